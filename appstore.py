@@ -14,6 +14,9 @@ import asyncio
 from aiohttp_socks import ProxyType, ProxyConnector, ChainProxyConnector
 from DataRecorder import Recorder
 import pandas as pd
+from cdx_lines import CDXLineReader
+from cdx_client import CDX_API_URL
+from cdx_query import archive_listing_scan
 
 # Constants
 PROXY_URL = None
@@ -27,20 +30,10 @@ RESULT_FOLDER = "./result"
 OUTPUT_FOLDER = "./output"
 
 # Helper Functions
-def process_line(csv_file, lines):
-    """Process and save lines to CSV."""
-    
-    # Create file and write header if it doesn't exist
-      
-    for line in lines:
-        try:
-            line = line.strip()
-            if ' ' in line:
-                timestamp, original_url = line.split(' ')
-                data = {'timestamp': timestamp, 'url': original_url}
-                csv_file.add_data(data)
-        except Exception as e:
-            print(f"Failed to process line: {line}, Error: {e}")
+def process_line(csv_file, captures):
+    """Save (timestamp, original) captures to CSV."""
+    for timestamp, original_url in captures:
+        csv_file.add_data({'timestamp': timestamp, 'url': original_url})
 
 
 async def get_urls_from_archive(domain, start, end):
@@ -56,10 +49,8 @@ async def get_urls_from_archive(domain, start, end):
     if not os.path.exists(csv_filepath):
         csv_file.add_data(fieldnames)
 
-    query_url = f"http://web.archive.org/cdx/search/cdx?url={domain}/&fl=timestamp,original"
-    # filter = f"&statuscode=200&from={start}&to={end}" if end else f"&statuscode=200&from={start}"
-    query_url += "&collapse=urlkey"
-    query_url=query_url+'&matchType=prefix'
+    query = archive_listing_scan(domain)
+    query_url = f"{CDX_API_URL}?{query.query_string()}"
 
     headers = {
         'Referer': 'https://web.archive.org/',
@@ -75,24 +66,10 @@ async def get_urls_from_archive(domain, start, end):
                     print(f"Received status code {resp.status}.")
                     return
 
-                count = 0
-                buffer = bytearray()
-                while True:
-                    chunk = await resp.content.read(1024)
-                    if not chunk:
-                        if buffer:
-                            process_line(csv_file, [buffer.decode('utf-8', 'replace')])
-                        break
-                    buffer.extend(chunk)
-                    raw = buffer.decode('utf-8', 'replace')
-                    lines = raw.splitlines(True)
-
-                    for line in lines[:-1]:
-                        process_line(csv_file, [line])
-                    buffer = bytearray(lines[-1], 'utf-8')
-
-                    count += len(lines)
-                    print(f"Processed {count} lines so far...")
+                captures = CDXLineReader(resp.content)
+                async for batch in captures.batches():
+                    process_line(csv_file, batch)
+                    print(f"Processed {captures.captures} lines so far...")
 
     except Exception as e:
         print(f"Error fetching data: {e}")
@@ -0,0 +1,110 @@
+import time
+import asyncio
+import argparse
+import tempfile
+from cdx_client import CDXClient
+from cdx_server import LocalCDX, start_server
+from http_cache import ResponseCache
+
+
+async def serial_scan(api_url, params, chunk_size):
+    """The collect_data_wayback path: resumeKey chunks, one after another"""
+    rows = []
+    async with CDXClient(api_url=api_url, cache=False, limiter=False) as cdx:
+        async for page_rows, _ in cdx.iter_pages(dict(params, limit=chunk_size)):
+            rows.extend(page_rows)
+        return rows, cdx.pages
+
+
+async def sharded_scan(api_url, params, concurrency):
+    """showNumPages, then page= slices fetched concurrently and merged in page order"""
+    rows = []
+    async with CDXClient(api_url=api_url, concurrency=concurrency, cache=False, limiter=False) as cdx:
+        async for _, page_rows, _ in cdx.iter_shards(params):
+            rows.extend(page_rows)
+        return rows, cdx.pages
+
+
+async def transfer_scan(api_url, params, fields, cache=False):
+    """Sharded scan with either full JSON rows (fields=None) or fl= projected tuples; returns rows and the client"""
+    rows = []
+    async with CDXClient(api_url=api_url, fields=fields, cache=cache, limiter=False) as cdx:
+        async for _, page_rows, _ in cdx.iter_shards(params):
+            rows.extend(page_rows)
+        return rows, cdx
+
+
+async def run(args):
+    local_cdx = LocalCDX(args.rows, args.page_rows, args.latency_ms, args.row_us)
+    runner, api_url = await start_server(local_cdx, port=args.port)
+    params = {'url': 'example.com/tag/', 'matchType': 'prefix', 'filter': ['statuscode:200', 'mimetype:text/html']}
+    try:
+        started = time.monotonic()
+        serial_rows, serial_requests = await serial_scan(api_url, params, args.chunk_size)
+        serial_elapsed = time.monotonic() - started
+
+        results = []
+        for concurrency in args.concurrency:
+            started = time.monotonic()
+            sharded_rows, sharded_requests = await sharded_scan(api_url, params, concurrency)
+            results.append((concurrency, sharded_rows, sharded_requests, time.monotonic() - started))
+
+        transfers = []
+        for fields in [None, ('timestamp', 'original')]:
+            transfers.append(await transfer_scan(api_url, params, fields))
+
+        # The same projected scan twice through an empty on-disk cache: the rerun never touches the server
+        cache_dir = tempfile.TemporaryDirectory()
+        cache = ResponseCache(cache_dir.name)
+        cached = []
+        for label in ['cold cache', 'warm cache']:
+            requests_before = local_cdx.requests
+            started = time.monotonic()
+            rows, _ = await transfer_scan(api_url, params, ('timestamp', 'original'), cache)
+            cached.append((label, rows, local_cdx.requests - requests_before, time.monotonic() - started))
+    finally:
+        await runner.cleanup()
+
+    print(f"\n[INFO] CDX scan of {args.rows} captures (latency {args.latency_ms} ms + {args.row_us} us/row, "
+          f"{args.page_rows} captures per page)")
+    local_cdx.report()
+    print(f"  - serial resumeKey, {args.chunk_size}-row chunks: {len(serial_rows)} rows, "
+          f"{serial_requests} requests in {serial_elapsed:.2f}s")
+    for concurrency, sharded_rows, sharded_requests, elapsed in results:
+        same = [row['urlkey'] for row in sharded_rows] == [row['urlkey'] for row in serial_rows]
+        print(f"  - sharded page=, {concurrency} in flight: {len(sharded_rows)} rows, {sharded_requests} requests "
+              f"in {elapsed:.2f}s, {serial_elapsed / elapsed:.1f}x speedup, same ordered rows: {same}")
+
+    print("\n[INFO] Transfer per 100k rows, today's JSON path against fl= projection with gzip")
+    json_rows = [(row['timestamp'], row['original']) for row in transfers[0][0]]
+    for rows, cdx in transfers:
+        per_100k = 100000 / len(rows) if rows else 0
+        same = (rows if cdx.fields else json_rows) == json_rows
+        shape = f"fl={','.join(cdx.fields)} tuples" if cdx.fields else 'full JSON rows'
+        print(f"  - {shape}: {cdx.bytes_transferred * per_100k / 1e6:.2f} MB on the wire "
+              f"({cdx.bytes_decoded * per_100k / 1e6:.2f} MB decoded), "
+              f"parse {cdx.parse_seconds * 1000 * per_100k:.0f} ms, same timestamps and URLs: {same}")
+
+    print(f"\n[INFO] Projected scan through the on-disk response cache ({cache.codec})")
+    for label, rows, requests, elapsed in cached:
+        print(f"  - {label}: {len(rows)} rows, {requests} server requests in {elapsed:.2f}s, "
+              f"same rows: {rows == cached[0][1]}")
+    cache.report()
+    cache.close()
+    cache_dir.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare serial resumeKey paging with page-sharded CDX fetching, and JSON rows with fl= tuples, on cdx_server.py.')
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--page_rows', type=int, default=5000, help='Captures per page= slice')
+    parser.add_argument('--chunk_size', type=int, default=5000, help='limit= for the serial path')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[2, 4, 8])
+    parser.add_argument('--latency_ms', type=float, default=100)
+    parser.add_argument('--row_us', type=float, default=20)
+    parser.add_argument('--port', type=int, default=8791)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import os
+import time
+import asyncio
+import argparse
+import tempfile
+import tracemalloc
+from cdx_lines import CDX_READ_CHUNK, CDXLineReader
+
+
+class FileStream:
+    """A local file behind the awaitable read(n) interface of aiohttp's response.content"""
+
+    def __init__(self, path):
+        self.f = open(path, 'rb')
+
+    async def read(self, n=-1):
+        return self.f.read(n)
+
+    def close(self):
+        self.f.close()
+
+
+def write_fixture(path, rows):
+    """Synthetic "timestamp original" CDX body, with some non-ASCII URLs to exercise chunk boundaries"""
+    with open(path, 'w', encoding='utf8') as f:
+        for i in range(rows):
+            tag = f"标签{i}" if i % 5 == 0 else f"t{i:08d}"
+            f.write(f"2024{1 + i % 12:02d}{1 + i % 28:02d}{i % 24:02d}0000 https://www.tiktok.com/tag/{tag}?lang=en\n")
+    return os.path.getsize(path)
+
+
+async def read_whole_body(stream):
+    """The old main.py/save.py path: resp.text() then splitlines()"""
+    chunks = []
+    while True:
+        chunk = await stream.read(CDX_READ_CHUNK)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    count = 0
+    for line in b''.join(chunks).decode('utf-8').splitlines():
+        parts = line.strip().split(' ')
+        if len(parts) >= 2:
+            count += 1
+    return count
+
+
+async def read_redecoding(stream):
+    """The old appstore.py path: 1 KB reads, decoding and re-encoding the buffer on every chunk"""
+    count = 0
+    buffer = bytearray()
+    while True:
+        chunk = await stream.read(1024)
+        if not chunk:
+            if buffer:
+                count += 1
+            break
+        buffer.extend(chunk)
+        lines = buffer.decode('utf-8', 'replace').splitlines(True)
+        for line in lines[:-1]:
+            parts = line.strip().split(' ')
+            if len(parts) >= 2:
+                count += 1
+        buffer = bytearray(lines[-1], 'utf-8')
+    return count
+
+
+async def read_streaming(stream):
+    """cdx_lines.CDXLineReader one capture at a time, as run_pipeline consumes it"""
+    count = 0
+    async for _ in CDXLineReader(stream):
+        count += 1
+    return count
+
+
+async def read_streaming_batches(stream):
+    """cdx_lines.CDXLineReader.batches(), one list of captures per chunk"""
+    count = 0
+    async for captures in CDXLineReader(stream).batches():
+        count += len(captures)
+    return count
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'cdx.txt')
+        size = write_fixture(path, args.rows)
+        print(f"[INFO] CDX fixture: {args.rows} lines, {size / 1e6:.1f} MB")
+        for label, reader in [('whole body + splitlines', read_whole_body),
+                              ('1 KB chunks, re-decoded buffer', read_redecoding),
+                              (f'CDXLineReader, {CDX_READ_CHUNK // 1024} KB chunks', read_streaming),
+                              (f'CDXLineReader.batches(), {CDX_READ_CHUNK // 1024} KB chunks', read_streaming_batches)]:
+            stream = FileStream(path)
+            started = time.monotonic()
+            try:
+                count = await reader(stream)
+            finally:
+                elapsed = time.monotonic() - started
+                stream.close()
+            # A second pass under tracemalloc for peak memory; tracing would distort the timing above
+            stream = FileStream(path)
+            tracemalloc.start()
+            try:
+                await reader(stream)
+            finally:
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                stream.close()
+            print(f"  - {label}: {count} captures in {elapsed:.2f}s "
+                  f"({size / 1e6 / elapsed:.1f} MB/s), peak memory {peak / 1e6:.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare CDX body readers on a large local fixture.')
+    parser.add_argument('--rows', type=int, default=2000000, help='Lines in the fixture')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
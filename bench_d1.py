@@ -0,0 +1,95 @@
+import os
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import importlib
+from d1_server import LocalD1, start_server
+
+
+def seller_lines(count, offset=0):
+    """Synthetic (timestamp, original) CDX captures, one per seller id"""
+    return [('20240101000000', f"https://www.amazon.com/sp?ie=UTF8&seller=S{i:010d}&tab=feedback")
+            for i in range(offset, offset + count)]
+
+
+async def bench_main(rows):
+    """Time main.py's CDX line -> D1 path: a cold run, then a rerun over the same lines plus 10% new ones"""
+    main = importlib.import_module('main')
+    from d1_client import D1Client
+    results = []
+    async with D1Client() as d1:
+        await main.create_table(d1)
+        for label, lines in [('cold', seller_lines(rows)), ('rerun', seller_lines(rows + rows // 10))]:
+            started = time.monotonic()
+            writer = await main.save_lines(lines, d1)
+            elapsed = time.monotonic() - started
+            results.append((f"main.py {label}", len(lines), writer.rows_inserted, elapsed))
+    return results
+
+
+async def bench_replicate(models, changed):
+    """Time replicate.py's stage -> D1 sync path: a first sync, then one where only `changed` of the models moved"""
+    try:
+        replicate = importlib.import_module('replicate')
+    except ImportError as e:
+        print(f"[WARNING] Skipping replicate.py benchmark: {e}")
+        return []
+    results = []
+    async with replicate.d1:
+        await replicate.create_table_if_not_exists()
+        counts = {f"https://replicate.com/bench/model-{i}": random.randint(0, 10 ** 6) for i in range(models)}
+        for label in ['first sync', 'delta sync']:
+            if label == 'delta sync':
+                for url in random.sample(list(counts), int(models * changed)):
+                    counts[url] += 1
+            stage = replicate.ModelStage('replicate_model_data')
+            started = time.monotonic()
+            for url, run_count in counts.items():
+                stage.stage(url, run_count=run_count)
+            pushed = await stage.sync(replicate.d1, replicate.build_upsert_statement)
+            elapsed = time.monotonic() - started
+            stage.close()
+            results.append((f"replicate.py {label}", models, pushed, elapsed))
+    return results
+
+
+async def run(args):
+    local_d1 = LocalD1(':memory:', args.latency_ms, args.jitter_ms, args.rate_limit, args.throttle_rate)
+    runner, api_base_url = await start_server(local_d1, port=args.port)
+    # The scripts build their D1 clients from the environment, so point them at the local server before import
+    os.environ['CLOUDFLARE_API_BASE_URL'] = api_base_url
+    os.environ.setdefault('CLOUDFLARE_API_TOKEN', 'bench')
+    os.environ.setdefault('CLOUDFLARE_ACCOUNT_ID', 'bench')
+    os.environ.setdefault('CLOUDFLARE_D1_DATABASE_ID', 'bench')
+    os.environ['STAGE_DIR'] = tempfile.mkdtemp(prefix='bench_d1_')
+    try:
+        results = await bench_main(args.rows)
+        results += await bench_replicate(args.models, args.changed)
+    finally:
+        await runner.cleanup()
+
+    print(f"\n[INFO] Benchmark against local D1 (latency {args.latency_ms} ms, jitter {args.jitter_ms} ms, "
+          f"rate limit {args.rate_limit or 'off'} req/s, throttle rate {args.throttle_rate})")
+    local_d1.report()
+    for label, total, written, elapsed in results:
+        rate = total / elapsed if elapsed > 0 else 0.0
+        print(f"  - {label}: {total} rows in {elapsed:.2f}s ({rate:.1f} rows/sec), {written} written")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the D1 write paths of main.py and replicate.py against d1_server.py.')
+    parser.add_argument('--rows', type=int, default=20000, help='CDX lines for main.py')
+    parser.add_argument('--models', type=int, default=2000, help='Models for replicate.py')
+    parser.add_argument('--changed', type=float, default=0.1, help='Share of models whose run count moves between syncs')
+    parser.add_argument('--port', type=int, default=8788)
+    parser.add_argument('--latency_ms', type=float, default=30, help='Injected per-request latency')
+    parser.add_argument('--jitter_ms', type=float, default=10)
+    parser.add_argument('--rate_limit', type=float, default=0, help='Requests per second before 429 (0 = off)')
+    parser.add_argument('--throttle_rate', type=float, default=0, help='Share of requests answered with 429')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
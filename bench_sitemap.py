@@ -0,0 +1,100 @@
+import os
+import gzip
+import time
+import argparse
+import tempfile
+import tracemalloc
+import warnings
+from bs4 import BeautifulSoup, FeatureNotFound, XMLParsedAsHTMLWarning
+from sitemap import SITEMAP_READ_CHUNK, SitemapParser
+
+
+def write_fixture(path, rows):
+    """Synthetic urlset shaped like replicate.com's sitemap-versions.xml: one <url> with loc and lastmod per entry"""
+    with open(path, 'w', encoding='utf8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write('<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+        for i in range(rows):
+            f.write(f"<url>\n<loc>https://replicate.com/owner{i % 997}/model-{i:08d}/versions/{i * 7919:040x}</loc>\n"
+                    f"<lastmod>2025-{1 + i % 12:02d}-{1 + i % 28:02d}T{i % 24:02d}:40:39.517995+00:00</lastmod>\n</url>\n")
+        f.write('</urlset>\n')
+    with open(path, 'rb') as f, gzip.open(path + '.gz', 'wb') as out:
+        out.write(f.read())
+    return os.path.getsize(path), os.path.getsize(path + '.gz')
+
+
+def parse_soup(path, features):
+    """The old parse_sitemap path: the whole body as text, a full BeautifulSoup tree, then find_all('loc')"""
+    with open(path, encoding='utf8') as f:
+        text = f.read()
+    soup = BeautifulSoup(text, features)
+    return len([loc.text for loc in soup.find_all('loc')])
+
+
+def parse_streaming(path):
+    """sitemap.SitemapParser fed fixed-size chunks, as iter_sitemap feeds it the response"""
+    parser = SitemapParser()
+    count = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(SITEMAP_READ_CHUNK)
+            if not chunk:
+                break
+            count += len(parser.feed(chunk))
+    return count + len(parser.close())
+
+
+def soup_features():
+    # The scrapers ask for "xml", which needs lxml; fall back to the stdlib HTML parser so the bench still runs
+    try:
+        BeautifulSoup('<a/>', 'xml')
+        return 'xml'
+    except FeatureNotFound:
+        print("[WARNING] lxml is not installed, BeautifulSoup runs with html.parser instead of xml")
+        warnings.filterwarnings('ignore', category=XMLParsedAsHTMLWarning)
+        return 'html.parser'
+
+
+def measure(label, size, parse, *args):
+    started = time.monotonic()
+    count = parse(*args)
+    elapsed = time.monotonic() - started
+    # A second pass under tracemalloc for peak memory; tracing would distort the timing above
+    tracemalloc.start()
+    try:
+        parse(*args)
+    finally:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    print(f"  - {label}: {count} locs in {elapsed:.2f}s ({size / 1e6 / elapsed:.1f} MB/s), peak memory {peak / 1e6:.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the BeautifulSoup and streaming sitemap parsers.')
+    parser.add_argument('--rows', type=int, default=200000, help='<url> entries in the synthetic fixture')
+    args = parser.parse_args()
+
+    # The checked-in sitemap index must parse to the same locs either way
+    here = os.path.dirname(os.path.abspath(__file__))
+    features = soup_features()
+    index = os.path.join(here, 'replicate.xml')
+    if os.path.exists(index):
+        with open(index, encoding='utf8') as f:
+            expected = [loc.text for loc in BeautifulSoup(f.read(), features).find_all('loc')]
+        sitemap_parser = SitemapParser()
+        with open(index, 'rb') as f:
+            entries = sitemap_parser.feed(f.read()) + sitemap_parser.close()
+        same = [loc for loc, _ in entries] == expected
+        print(f"[INFO] replicate.xml: {len(entries)} sitemaps, {'same' if same else 'DIFFERENT'} locs as BeautifulSoup")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'sitemap.xml')
+        size, gz_size = write_fixture(path, args.rows)
+        print(f"[INFO] Sitemap fixture: {args.rows} entries, {size / 1e6:.1f} MB ({gz_size / 1e6:.1f} MB gzipped)")
+        measure(f'BeautifulSoup({features!r}) on the whole body', size, parse_soup, path, features)
+        measure(f'SitemapParser, {SITEMAP_READ_CHUNK // 1024} KB chunks', size, parse_streaming, path)
+        measure(f'SitemapParser on .xml.gz, {SITEMAP_READ_CHUNK // 1024} KB chunks', size, parse_streaming, path + '.gz')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+import os
+import json
+import asyncio
+import datetime
+import itertools
+import aiohttp
+from cdx_client import RETRY_STATUSES
+from http_cache import default_cache
+from rate_limit import default_rate_limiter, paced
+from cdx_lines import CDX_READ_CHUNK, LineSplitter
+
+CC_INDEX_SERVER = os.getenv('CC_INDEX_SERVER', 'https://index.commoncrawl.org')
+# Crawl collections to search, e.g. CC-MAIN-2024-40,CC-MAIN-2024-33; empty means discover them from collinfo.json
+CC_INDEXES = [name.strip() for name in os.getenv('CC_INDEXES', '').split(',') if name.strip()]
+CC_TIMEOUT = float(os.getenv('CC_TIMEOUT', '60'))
+CC_RETRIES = int(os.getenv('CC_RETRIES', '5'))
+# index.commoncrawl.org answers 503 quickly when pushed, so keep few requests in flight across all crawls
+CC_CONCURRENCY = int(os.getenv('CC_CONCURRENCY', '2'))
+# A crawl without from/to in collinfo.json is assumed to span this many days from the Monday of its week
+CC_CRAWL_DAYS = int(os.getenv('CC_CRAWL_DAYS', '14'))
+
+
+def crawl_window(collection):
+    """(from, to) of a collinfo.json entry as YYYYMMDDhhmmss strings"""
+    if collection.get('from') and collection.get('to'):
+        return tuple(''.join(ch for ch in collection[key] if ch.isdigit())[:14].ljust(14, '0') for key in ('from', 'to'))
+    # Older entries only carry the id, e.g. CC-MAIN-2019-35 for a crawl that started in week 35 of 2019
+    try:
+        _, _, year, week = collection['id'].split('-')
+        start = datetime.datetime.strptime(f"{year}-{week}-1", '%G-%V-%u')
+    except (KeyError, ValueError):
+        return None
+    end = start + datetime.timedelta(days=CC_CRAWL_DAYS)
+    return start.strftime('%Y%m%d%H%M%S'), end.strftime('%Y%m%d%H%M%S')
+
+
+class CCIndexError(Exception):
+    pass
+
+
+class CCIndexClient:
+    """Async client for the Common Crawl index server (a pywb CDX API with one collection per crawl)"""
+
+    def __init__(self, session=None, server=CC_INDEX_SERVER, indexes=None, retries=CC_RETRIES, timeout=CC_TIMEOUT,
+                 concurrency=CC_CONCURRENCY, cache=None, limiter=None):
+        self.server = server.rstrip('/')
+        self.indexes = list(indexes or CC_INDEXES)
+        self.collections = None
+        self.retries = retries
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.concurrency = concurrency
+        self.semaphore = None
+        self.session = session
+        self.owns_session = session is None
+        # A published crawl never changes, so its answers are cached as closed windows
+        self.cache = default_cache() if cache is None else cache
+        # index.commoncrawl.org is paced by its own adaptive bucket on top of the concurrency cap
+        self.limiter = default_rate_limiter() if limiter is None else limiter
+        self.requests = 0
+        # (index, page) pairs that gave up; page is None for a crawl whose page count could not be read
+        self.failed_pages = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def _ensure_session(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(timeout=self.timeout)
+            self.owns_session = True
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        return self.session
+
+    def index_url(self, index):
+        return f"{self.server}/{index}-index"
+
+    async def list_collections(self):
+        """Every crawl the index server knows, from collinfo.json (newest first)"""
+        if self.collections is None:
+            session = self._ensure_session()
+            url = f"{self.server}/collinfo.json"
+            body = self.cache.get(url) if self.cache else None
+            if body is None:
+                async with paced(session, 'GET', url, limiter=self.limiter, timeout=self.timeout) as response:
+                    self.requests += 1
+                    if response.status != 200:
+                        raise CCIndexError(f"collinfo.json returned HTTP {response.status}")
+                    body = await response.read()
+                if self.cache:
+                    # New crawls get published, so the list is only trusted for the short TTL
+                    self.cache.put(url, body, closed=False)
+            self.collections = json.loads(body)
+        return self.collections
+
+    async def indexes_between(self, start=None, end=None):
+        """Ids of the crawls whose capture window overlaps start..end (CDX timestamps, either may be None)"""
+        if self.indexes:
+            return self.indexes
+        start = str(start or '').ljust(14, '0')
+        end = str(end or '').ljust(14, '9')
+        selected = []
+        for collection in await self.list_collections():
+            window = crawl_window(collection)
+            if window and window[0] <= end and window[1] >= start:
+                selected.append(collection['id'])
+        print(f"✓ {len(selected)} Common Crawl indexes overlap {start[:8]} to {end[:8]}")
+        return selected
+
+    async def _get(self, index, params, json_lines=True):
+        """GET one index query with retries; JSON-lines bodies come back as row dicts, others as text"""
+        session = self._ensure_session()
+        url = self.index_url(index)
+        label = f"{index} page {params['page']}" if 'page' in params else index
+        if self.cache:
+            body = self.cache.get(url, params)
+            if body is not None:
+                return self.parse_block(body) if json_lines else body.decode('utf-8', 'replace')
+        for attempt in range(self.retries):
+            try:
+                async with self.semaphore:
+                    async with paced(session, 'GET', url, limiter=self.limiter, params=params, timeout=self.timeout) as response:
+                        self.requests += 1
+                        # A 404 is the index server's way of saying there are no captures
+                        if response.status in (200, 404):
+                            if response.status == 404:
+                                body, result = b'', [] if json_lines else ''
+                            elif json_lines:
+                                body, result = await self._read_rows(response)
+                            else:
+                                body = await response.read()
+                                result = body.decode('utf-8', 'replace')
+                            if self.cache:
+                                self.cache.put(url, body, params, closed=True)
+                            return result
+                        if response.status not in RETRY_STATUSES:
+                            raise CCIndexError(f"{label} returned HTTP {response.status}")
+                        print(f"⚠ {label} returned HTTP {response.status}, attempt {attempt + 1}/{self.retries}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"⚠ {label} request failed on attempt {attempt + 1}/{self.retries}: {e}")
+            if attempt < self.retries - 1:
+                await asyncio.sleep(2 ** attempt)
+        raise CCIndexError(f"Failed to query {label} after {self.retries} attempts")
+
+    async def _read_rows(self, response):
+        """Decode JSON lines chunk by chunk as the body arrives; returns the raw body (for the cache) and the rows"""
+        splitter = LineSplitter()
+        chunks = []
+        rows = []
+        async for chunk in response.content.iter_chunked(CDX_READ_CHUNK):
+            if self.cache:
+                chunks.append(chunk)
+            rows.extend(self.parse_block(splitter.feed(chunk)))
+        rows.extend(self.parse_block(splitter.close()))
+        return b''.join(chunks), rows
+
+    @staticmethod
+    def parse_block(block):
+        """Complete JSON lines as dicts; lines that fail to parse are skipped"""
+        rows = []
+        for line in block.decode('utf-8', 'replace').split('\n'):
+            line = line.strip()
+            if line:
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    continue
+        return rows
+
+    async def num_pages(self, index, query):
+        """Number of pages the index server splits a query into"""
+        text = await self._get(index, dict(query, showNumPages='true'), json_lines=False)
+        if not text.strip():
+            return 0
+        # output=json answers {"pages": N, "pageSize": ..., "blocks": ...}; plain output is just the number
+        info = json.loads(text)
+        return int(info['pages'] if isinstance(info, dict) else info)
+
+    async def fetch_page(self, index, query, page):
+        """One page of a query as row dicts, retried on its own if it fails"""
+        return await self._get(index, dict(query, page=page))
+
+    async def iter_pages(self, indexes, query):
+        """Yield (index, page, rows) as pages complete, with every page of every crawl in flight under the shared cap"""
+        async def count(index):
+            try:
+                return await self.num_pages(index, query)
+            except (CCIndexError, ValueError) as e:
+                # One crawl that cannot be sized is skipped, the others are still queried
+                print(f"✗ Skipping {index}, could not count its pages: {e}")
+                self.failed_pages.append((index, None))
+                return 0
+
+        totals = await asyncio.gather(*(count(index) for index in indexes))
+        print(f"✓ Query spans {sum(totals)} index pages across {len(indexes)} crawls")
+
+        async def fetch(index, page):
+            try:
+                return index, page, await self.fetch_page(index, query, page)
+            except CCIndexError as e:
+                # One page giving up does not cost the pages already fetched
+                print(f"✗ Giving up on page {page} of {index}: {e}")
+                self.failed_pages.append((index, page))
+                return index, page, []
+
+        jobs = ((index, page) for index, total in zip(indexes, totals) for page in range(total))
+        # Keep a bounded window of pages in flight, so pages the caller has not taken yet never pile up in memory
+        window = self.concurrency * 2
+        pending = set()
+        try:
+            while True:
+                for index, page in itertools.islice(jobs, window - len(pending)):
+                    pending.add(asyncio.ensure_future(fetch(index, page)))
+                if not pending:
+                    break
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def query_params(self, url, match_type='prefix', fields=('timestamp', 'url'), **params):
+        return dict(params, url=url, matchType=match_type, output='json', fl=','.join(fields))
+
+    async def query(self, index, url, match_type='prefix', fields=('timestamp', 'url'), **params):
+        """Captures of url in one crawl as dicts of the requested fields, all pages"""
+        rows = []
+        async for _, _, page_rows in self.iter_pages([index], self.query_params(url, match_type, fields, **params)):
+            rows.extend(page_rows)
+        return rows
+
+    async def iter_captures(self, url, start=None, end=None, **params):
+        """Yield capture rows under url from every crawl overlapping start..end as their pages land, unmerged"""
+        indexes = await self.indexes_between(start, end)
+        if start:
+            params['from'] = start
+        if end:
+            params['to'] = end
+        failed_before = len(self.failed_pages)
+        async for _, _, rows in self.iter_pages(indexes, self.query_params(url, **params)):
+            for row in rows:
+                yield row
+        failed = self.failed_pages[failed_before:]
+        crawls = sum(1 for _, page in failed if page is None)
+        if crawls:
+            print(f"⚠ {crawls} crawls could not be sized and are missing")
+        if len(failed) > crawls:
+            print(f"⚠ {len(failed) - crawls} index pages failed after {self.retries} attempts and are missing")
+
+    async def earliest_by_url(self, url, start=None, end=None, **params):
+        """Captures under url in every crawl overlapping start..end, one row per URL with its earliest timestamp"""
+        merged = {}
+        # Rows are merged as they land, so only the per-URL minimum is ever held
+        async for row in self.iter_captures(url, start, end, **params):
+            key = row.get('url')
+            if key and (key not in merged or row.get('timestamp', '') < merged[key].get('timestamp', '')):
+                merged[key] = row
+        return merged
+
+    async def first_seen(self, url, start=None, end=None):
+        """Earliest capture timestamp of url (and the pages under it) across the crawls, or None"""
+        merged = await self.earliest_by_url(url, start, end, filter='status:200')
+        timestamps = [row['timestamp'] for row in merged.values() if row.get('timestamp')]
+        return min(timestamps) if timestamps else None
+
+    async def close(self):
+        if self.owns_session and self.session is not None and not self.session.closed:
+            await self.session.close()
@@ -0,0 +1,249 @@
+import os
+import json
+import time
+import zlib
+import asyncio
+import aiohttp
+from http_cache import default_cache
+from proxy_pool import default_proxy_pool
+from rate_limit import default_rate_limiter, paced
+
+CDX_API_URL = os.getenv('CDX_API_URL', 'http://web.archive.org/cdx/search/cdx')
+CDX_TIMEOUT = float(os.getenv('CDX_TIMEOUT', '60'))
+CDX_RETRIES = int(os.getenv('CDX_RETRIES', '5'))
+# Most page= requests a client keeps in flight against its CDX host
+CDX_HOST_CONCURRENCY = int(os.getenv('CDX_HOST_CONCURRENCY', '4'))
+
+# Statuses worth retrying: rate limiting and transient server errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CDXError(Exception):
+    pass
+
+
+class CDXClient:
+    """Async Wayback CDX client that pages with showResumeKey and prefetches the next page while the current one is consumed"""
+
+    def __init__(self, session=None, api_url=None, retries=CDX_RETRIES, timeout=CDX_TIMEOUT, sleep=0,
+                 concurrency=CDX_HOST_CONCURRENCY, fields=None, cache=None, proxies=None, limiter=None):
+        self.api_url = api_url or CDX_API_URL
+        # Responses are served from the on-disk cache when fresh; pass cache=False to always hit the server
+        self.cache = default_cache() if cache is None else cache
+        # Requests spread over the egresses of a ProxyPool when one is configured; pass proxies=False to go direct
+        self.proxies = default_proxy_pool() if proxies is None else proxies
+        # Requests wait for the CDX host's adaptive token bucket; pass limiter=False to send unpaced
+        self.limiter = default_rate_limiter() if limiter is None else limiter
+        # With fields set, only those columns are requested (fl=) and rows come back as tuples in that order;
+        # without, rows are dicts of the full JSON row
+        self.fields = tuple(fields) if fields else None
+        self.retries = retries
+        self.concurrency = concurrency
+        self.semaphore = None
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        # Extra pause between resumeKey pages, on top of the host's adaptive rate limit
+        self.sleep = sleep
+        self.session = session
+        self.owns_session = session is None
+        self.pages = 0
+        self.prefetches = set()
+        self.rows = 0
+        self.bytes_transferred = 0
+        self.bytes_decoded = 0
+        self.parse_seconds = 0.0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def _ensure_session(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(timeout=self.timeout)
+            self.owns_session = True
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        return self.session
+
+    async def _get(self, query, parse):
+        """GET the CDX API with retries and return parse(body text)"""
+        session = self._ensure_session()
+        # A list value (e.g. several filters) becomes a repeated query parameter
+        query = [(key, item) for key, value in query.items()
+                 for item in (value if isinstance(value, (list, tuple)) else [value])]
+        if self.cache:
+            body = self.cache.get(self.api_url, query)
+            if body is not None:
+                self.pages += 1
+                return self._parse_body(body, parse)
+        for attempt in range(self.retries):
+            try:
+                async with self.semaphore:
+                    # Decompress here rather than in aiohttp so the bytes on the wire can be counted
+                    # Each attempt picks an egress afresh and a failed one loses weight, so retries drift off a blocked proxy
+                    async with paced(session, 'GET', self.api_url, limiter=self.limiter, pool=self.proxies or False,
+                                     params=query, timeout=self.timeout, headers={'Accept-Encoding': 'gzip'},
+                                     auto_decompress=False) as response:
+                        if response.status == 200:
+                            body = self._decode(await response.read(), response.headers.get('Content-Encoding', ''))
+                            self.pages += 1
+                            result = self._parse_body(body, parse)
+                            if self.cache:
+                                self.cache.put(self.api_url, body, query)
+                            return result
+                        if response.status not in RETRY_STATUSES:
+                            raise CDXError(f"CDX server returned HTTP {response.status}")
+                        print(f"⚠ CDX server returned HTTP {response.status}, attempt {attempt + 1}/{self.retries}")
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, zlib.error) as e:
+                # zlib.error is a truncated or corrupt gzip body, which a fresh attempt usually fixes
+                print(f"⚠ CDX request failed on attempt {attempt + 1}/{self.retries}: {e}")
+            if attempt < self.retries - 1:
+                await asyncio.sleep(2 ** attempt)
+        raise CDXError(f"Failed to fetch CDX page after {self.retries} attempts")
+
+    def _decode(self, body, encoding):
+        self.bytes_transferred += len(body)
+        if encoding in ('gzip', 'deflate'):
+            # wbits 47 accepts both gzip and zlib framing
+            body = zlib.decompress(body, 47)
+        return body
+
+    def _parse_body(self, body, parse):
+        self.bytes_decoded += len(body)
+        started = time.perf_counter()
+        result = parse(body.decode('utf-8', 'replace'))
+        self.parse_seconds += time.perf_counter() - started
+        if isinstance(result, tuple):
+            self.rows += len(result[0])
+        return result
+
+    def _page_query(self, params):
+        query = dict(params)
+        if self.fields:
+            query['fl'] = ','.join(self.fields)
+        else:
+            query['output'] = 'json'
+        return query
+
+    def _page_parser(self):
+        return self.parse_text_page if self.fields else self.parse_page
+
+    def parse_text_page(self, text):
+        """Parse a plain-text fl= page into tuples; a resume key follows a blank line at the end"""
+        lines = text.rstrip('\n').split('\n')
+        resume_key = ''
+        if len(lines) >= 2 and lines[-2] == '':
+            resume_key = lines.pop()
+            lines.pop()
+        width = len(self.fields)
+        # Only the last field may contain spaces, so it takes the remainder of the line
+        rows = [tuple(row) for row in (line.split(' ', width - 1) for line in lines if line) if len(row) == width]
+        return rows, resume_key
+
+    async def fetch_page(self, params, resume_key=''):
+        """Fetch one page; returns (rows, resume key of the next page or '')"""
+        query = dict(self._page_query(params), showResumeKey='true')
+        if resume_key:
+            query['resumeKey'] = resume_key
+        return await self._get(query, self._page_parser())
+
+    async def num_pages(self, params):
+        """Number of page= slices the server splits the query into"""
+        query = {key: value for key, value in params.items() if key != 'limit'}
+        query['showNumPages'] = 'true'
+        return await self._get(query, lambda text: int(text.strip() or 0))
+
+    async def fetch_shard(self, params, page):
+        """Fetch one page= slice of the query as rows"""
+        query = self._page_query({key: value for key, value in params.items() if key != 'limit'})
+        query['page'] = page
+        rows, _ = await self._get(query, self._page_parser())
+        return rows
+
+    @staticmethod
+    def parse_page(text):
+        text = text.strip()
+        if not text:
+            return [], ''
+        page = json.loads(text)
+        if len(page) < 2:
+            return [], ''
+        header = page[0]
+        # With showResumeKey the page ends with an empty row and a one-element row holding the key
+        resume_key = page[-1][0] if len(page[-1]) == 1 else ''
+        rows = [dict(zip(header, row)) for row in page[1:] if len(row) == len(header)]
+        return rows, resume_key
+
+    async def _fetch_after_sleep(self, params, resume_key):
+        if self.sleep:
+            await asyncio.sleep(self.sleep)
+        return await self.fetch_page(params, resume_key)
+
+    async def iter_pages(self, params, resume_key='', max_pages=None):
+        """Yield (rows, next resume key) per page; the next page is already in flight while the caller works"""
+        next_page = self._prefetch(self.fetch_page(params, resume_key))
+        pages = 0
+        try:
+            while next_page is not None:
+                rows, next_key = await next_page
+                next_page = None
+                pages += 1
+                if next_key and next_key != resume_key and (max_pages is None or pages < max_pages):
+                    next_page = self._prefetch(self._fetch_after_sleep(params, next_key))
+                if rows or next_key:
+                    yield rows, next_key
+                resume_key = next_key
+        finally:
+            if next_page is not None:
+                next_page.cancel()
+
+    def _prefetch(self, coro):
+        task = asyncio.ensure_future(coro)
+        self.prefetches.add(task)
+        task.add_done_callback(self.prefetches.discard)
+        return task
+
+    async def iter_shards(self, params, start_page=0):
+        """Yield (page number, rows, total pages) in page order, fetching up to `concurrency` page= slices at once"""
+        total = await self.num_pages(params)
+        print(f"✓ CDX query splits into {total} pages, fetching {self.concurrency} at a time")
+        # Keep a bounded window of slices in flight so a slow page never lets the rest pile up in memory
+        window = self.concurrency * 2
+        pending = {}
+        next_page = start_page
+        try:
+            for page in range(start_page, total):
+                while next_page < total and next_page < page + window:
+                    pending[next_page] = self._prefetch(self.fetch_shard(params, next_page))
+                    next_page += 1
+                yield page, await pending.pop(page), total
+        finally:
+            for task in pending.values():
+                task.cancel()
+
+    async def iter_rows(self, params, resume_key='', max_pages=None):
+        """Yield result rows one by one across pages"""
+        async for rows, _ in self.iter_pages(params, resume_key, max_pages):
+            for row in rows:
+                yield row
+
+    def report(self):
+        per_100k = self.parse_seconds * 1000 * 100000 / self.rows if self.rows else 0
+        shape = f"fl={','.join(self.fields)} tuples" if self.fields else 'full JSON rows'
+        print(f"✓ CDX client ({shape}): {self.pages} pages, {self.rows} rows, "
+              f"{self.bytes_transferred / 1024:.0f} KB transferred ({self.bytes_decoded / 1024:.0f} KB decoded), "
+              f"parse {per_100k:.0f} ms per 100k rows")
+        if self.cache:
+            self.cache.report()
+        if self.proxies:
+            self.proxies.report()
+        if self.limiter:
+            self.limiter.host(self.api_url).report()
+
+    async def close(self):
+        # A caller that stopped iterating early may leave a prefetched page in flight
+        for task in list(self.prefetches):
+            task.cancel()
+        if self.owns_session and self.session is not None and not self.session.closed:
+            await self.session.close()
@@ -0,0 +1,71 @@
+import os
+
+# Bytes read off the response per step; memory stays at one chunk plus one partial line
+CDX_READ_CHUNK = int(os.getenv('CDX_READ_CHUNK', '65536'))
+
+
+def parse_capture(line):
+    """Split one "timestamp original [...]" CDX line into a (timestamp, original) tuple, or None"""
+    parts = line.split(None, 2)
+    if len(parts) < 2:
+        return None
+    return parts[0], parts[1]
+
+
+class LineSplitter:
+    """Cut a stream of byte chunks into blocks of complete lines, carrying the partial last line to the next chunk"""
+
+    def __init__(self):
+        self.tail = b''
+
+    def feed(self, chunk):
+        end = chunk.rfind(b'\n')
+        if end < 0:
+            self.tail += chunk
+            return b''
+        block = self.tail + chunk[:end]
+        self.tail = chunk[end + 1:]
+        return block
+
+    def close(self):
+        tail, self.tail = self.tail, b''
+        return tail
+
+
+class CDXLineReader:
+    """Async iterator of (timestamp, original) captures read off a CDX text body in constant memory"""
+
+    def __init__(self, stream, chunk_size=CDX_READ_CHUNK):
+        # Anything with an awaitable read(n): an aiohttp response.content or an asyncio StreamReader
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.lines = 0
+        self.captures = 0
+        self.bytes = 0
+
+    def _parse_block(self, block):
+        # Blocks end on a line boundary, so one decode per chunk never splits a multi-byte character
+        lines = block.decode('utf-8', 'replace').split('\n')
+        captures = [capture for capture in map(parse_capture, lines) if capture is not None]
+        self.lines += len(lines)
+        self.captures += len(captures)
+        return captures
+
+    async def batches(self):
+        """Yield the captures of each chunk as one list; cheaper than awaiting the iterator once per line"""
+        splitter = LineSplitter()
+        while True:
+            chunk = await self.stream.read(self.chunk_size)
+            self.bytes += len(chunk)
+            block = splitter.feed(chunk) if chunk else splitter.close()
+            if block:
+                captures = self._parse_block(block)
+                if captures:
+                    yield captures
+            if not chunk:
+                break
+
+    async def __aiter__(self):
+        async for captures in self.batches():
+            for capture in captures:
+                yield capture
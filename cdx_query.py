@@ -0,0 +1,150 @@
+import re
+from urllib.parse import urlencode, urlparse, parse_qs, unquote
+
+# Fields the CDX server can filter, collapse and project on
+FIELDS = ('urlkey', 'timestamp', 'original', 'mimetype', 'statuscode', 'digest', 'length')
+MATCH_TYPES = ('exact', 'prefix', 'host', 'domain')
+# Filter operators: a regex is understood by every CDX server; '=' (exact) and '~' (contains) are pywb extensions
+OPERATORS = {'regex': '', 'exact': '=', 'contains': '~'}
+
+
+class CDXQuery:
+    """Builder for CDX server params, so filtering and collapsing happen on the server instead of after download"""
+
+    def __init__(self, url, match_type='prefix'):
+        if match_type not in MATCH_TYPES:
+            raise ValueError(f"Invalid matchType {match_type}. Choose from: {', '.join(MATCH_TYPES)}")
+        self.url = url
+        self.match_type = match_type
+        self.filters = []
+        self.collapses = []
+        self.start = None
+        self.end = None
+        self.fields = None
+        self.row_limit = None
+
+    def filter(self, field, value, negate=False, operator='regex'):
+        """Keep only captures whose field matches value (or does not, with negate)"""
+        self._check_field(field)
+        if operator not in OPERATORS:
+            raise ValueError(f"Invalid filter operator {operator}. Choose from: {', '.join(OPERATORS)}")
+        if operator == 'regex':
+            re.compile(value)
+        self.filters.append(f"{'!' if negate else ''}{OPERATORS[operator]}{field}:{value}")
+        return self
+
+    def status(self, code, negate=False):
+        return self.filter('statuscode', str(code), negate)
+
+    def mimetype(self, mimetype, negate=False):
+        return self.filter('mimetype', re.escape(mimetype), negate)
+
+    def urlkey(self, regex, negate=False):
+        return self.filter('urlkey', regex, negate)
+
+    def collapse(self, field, length=None):
+        """Drop adjacent captures that share field (or its first `length` characters, e.g. timestamp:8 for one per day)"""
+        self._check_field(field)
+        self.collapses.append(f"{field}:{length}" if length else field)
+        return self
+
+    def between(self, start=None, end=None):
+        """from/to as YYYYMMDDhhmmss timestamps or any prefix of one"""
+        for value in (start, end):
+            if value is not None and not re.fullmatch(r'\d{1,14}', str(value)):
+                raise ValueError(f"Invalid CDX timestamp {value}")
+        self.start, self.end = start, end
+        return self
+
+    def project(self, *fields):
+        """Only return these columns (fl=), in this order"""
+        for field in fields:
+            self._check_field(field)
+        self.fields = fields
+        return self
+
+    def limit(self, rows):
+        self.row_limit = rows
+        return self
+
+    def _check_field(self, field):
+        if field not in FIELDS:
+            raise ValueError(f"Invalid CDX field {field}. Choose from: {', '.join(FIELDS)}")
+
+    def params(self):
+        """The query as a params dict; repeated filters and collapses are lists, as CDXClient expects"""
+        params = {'url': self.url, 'matchType': self.match_type}
+        if self.filters:
+            params['filter'] = list(self.filters)
+        if self.collapses:
+            params['collapse'] = list(self.collapses)
+        if self.start is not None:
+            params['from'] = str(self.start)
+        if self.end is not None:
+            params['to'] = str(self.end)
+        if self.fields:
+            params['fl'] = ','.join(self.fields)
+        if self.row_limit:
+            params['limit'] = self.row_limit
+        return params
+
+    def query_string(self):
+        return urlencode(self.params(), doseq=True)
+
+    def __repr__(self):
+        return f"CDXQuery({self.query_string()})"
+
+
+# One scan spec per kind of crawl; each returns a fresh query to narrow further with between()/limit()
+
+def seller_scan(domain):
+    """Amazon seller pages: one capture per URL, successful ones only"""
+    # A bare host or path gets a trailing slash; a query-string prefix such as ...&seller= is already a prefix of every page
+    url = domain if urlparse(domain).query or domain.endswith('=') else f"{domain.rstrip('/')}/"
+    return CDXQuery(url).status(200).collapse('urlkey').project('timestamp', 'original')
+
+
+def hashtag_scan(prefix):
+    """Hashtag or tag pages under one prefix, e.g. tiktok.com/tag/: HTML pages that returned 200"""
+    return CDXQuery(prefix).status(200).mimetype('text/html').project('timestamp', 'original')
+
+
+def hashtag_of(url, prefix):
+    """The hashtag a hashtag_scan capture is for, or None: the path segment after a path-style prefix
+    (tiktok.com/tag/), else the first query value of a search-style one (reddit.com/search/?q=%23)"""
+    prefix_path = unquote(urlparse("https://" + prefix).path)
+    parsed_url = urlparse(url)
+    decoded_path = unquote(parsed_url.path)
+    tag = ''
+    if prefix_path.strip('/') and prefix_path in decoded_path:
+        tag = decoded_path.split(prefix_path, 1)[-1].split('/')[0]
+    if not tag and parsed_url.query:
+        # Search pages sit at the prefix path itself and carry the hashtag in the query string
+        values = [value for values in parse_qs(parsed_url.query).values() for value in values]
+        tag = values[0] if values else ''
+    return tag.lstrip('#') or None
+
+
+def hub_listing_scan(website_url):
+    """Pages under a hub path such as huggingface.co/models, one successful capture per URL"""
+    return CDXQuery(f"https://www.{website_url}/").status(200).collapse('urlkey').project('timestamp', 'original')
+
+
+def page_history_scan(website_url):
+    """Captures of one page and its query-string variants that were not 404s, one per URL"""
+    return CDXQuery(f"https://www.{website_url}").status(404, negate=True).collapse('urlkey').project('timestamp', 'original')
+
+
+def article_scan(website_url):
+    """Article URLs under a site, successful captures only, one per URL"""
+    return CDXQuery(f"https://www.{website_url}").status(200).collapse('urlkey').project('original')
+
+
+def archive_listing_scan(domain):
+    """Every URL ever captured under domain, one capture per URL, for offline listing exports"""
+    return CDXQuery(f"{domain}/").collapse('urlkey').project('timestamp', 'original')
+
+
+def first_seen_scan(prefix):
+    """Every URL under a prefix with its earliest non-404 capture, for building first-seen maps in one pass"""
+    return CDXQuery(prefix).status(404, negate=True).collapse('urlkey').project('timestamp', 'original')
@@ -0,0 +1,136 @@
+import os
+import re
+import json
+import asyncio
+import argparse
+from aiohttp import web
+
+CDX_SERVER_HOST = os.getenv('CDX_SERVER_HOST', '127.0.0.1')
+CDX_SERVER_PORT = int(os.getenv('CDX_SERVER_PORT', '8790'))
+CDX_SERVER_ROWS = int(os.getenv('CDX_SERVER_ROWS', '200000'))
+CDX_SERVER_PAGE_ROWS = int(os.getenv('CDX_SERVER_PAGE_ROWS', '5000'))
+CDX_SERVER_LATENCY_MS = float(os.getenv('CDX_SERVER_LATENCY_MS', '100'))
+CDX_SERVER_ROW_US = float(os.getenv('CDX_SERVER_ROW_US', '20'))
+
+FIELDS = ['urlkey', 'timestamp', 'original', 'mimetype', 'statuscode', 'digest', 'length']
+
+
+class LocalCDX:
+    """Synthetic stand-in for the Wayback CDX server: resumeKey paging, showNumPages/page slices and filters"""
+
+    def __init__(self, rows=CDX_SERVER_ROWS, page_rows=CDX_SERVER_PAGE_ROWS, latency_ms=CDX_SERVER_LATENCY_MS,
+                 row_us=CDX_SERVER_ROW_US, host='example.com', prefix='/tag/'):
+        # One capture per URL, sorted by urlkey like the real index
+        reversed_host = ','.join(reversed(host.split('.')))
+        self.rows = []
+        for i in range(rows):
+            path = f"{prefix}t{i:08d}"
+            self.rows.append([
+                f"{reversed_host}){path}",
+                f"2024{1 + i % 12:02d}{1 + i % 28:02d}{i % 24:02d}0000",
+                f"https://www.{host}{path}",
+                'text/html' if i % 10 else 'application/json',
+                '200' if i % 7 else '301',
+                f"D{i:031d}",
+                str(1000 + i % 5000)
+            ])
+        self.page_rows = page_rows
+        # Simulated server cost: a fixed delay per request plus a per-row scan cost
+        self.latency_ms = latency_ms
+        self.row_us = row_us
+        self.requests = 0
+        self.rows_served = 0
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get('/cdx/search/cdx', self.handle_cdx)
+        return app
+
+    def _matcher(self, filters):
+        """Predicate for CDX filter=[!]field:regex expressions"""
+        tests = []
+        for expression in filters:
+            negate = expression.startswith('!')
+            field, _, pattern = expression.lstrip('!').partition(':')
+            if field in FIELDS:
+                tests.append((FIELDS.index(field), re.compile(pattern), negate))
+        return lambda row: all(bool(regex.fullmatch(row[index])) != negate for index, regex, negate in tests)
+
+    async def _respond(self, request, rows, resume_key=''):
+        self.requests += 1
+        self.rows_served += len(rows)
+        await asyncio.sleep((self.latency_ms + len(rows) * self.row_us / 1000) / 1000)
+        fields = request.query.get('fl', '').split(',') if request.query.get('fl') else FIELDS
+        indexes = [FIELDS.index(field) for field in fields if field in FIELDS]
+        projected = [[row[i] for i in indexes] for row in rows]
+        if request.query.get('output') == 'json':
+            body = [[FIELDS[i] for i in indexes]] + projected if projected else []
+            if resume_key:
+                body += [[], [resume_key]]
+            response = web.Response(text=json.dumps(body), content_type='application/json')
+        else:
+            lines = [' '.join(row) for row in projected]
+            if resume_key:
+                lines += ['', resume_key]
+            response = web.Response(text='\n'.join(lines) + ('\n' if lines else ''), content_type='text/plain')
+        # gzip when the client sends Accept-Encoding, like the real CDX server
+        response.enable_compression()
+        return response
+
+    async def handle_cdx(self, request):
+        query = request.query
+        pages = max(1, -(-len(self.rows) // self.page_rows))
+        if query.get('showNumPages') == 'true':
+            self.requests += 1
+            return web.Response(text=f"{pages}\n", content_type='text/plain')
+        matches = self._matcher(query.getall('filter', []))
+        if 'page' in query:
+            page = int(query['page'])
+            rows = self.rows[page * self.page_rows:(page + 1) * self.page_rows]
+            return await self._respond(request, [row for row in rows if matches(row)])
+
+        # resumeKey paging: the key is the index of the next unscanned row
+        start = int(query.get('resumeKey') or 0)
+        limit = int(query.get('limit') or len(self.rows))
+        matched = []
+        position = start
+        while position < len(self.rows) and len(matched) < limit:
+            if matches(self.rows[position]):
+                matched.append(self.rows[position])
+            position += 1
+        resume_key = str(position) if query.get('showResumeKey') == 'true' and position < len(self.rows) else ''
+        return await self._respond(request, matched, resume_key)
+
+    def report(self):
+        print(f"[INFO] Local CDX: {self.requests} requests, {self.rows_served} rows served")
+
+
+async def start_server(local_cdx, host=CDX_SERVER_HOST, port=CDX_SERVER_PORT):
+    """Serve local_cdx in the running event loop; returns the runner to clean up and the CDX API URL"""
+    runner = web.AppRunner(local_cdx.app())
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    return runner, f"http://{host}:{port}/cdx/search/cdx"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve synthetic captures behind the Wayback CDX API.')
+    parser.add_argument('--host', type=str, default=CDX_SERVER_HOST)
+    parser.add_argument('--port', type=int, default=CDX_SERVER_PORT)
+    parser.add_argument('--rows', type=int, default=CDX_SERVER_ROWS, help='Captures under the prefix')
+    parser.add_argument('--page_rows', type=int, default=CDX_SERVER_PAGE_ROWS, help='Captures per page= slice')
+    parser.add_argument('--latency_ms', type=float, default=CDX_SERVER_LATENCY_MS, help='Delay per request')
+    parser.add_argument('--row_us', type=float, default=CDX_SERVER_ROW_US, help='Extra delay per returned row')
+    args = parser.parse_args()
+
+    local_cdx = LocalCDX(args.rows, args.page_rows, args.latency_ms, args.row_us)
+    print(f"[INFO] Set CDX_API_URL=http://{args.host}:{args.port}/cdx/search/cdx to use this server")
+    try:
+        web.run_app(local_cdx.app(), host=args.host, port=args.port)
+    finally:
+        local_cdx.report()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,51 +1,40 @@
-import os
 import aiohttp
 import asyncio
 from bs4 import BeautifulSoup
 from datetime import datetime
 from dotenv import load_dotenv
+from d1_client import D1Client
+from rate_limit import paced, report_rates
+from sitemap import SitemapRules, SitemapState, crawl_sitemaps
+from model_stage import ModelStage
 import re
 
 # Load environment variables
 load_dotenv()
 
-D1_DATABASE_ID = os.getenv('CLOUDFLARE_D1_DATABASE_ID')
-CLOUDFLARE_ACCOUNT_ID = os.getenv('CLOUDFLARE_ACCOUNT_ID')
-CLOUDFLARE_API_TOKEN = os.getenv('CLOUDFLARE_API_TOKEN')
-
 # Constants
-CLOUDFLARE_BASE_URL = f"https://api.cloudflare.com/client/v4/accounts/{CLOUDFLARE_ACCOUNT_ID}/d1/database/{D1_DATABASE_ID}"
 ROOT_SITEMAP_URL = "https://civitai.com/sitemap.xml"
+# Only the models sitemap (or its numbered parts, should it become an index) lists model pages
+SITEMAP_RULES = SitemapRules(follow=r'/sitemap-models(-\d+)?\.xml(\.gz)?$')
 
-HEADERS = {
-    "Authorization": f"Bearer {CLOUDFLARE_API_TOKEN}",
-    "Content-Type": "application/json",
-}
+# Shared D1 client (pooled connections, bounded in-flight queries, retries)
+d1 = D1Client()
+# Last stats pushed to D1, used to skip unchanged models
+stage = ModelStage('civitai_model_data')
+# Validators and entries of each sitemap, so unchanged ones are skipped or answered with a 304
+sitemaps = SitemapState('civitai')
 
 # Semaphore for controlling concurrency
 MAX_CONCURRENT_REQUESTS = 50  # Adjust based on system capabilities
 semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
 
-# Helper: Parse a sitemap and return all <loc> URLs
-async def parse_sitemap(url, session):
-    async with semaphore:
-        try:
-            async with session.get(url) as response:
-                response.raise_for_status()
-                text = await response.text()
-                soup = BeautifulSoup(text, "xml")
-                return [loc.text for loc in soup.find_all("loc")]
-        except aiohttp.ClientError as e:
-            print(f"[ERROR] Failed to fetch sitemap {url}: {e}")
-            return []
-
 # Helper: Fetch model page and extract run count
 async def get_model_runs(url, session):
     stats=[]
     
     async with semaphore:
         try:
-            async with session.get(url) as response:
+            async with paced(session, 'GET', url) as response:
                 response.raise_for_status()
                 text = await response.text()
                 soup = BeautifulSoup(text, "html.parser")
@@ -82,7 +71,7 @@ async def get_model_runs(url, session):
             return stats
 
 # Helper: Create table in the database
-async def create_table_if_not_exists(session):
+async def create_table_if_not_exists():
     create_table_sql = """
     CREATE TABLE IF NOT EXISTS civitai_model_data (
         id SERIAL PRIMARY KEY,
@@ -94,70 +83,52 @@ async def create_table_if_not_exists(session):
         updateAt TEXT
     );
     """
-    payload = {"sql": create_table_sql}
-    url = f"{CLOUDFLARE_BASE_URL}/query"
-    try:
-        async with session.post(url, headers=HEADERS, json=payload) as response:
-            response.raise_for_status()
-            print("[INFO] Table civitai_model_data checked/created successfully.")
-    except aiohttp.ClientError as e:
-        print(f"[ERROR] Failed to create table: {e}")
+    if await d1.query(create_table_sql) is not None:
+        print("[INFO] Table civitai_model_data checked/created successfully.")
+    else:
+        print("[ERROR] Failed to create table.")
 
-# Helper: Insert or update model data
-async def upsert_model_data(model_url, stats, type, session):
+# Helper: Build the upsert statement for a model's latest stats
+def build_upsert_statement(model_url, stats):
     current_time = datetime.utcnow().isoformat()
-    download_count=stats[0]
-    run_count=stats[1]
-    sql = f"""
+    sql = """
     INSERT INTO civitai_model_data (model_url, download_count,run_count, type, createAt, updateAt)
-    VALUES ('{model_url}',{download_count}, {run_count}, '{type}', '{current_time}', '{current_time}')
+    VALUES (?, ?, ?, ?, ?, ?)
     ON CONFLICT (model_url) DO UPDATE
-    SET run_count = {run_count}, 
-        updateAt = '{current_time}',
+    SET run_count = excluded.run_count, 
+        updateAt = excluded.updateAt,
         createAt = civitai_model_data.createAt;
     """
-    payload = {"sql": sql}
-    
-    url = f"{CLOUDFLARE_BASE_URL}/query"
-    try:
-        async with session.post(url, headers=HEADERS, json=payload) as response:
-            response.raise_for_status()
-            print(f"[INFO] Data upserted for {model_url} with {run_count} runs.")
-    except aiohttp.ClientError as e:
-        print('insert data',sql)
-        
-        print(f"[ERROR] Failed to upsert data for {model_url}: {e}")
+    return {"sql": sql, "params": [model_url, stats['download_count'], stats['run_count'], stats['type'],
+                                   current_time, current_time]}
 
 # Main workflow
 async def process_model_url(model_url, type, session):
     print(f"[INFO] Processing model: {model_url}")
     stats = await get_model_runs(model_url, session)
     if stats is not None and len(stats)==2:
-        await upsert_model_data(model_url, stats, type, session)
+        stage.stage(model_url, download_count=stats[0], run_count=stats[1], type=type)
 
 async def main():
     print("[INFO] Starting sitemap parsing...")
-    async with aiohttp.ClientSession() as session:
-        await create_table_if_not_exists(session)
-
-        # Parse the root sitemap
-        subsitemaps = await parse_sitemap(ROOT_SITEMAP_URL, session)
-        if not subsitemaps:
-            print("[ERROR] No subsitemaps found.")
-            return
+    async with aiohttp.ClientSession() as session, d1:
+        await create_table_if_not_exists()
 
+        # Sub-sitemaps download concurrently and each model page is scraped as soon as its sitemap has parsed
         tasks = []
-        for subsitemap_url in subsitemaps:
-            type = subsitemap_url.replace('https://civitai.com/sitemap-', '').replace('.xml', '')
-            if len(type) == 1 or type != 'models':
-                continue
-            print(f"[INFO] Parsing subsitemap: {subsitemap_url}")
-            model_urls = await parse_sitemap(subsitemap_url, session)
-
-            for model_url in model_urls:
-                tasks.append(process_model_url(model_url, type, session))
+        async for model_url, _ in crawl_sitemaps(session, ROOT_SITEMAP_URL, SITEMAP_RULES, state=sitemaps):
+            tasks.append(asyncio.ensure_future(process_model_url(model_url, 'models', session)))
+        if not tasks:
+            print("[ERROR] No model URLs found in the sitemaps.")
 
         await asyncio.gather(*tasks)
+
+        # Only models whose stats moved since the last push are written to D1
+        await stage.sync(d1, build_upsert_statement)
+    report_rates()
+    sitemaps.report()
+    sitemaps.close()
+    stage.close()
     print("[INFO] Sitemap parsing complete.")
 
 # Run the script
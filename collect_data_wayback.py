@@ -1,21 +1,49 @@
-import requests as rq
-import time
 import os
 import argparse
+import asyncio
+import inspect
 import sys
 from tqdm import tqdm
+from cdx_client import CDXClient, CDXError
+from cdx_query import article_scan, hub_listing_scan, page_history_scan
+from proxy_pool import ProxyPool
 
 sys.path.insert(1, os.path.join(sys.path[0], '..'))
 
-def collect_data_wayback(website_url,
+async def _deliver(on_chunk, chunk):
+    # on_chunk may be a plain function or a coroutine function
+    result = on_chunk(chunk)
+    if inspect.isawaitable(result):
+        await result
+
+def _proxy_pool(proxies):
+    # A plain list of proxy URLs gets its own health-checked pool
+    return ProxyPool(proxies) if isinstance(proxies, (list, tuple)) else proxies
+
+async def _iter_chunks(cdx, params, resume_key, max_pages, sharded):
+    # Both CDX paging modes as (rows, position to resume after them); '' marks the last chunk.
+    # Sharded crawls fetch page= slices concurrently and resume from a page number.
+    if sharded:
+        async for page, rows, total in cdx.iter_shards(params, int(resume_key or 0)):
+            yield rows, str(page + 1) if page + 1 < total else ''
+    else:
+        async for rows, next_key in cdx.iter_pages(params, resume_key, max_pages=max_pages):
+            yield rows, next_key
+
+async def collect_data_wayback_async(website_url,
                          output_dir,
                          start_date,
                          end_date,
                          resume_key='',
                          max_count=1000,
                          chunk_size=100,
-                         sleep=3,
-                         retries=5):
+                         sleep=0,  # Extra pause between resumeKey pages; the archive.org rate limiter already paces them
+                         retries=5,
+                         checkpoint=None,
+                         on_chunk=None,
+                         session=None,
+                         sharded=False,
+                         proxies=None):
     if 'http://' in website_url:
         website_url = website_url.replace('http://', '')
     if 'https://' in website_url:
@@ -24,195 +52,164 @@ def collect_data_wayback(website_url,
     if chunk_size > max_count:
         raise ValueError('Chunk size needs to be smaller than max count.')
 
+    if checkpoint is not None:
+        # Continue an interrupted crawl of this prefix with the params it started with
+        progress = checkpoint.prefix(website_url, start_date=start_date, end_date=end_date, chunk_size=chunk_size,
+                                     sharded=sharded)
+        params = progress['params']
+        start_date, end_date, chunk_size = params['start_date'], params['end_date'], params['chunk_size']
+        sharded = params.get('sharded', False)
+        resume_key = progress['resume_key'] or resume_key
+
     unique_articles_set = set()
     url_list = []
-    url_template = 'http://web.archive.org/cdx/search/cdx?url=https://www.{domain}&collapse=urlkey&filter=!statuscode:404&showResumeKey=true&matchType=prefix&from={start}&to={end}&limit={chunk}&output=json'
-    
-    url = url_template.format(domain=website_url, start=start_date, end=end_date, chunk=chunk_size)
-    if resume_key:
-        url += '&resumeKey=' + resume_key
+    # Non-200 captures are dropped by the server rather than downloaded and skipped here
+    query = article_scan(website_url).between(start_date, end_date).limit(chunk_size)
+    params = query.params()
 
     its = max_count // chunk_size
     progress_bar = tqdm(total=its)
 
-    for _ in range(its):
-        for attempt in range(retries):
-            try:
-                result = rq.get(url)
-                result.raise_for_status()
-                parse_url = result.json()
-
-                if len(parse_url) < 2:
-                    print("No more data to fetch.")
-                    progress_bar.close()
-                    return url_list
-                
-                # Update resume_key and URL for the next batch
-                new_resume_key = parse_url[-1][0] if parse_url[-1][0] != resume_key else ''
-                if not new_resume_key:
-                    print("No progress detected with resume key. Exiting loop.")
-                    progress_bar.close()
-                    return url_list
-                
-                resume_key = new_resume_key
-                for i in range(1, len(parse_url) - 1):
-                    # print('====',parse_url[i])
-                    if len(parse_url[i])<5:
-                      continue
-                    orig_url = parse_url[i][2]
+    async with CDXClient(session=session, retries=retries, sleep=sleep, fields=query.fields, proxies=_proxy_pool(proxies)) as cdx:
+        try:
+            async for rows, resume_key in _iter_chunks(cdx, params, resume_key, its, sharded):
+                chunk_start = len(url_list)
+                for orig_url, in rows:
                     print('======',orig_url)
 
-                    if parse_url[i][4] != '200':
-                        continue
                     if orig_url not in unique_articles_set:
                         url_list.append(orig_url)
                         unique_articles_set.add(orig_url)
-                
-                url = url_template.format(domain=website_url, start=start_date, end=end_date, chunk=chunk_size) + '&resumeKey=' + resume_key
-                time.sleep(sleep)
-                break
-            except (rq.RequestException, ValueError) as e:
-                if attempt < retries - 1:
-                    time.sleep(2 ** attempt)
-                    continue
-                else:
-                    print(f"Failed to fetch data after {retries} attempts. Error: {e}")
-                    progress_bar.close()
-                    return url_list
-        print('current url',len(url_list))
-
-        progress_bar.update(1)
-
-        # Check if the progress is complete
-        if progress_bar.n == its:
-            print("Progress completed. Returning results.")
+
+                if on_chunk is not None:
+                    await _deliver(on_chunk, url_list[chunk_start:])
+                if checkpoint is not None:
+                    checkpoint.advance(website_url, resume_key, len(url_list) - chunk_start)
+                print('current url',len(url_list))
+
+                progress_bar.update(1)
+                if sharded and resume_key and len(url_list) >= max_count:
+                    break
+                if not resume_key:
+                    print("No more data to fetch.")
+                    if checkpoint is not None:
+                        checkpoint.finish(website_url)
+        except CDXError as e:
+            print(f"Failed to fetch data after {retries} attempts. Error: {e}")
+            cdx.report()
             progress_bar.close()
             return url_list
+        cdx.report()
 
     progress_bar.close()
     print('urls count', len(url_list))
     print('Collected %s of the initial number of requested urls' % (round(len(url_list) / max_count, 2)))
     return url_list
 
+def collect_data_wayback(*args, **kwargs):
+    """Blocking wrapper around collect_data_wayback_async"""
+    return asyncio.run(collect_data_wayback_async(*args, **kwargs))
 
-import random
-
-# Load SOCKS5 proxies from a URL (or you can load from a file if you prefer)
-def load_proxies(url=None):
-    if url is None:
-      url='https://raw.githubusercontent.com/TheSpeedX/SOCKS-List/master/socks5.txt'
-      # https://github.com/proxifly/free-proxy-list/blob/main/proxies/all/data.txt
-    try:
-        response = rq.get(url)
-        response.raise_for_status()
-        return response.text.splitlines()
-    except rq.RequestException as e:
-        print(f"Error fetching proxy list from {url}: {e}")
-        return []
-
-# Function to select a random proxy
-def get_random_proxy(proxy_list):
-    return random.choice(proxy_list) if proxy_list else None
 
 sys.path.insert(1, os.path.join(sys.path[0], '..'))
 
-def exact_url_timestamp(website_url,
-                         sleep=3,
+async def exact_url_timestamp_async(website_url,
+                         sleep=0,
                          retries=5,
                          max_count=1000,
                          chunk_size=100,
                          start_date=None,
                          end_date=None,
-                        
-                         proxy_retries=3,  # Added retry limit for proxies
-                         proxies=None):  # Added proxies parameter
+                         checkpoint=None,  # CrawlCheckpoint to resume from and advance after each chunk
+                         on_chunk=None,  # Called (or awaited) with each chunk's items before the checkpoint moves past it
+                         session=None,
+                         sharded=False,  # Fetch showNumPages page= slices concurrently instead of resumeKey chunks
+                         proxies=None):  # ProxyPool or list of proxy URLs; None uses the PROXY_LIST_URLS/PROXIES pool
     if 'http://' in website_url:
         website_url = website_url.replace('http://', '')
     if 'https://' in website_url:
         website_url = website_url.replace('https://', '')
 
+    resume_key = ''
+    if checkpoint is not None:
+        progress = checkpoint.prefix(website_url, start_date=start_date, end_date=end_date, chunk_size=chunk_size,
+                                     sharded=sharded)
+        # Keep the date window the crawl started with so the resume key stays valid
+        params = progress['params']
+        start_date, end_date, chunk_size = params['start_date'], params['end_date'], params['chunk_size']
+        sharded = params.get('sharded', False)
+        resume_key = progress['resume_key']
 
-    unique_articles_set = set()
     items = []
     if start_date and end_date:                
-        url_template = 'http://web.archive.org/cdx/search/cdx?url=https://www.{domain}/&collapse=urlkey&filter=statuscode:200&matchType=prefix&from={start}&to={end}&limit={chunk}&output=json'
-        url = url_template.format(domain=website_url, start=start_date, end=end_date, chunk=chunk_size)
+        query = hub_listing_scan(website_url).between(start_date, end_date)
     else:
-        url_template = 'http://web.archive.org/cdx/search/cdx?url=https://www.{domain}&collapse=urlkey&filter=!statuscode:404&showResumeKey=true&matchType=prefix&limit={chunk}&output=json'
-        url = url_template.format(domain=website_url, chunk=chunk_size)
+        query = page_history_scan(website_url)
+    params = query.limit(chunk_size).params()
 
-                           # max_count=1
-    # chunk_size=1
     its = max_count // chunk_size
     progress_bar = tqdm(total=its)
 
-    for _ in range(its):
-        for attempt in range(retries):
-            for proxy_attempt in range(proxy_retries):  # Retry with different proxies if request fails
-                try:
-                    # Select a random proxy from the list
-                    if proxies is None:
-                        proxies=load_proxies()
-                    proxy = get_random_proxy(proxies)
-                    proxy_dict = None
-                    if 'socks5' in proxy==False:
-                        # Define the proxy for requests
-                        proxy_dict = {'http': f'socks5://{proxy}', 'https': f'socks5://{proxy}'}
-                    else:
-                        proxy_dict = {'http': f'{proxy}', 'https': f'{proxy}'}
-                      
-                    result = rq.get(url
-                                    # , proxies=proxy_dict
-                                    ,timeout=30000
-                                   )
-                    result.raise_for_status()
-                    parse_url = result.json()
-
-                    if len(parse_url) < 2:
-                        print("No more data to fetch.")
-                        progress_bar.close()
-                        return items
-                                        
-                    for i in range(1, len(parse_url) - 1):
-                        if len(parse_url[i]) < 5:
-                            continue
-                        orig_url = parse_url[i][2]
-                        indexdate = parse_url[i][1]
-                        item={}
-                      
-                        orig_url=orig_url.replace('http://','https://')
-                        print('---',orig_url)
-                      
-                        item['url']=orig_url
-                        item['timestamp']=indexdate
-                        items.append(item)
-
-                    print('===founding===', len(items))
-                      
-                    break  # Exit proxy retry loop if successful
-                except (rq.RequestException, ValueError) as e:
-                    if proxy_attempt < proxy_retries - 1:
-                        print(f"Proxy failed. Retrying with another proxy. Attempt {proxy_attempt + 1}/{proxy_retries}")
-                        continue  # Try another proxy
-                    else:
-                        print(f"Failed to fetch data after {proxy_retries} proxy attempts. Error: {e}")
-                        progress_bar.close()
-                        return items
-            print('current url index date', len(items))
-
-            progress_bar.update(1)
-
-            # Check if the progress is complete
-            if progress_bar.n == its:
-                print("Progress completed. Returning results.")
-                progress_bar.close()
-                return items
+    async with CDXClient(session=session, retries=retries, sleep=sleep, fields=query.fields, proxies=_proxy_pool(proxies)) as cdx:
+        try:
+            async for rows, resume_key in _iter_chunks(cdx, params, resume_key, its, sharded):
+                chunk = []
+                for timestamp, orig_url in rows:
+                    if not orig_url:
+                        continue
+                    item={}
+                  
+                    orig_url=orig_url.replace('http://','https://')
+                    print('---',orig_url)
+                  
+                    item['url']=orig_url
+                    item['timestamp']=timestamp
+                    chunk.append(item)
+                items.extend(chunk)
+                print('===founding===', len(items))
+
+                if on_chunk is not None:
+                    await _deliver(on_chunk, chunk)
+                if checkpoint is not None:
+                    checkpoint.advance(website_url, resume_key, len(chunk))
+                print('current url index date', len(items))
+
+                progress_bar.update(1)
+                if sharded and resume_key and len(items) >= max_count:
+                    break
+                if not resume_key:
+                    print("No more data to fetch.")
+                    if checkpoint is not None:
+                        checkpoint.finish(website_url)
+        except CDXError as e:
+            print(f"Failed to fetch data after {retries} attempts. Error: {e}")
+            cdx.report()
+            progress_bar.close()
+            return items
+        cdx.report()
 
     progress_bar.close()
     print('urls count', len(items))
     print('Collected %s of the initial number of requested urls' % (round(len(items) / max_count, 2)))
     return items
 
+def exact_url_timestamp(website_url,
+                         sleep=0,
+                         retries=5,
+                         max_count=1000,
+                         chunk_size=100,
+                         start_date=None,
+                         end_date=None,
+                        
+                         proxies=None,  # ProxyPool or list of proxy URLs
+                         checkpoint=None,
+                         on_chunk=None,
+                         sharded=False):
+    """Blocking wrapper around exact_url_timestamp_async"""
+    return asyncio.run(exact_url_timestamp_async(website_url, sleep=sleep, retries=retries, max_count=max_count,
+                                                 chunk_size=chunk_size, start_date=start_date, end_date=end_date,
+                                                 checkpoint=checkpoint, on_chunk=on_chunk, sharded=sharded,
+                                                 proxies=proxies))
 
 
 if __name__ == '__main__':
@@ -229,8 +226,8 @@ if __name__ == '__main__':
                         help='Maximum number of URLs to collect.')
     parser.add_argument('--chunk_size', type=int, default=4000,
                         help='Size of each chunk to query the Wayback Machine API.')
-    parser.add_argument('--sleep', type=int, default=5,
-                        help='Waiting time between two calls of the Wayback machine API.')
+    parser.add_argument('--sleep', type=int, default=0,
+                        help='Extra waiting time between two calls of the Wayback machine API, on top of the adaptive rate limit.')
 
     args = parser.parse_args()
 
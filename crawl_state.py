@@ -0,0 +1,71 @@
+import os
+import json
+import time
+
+CRAWL_STATE_DIR = os.getenv('CRAWL_STATE_DIR', os.path.join(os.getenv('STAGE_DIR', 'state'), 'crawls'))
+
+
+class CrawlCheckpoint:
+    """Resume key, page count and per-prefix progress of a CDX crawl, written atomically after every chunk"""
+
+    def __init__(self, name, path=None):
+        self.name = name
+        self.path = path or os.path.join(CRAWL_STATE_DIR, f'{name}.json')
+        self.state = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            print(f"⚠ Ignoring unreadable checkpoint {self.path}: {e}")
+        return {'name': self.name, 'prefixes': {}}
+
+    def prefix(self, prefix, **params):
+        """Progress of one URL prefix: the unfinished one on disk, or a fresh one recording the crawl params"""
+        progress = self.state['prefixes'].get(prefix)
+        if progress and not progress.get('done'):
+            print(f"✓ Resuming {self.name} crawl of {prefix} after page {progress['pages']} "
+                  f"({progress['rows']} rows already delivered)")
+            return progress
+        progress = {'params': params, 'resume_key': '', 'pages': 0, 'rows': 0, 'done': False,
+                    'started_at': time.time(), 'updated_at': time.time()}
+        self.state['prefixes'][prefix] = progress
+        self.save()
+        return progress
+
+    def advance(self, prefix, resume_key, rows):
+        """Record a delivered chunk; call only after its rows have been handed downstream"""
+        # resume_key is the CDX resumeKey, or the next page number for page-sharded crawls
+        progress = self.state['prefixes'][prefix]
+        progress['resume_key'] = resume_key
+        progress['pages'] += 1
+        progress['rows'] += rows
+        progress['updated_at'] = time.time()
+        self.save()
+
+    def finish(self, prefix):
+        progress = self.state['prefixes'][prefix]
+        progress['done'] = True
+        progress['resume_key'] = ''
+        progress['updated_at'] = time.time()
+        self.save()
+
+    def in_progress(self, prefix=None):
+        """Whether a crawl (of prefix, or of any prefix) was started and not finished"""
+        prefixes = self.state['prefixes']
+        if prefix is not None:
+            return prefix in prefixes and not prefixes[prefix].get('done')
+        return any(not progress.get('done') for progress in prefixes.values())
+
+    def save(self):
+        # Write to a temp file and rename so a crash mid-write never leaves a truncated checkpoint
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf8') as f:
+            json.dump(self.state, f, indent=2, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,169 @@
+import os
+import time
+import random
+import asyncio
+import aiohttp
+from dotenv import load_dotenv
+
+load_dotenv()
+
+D1_MAX_IN_FLIGHT = int(os.getenv('D1_MAX_IN_FLIGHT', '10'))
+D1_MAX_RETRIES = int(os.getenv('D1_MAX_RETRIES', '5'))
+D1_BACKOFF_BASE = float(os.getenv('D1_BACKOFF_BASE', '0.5'))
+D1_BACKOFF_CAP = float(os.getenv('D1_BACKOFF_CAP', '30'))
+D1_PAGE_SIZE = int(os.getenv('D1_PAGE_SIZE', '1000'))
+# Override with the CLOUDFLARE_API_BASE_URL env var (e.g. http://127.0.0.1:8787/client/v4 for d1_server.py)
+CLOUDFLARE_API_BASE_URL = 'https://api.cloudflare.com/client/v4'
+
+# Statuses worth retrying: rate limiting and transient server errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class D1Client:
+    """Shared Cloudflare D1 client with a keep-alive connection pool, bounded concurrency and retries"""
+
+    def __init__(self, api_token=None, account_id=None, database_id=None,
+                 max_in_flight=D1_MAX_IN_FLIGHT, max_retries=D1_MAX_RETRIES, api_base_url=None):
+        api_token = api_token or os.getenv('CLOUDFLARE_API_TOKEN')
+        account_id = account_id or os.getenv('CLOUDFLARE_ACCOUNT_ID')
+        database_id = database_id or os.getenv('CLOUDFLARE_D1_DATABASE_ID')
+        api_base_url = (api_base_url or os.getenv('CLOUDFLARE_API_BASE_URL', CLOUDFLARE_API_BASE_URL)).rstrip('/')
+        self.base_url = f"{api_base_url}/accounts/{account_id}/d1/database/{database_id}"
+        self.headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {api_token}"
+        }
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.session = None
+        self.semaphore = None
+        self.latencies = []
+        self.retries = 0
+        self.rate_limited = 0
+        self.failures = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def _ensure_session(self):
+        # Created lazily so module-level clients can be declared outside the event loop
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_in_flight, keepalive_timeout=60)
+            self.session = aiohttp.ClientSession(connector=connector, headers=self.headers,
+                                                 timeout=aiohttp.ClientTimeout(total=120))
+            self.semaphore = asyncio.Semaphore(self.max_in_flight)
+        return self.session
+
+    def _backoff(self, attempt, retry_after=None):
+        delay = random.uniform(0, min(D1_BACKOFF_CAP, D1_BACKOFF_BASE * 2 ** attempt))
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        return delay
+
+    async def request(self, method, path='', payload=None):
+        """Send one API request with retries; returns the decoded body or None on failure"""
+        session = self._ensure_session()
+        url = f"{self.base_url}{path}"
+        for attempt in range(self.max_retries):
+            retry_after = None
+            async with self.semaphore:
+                started = time.monotonic()
+                try:
+                    async with session.request(method, url, json=payload) as response:
+                        if response.status == 200:
+                            data = await response.json()
+                            self.latencies.append(time.monotonic() - started)
+                            if data.get('success'):
+                                return data
+                            print(f"[ERROR] D1 API error: {data.get('errors')}")
+                            self.failures += 1
+                            return None
+                        error_text = await response.text()
+                        if response.status not in RETRY_STATUSES:
+                            print(f"[ERROR] D1 returned HTTP {response.status}: {error_text}")
+                            self.failures += 1
+                            return None
+                        if response.status == 429:
+                            self.rate_limited += 1
+                        retry_after = response.headers.get('Retry-After')
+                        print(f"[WARNING] D1 returned HTTP {response.status}, attempt {attempt + 1}/{self.max_retries}")
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    print(f"[WARNING] D1 request failed on attempt {attempt + 1}/{self.max_retries}: {e}")
+            if attempt < self.max_retries - 1:
+                self.retries += 1
+                await asyncio.sleep(self._backoff(attempt, retry_after))
+        print(f"[ERROR] D1 request to {url} failed after {self.max_retries} attempts.")
+        self.failures += 1
+        return None
+
+    async def query(self, sql, params=None):
+        """Run one statement; returns the list of statement results or None on failure"""
+        payload = {"sql": sql}
+        if params:
+            payload["params"] = list(params)
+        data = await self.request('POST', '/query', payload)
+        return None if data is None else data.get('result') or []
+
+    async def batch(self, statements):
+        """Run several {sql, params} statements in one round trip"""
+        data = await self.request('POST', '/query', {"batch": list(statements)})
+        return None if data is None else data.get('result') or []
+
+    async def rows(self, sql, params=None):
+        """Run one statement and return its result rows"""
+        results = await self.query(sql, params)
+        if not results:
+            return []
+        return results[0].get('results') or []
+
+    async def iter_pages(self, table, columns, page_size=D1_PAGE_SIZE):
+        """Yield the given columns of a table page by page, keyset-paginated on rowid"""
+        # rowid is always set, unlike "id SERIAL" columns which SQLite does not auto-fill
+        last_rowid = 0
+        while True:
+            results = await self.query(
+                f"SELECT rowid AS row_id, {', '.join(columns)} FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                [last_rowid, page_size]
+            )
+            if results is None:
+                print(f"[WARNING] Stopped reading {table} after rowid {last_rowid}: page query failed")
+                return
+            page = (results[0].get('results') or []) if results else []
+            if not page:
+                return
+            yield page
+            if len(page) < page_size:
+                return
+            last_rowid = page[-1]['row_id']
+
+    async def test_connection(self):
+        """Check that the database is reachable with the configured credentials"""
+        print("\nTesting Cloudflare connection...")
+        print(f"URL: {self.base_url}")
+        data = await self.request('GET')
+        if data is None:
+            print("✗ Cloudflare connection failed")
+            return False
+        print("✓ Cloudflare connection successful")
+        return True
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.report()
+
+    def report(self):
+        if not self.latencies and not self.failures:
+            return
+        latencies = sorted(self.latencies)
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0.0
+        print(f"\n[INFO] D1 client: {len(latencies)} queries, "
+              f"p50 {percentile(0.5):.0f} ms, p95 {percentile(0.95):.0f} ms, max {percentile(1.0):.0f} ms, "
+              f"{self.retries} retries, {self.rate_limited} rate-limited, {self.failures} failed")
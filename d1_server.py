@@ -0,0 +1,173 @@
+import os
+import time
+import random
+import asyncio
+import sqlite3
+import argparse
+from aiohttp import web
+
+# D1 rejects statements with more than 100 bound parameters
+D1_MAX_PARAMS = 100
+D1_SERVER_HOST = os.getenv('D1_SERVER_HOST', '127.0.0.1')
+D1_SERVER_PORT = int(os.getenv('D1_SERVER_PORT', '8787'))
+D1_SERVER_DB = os.getenv('D1_SERVER_DB', ':memory:')
+D1_SERVER_LATENCY_MS = float(os.getenv('D1_SERVER_LATENCY_MS', '0'))
+D1_SERVER_JITTER_MS = float(os.getenv('D1_SERVER_JITTER_MS', '0'))
+D1_SERVER_RATE_LIMIT = float(os.getenv('D1_SERVER_RATE_LIMIT', '0'))
+D1_SERVER_THROTTLE_RATE = float(os.getenv('D1_SERVER_THROTTLE_RATE', '0'))
+
+
+class D1Error(Exception):
+    pass
+
+
+class LocalD1:
+    """SQLite-backed stand-in for the Cloudflare D1 REST API, with optional latency and rate-limit injection"""
+
+    def __init__(self, db_path=D1_SERVER_DB, latency_ms=D1_SERVER_LATENCY_MS, jitter_ms=D1_SERVER_JITTER_MS,
+                 rate_limit=D1_SERVER_RATE_LIMIT, throttle_rate=D1_SERVER_THROTTLE_RATE):
+        self.conn = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        # Requests per second before answering 429 (0 disables), and the share of requests throttled at random
+        self.rate_limit = rate_limit
+        self.throttle_rate = throttle_rate
+        self.window_started = time.monotonic()
+        self.window_requests = 0
+        self.requests = 0
+        self.statements = 0
+        self.rows_written = 0
+        self.rate_limited = 0
+        self.errors = 0
+
+    def app(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_get('/client/v4/accounts/{account_id}/d1/database/{database_id}', self.handle_database)
+        app.router.add_post('/client/v4/accounts/{account_id}/d1/database/{database_id}/query', self.handle_query)
+        return app
+
+    def _throttled(self):
+        now = time.monotonic()
+        if now - self.window_started >= 1:
+            self.window_started = now
+            self.window_requests = 0
+        self.window_requests += 1
+        if self.rate_limit and self.window_requests > self.rate_limit:
+            return True
+        return random.random() < self.throttle_rate
+
+    async def _admit(self):
+        """Apply injected latency; returns a 429 response when the request should be rejected"""
+        self.requests += 1
+        delay = self.latency_ms + random.uniform(0, self.jitter_ms)
+        if delay:
+            await asyncio.sleep(delay / 1000)
+        if self._throttled():
+            self.rate_limited += 1
+            return web.json_response(
+                {"success": False, "result": [], "errors": [{"code": 971, "message": "Please wait and consider throttling your request speed"}], "messages": []},
+                status=429, headers={'Retry-After': '1'}
+            )
+        return None
+
+    async def handle_database(self, request):
+        rejected = await self._admit()
+        if rejected is not None:
+            return rejected
+        database_id = request.match_info['database_id']
+        return web.json_response({"success": True, "result": {"uuid": database_id, "name": database_id},
+                                  "errors": [], "messages": []})
+
+    async def handle_query(self, request):
+        rejected = await self._admit()
+        if rejected is not None:
+            return rejected
+        try:
+            body = await request.json()
+        except ValueError:
+            return self._error(400, "Request body is not valid JSON")
+        statements = body['batch'] if 'batch' in body else [body]
+        try:
+            results = self.run(statements)
+        except (D1Error, sqlite3.Error) as e:
+            self.errors += 1
+            return self._error(400, str(e))
+        return web.json_response({"success": True, "result": results, "errors": [], "messages": []})
+
+    def _error(self, status, message):
+        return web.json_response({"success": False, "result": [], "errors": [{"code": 7500, "message": message}],
+                                  "messages": []}, status=status)
+
+    def run(self, statements):
+        """Execute statements in one transaction, like D1 does for a batch"""
+        results = []
+        self.conn.execute('BEGIN')
+        try:
+            for statement in statements:
+                results.append(self._execute(statement.get('sql') or '', statement.get('params') or []))
+            self.conn.execute('COMMIT')
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+        return results
+
+    def _execute(self, sql, params):
+        if len(params) > D1_MAX_PARAMS:
+            raise D1Error(f"too many SQL variables: {len(params)} > {D1_MAX_PARAMS}")
+        started = time.monotonic()
+        before = self.conn.total_changes
+        cursor = self.conn.execute(sql, params)
+        rows = []
+        if cursor.description:
+            names = [column[0] for column in cursor.description]
+            rows = [dict(zip(names, row)) for row in cursor.fetchall()]
+        changes = self.conn.total_changes - before
+        self.statements += 1
+        self.rows_written += changes
+        return {
+            "results": rows,
+            "success": True,
+            "meta": {
+                "changes": changes,
+                "last_row_id": cursor.lastrowid or 0,
+                "rows_read": len(rows),
+                "rows_written": changes,
+                "duration": (time.monotonic() - started) * 1000
+            }
+        }
+
+    def report(self):
+        print(f"[INFO] Local D1: {self.requests} requests, {self.statements} statements, "
+              f"{self.rows_written} rows written, {self.rate_limited} rate-limited, {self.errors} errors")
+
+
+async def start_server(local_d1, host=D1_SERVER_HOST, port=D1_SERVER_PORT):
+    """Serve local_d1 in the running event loop; returns the runner to clean up and the API base URL"""
+    runner = web.AppRunner(local_d1.app())
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    return runner, f"http://{host}:{port}/client/v4"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a local SQLite database behind the Cloudflare D1 REST API.')
+    parser.add_argument('--host', type=str, default=D1_SERVER_HOST)
+    parser.add_argument('--port', type=int, default=D1_SERVER_PORT)
+    parser.add_argument('--db', type=str, default=D1_SERVER_DB, help='SQLite file, or :memory:')
+    parser.add_argument('--latency_ms', type=float, default=D1_SERVER_LATENCY_MS, help='Added delay per request')
+    parser.add_argument('--jitter_ms', type=float, default=D1_SERVER_JITTER_MS, help='Extra random delay per request')
+    parser.add_argument('--rate_limit', type=float, default=D1_SERVER_RATE_LIMIT, help='Requests per second before 429 (0 = off)')
+    parser.add_argument('--throttle_rate', type=float, default=D1_SERVER_THROTTLE_RATE, help='Share of requests answered with 429')
+    args = parser.parse_args()
+
+    local_d1 = LocalD1(args.db, args.latency_ms, args.jitter_ms, args.rate_limit, args.throttle_rate)
+    print(f"[INFO] Set CLOUDFLARE_API_BASE_URL=http://{args.host}:{args.port}/client/v4 to use this server")
+    try:
+        web.run_app(local_d1.app(), host=args.host, port=args.port)
+    finally:
+        local_d1.report()
+
+
+if __name__ == "__main__":
+    main()
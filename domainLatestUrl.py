@@ -9,7 +9,7 @@ import re
 import os
 import logging
 from urllib.parse import quote, urlparse, parse_qs
-import random
+from rate_limit import default_rate_limiter
 import logging
 
 browser = setup_chrome()
@@ -209,9 +209,19 @@ class DomainMonitor:
 
             try:
                 tab=browser.new_tab()
-                
+
+                # Google is paced by its adaptive per-host rate instead of a fixed random delay
+                limiter = default_rate_limiter()
+                google = limiter.host(search_url) if limiter else None
+                if google:
+                    google.acquire_blocking()
+                started = time.monotonic()
                 tab.get(search_url)              
                 html=tab.html
+                if google:
+                    # A CAPTCHA or "unusual traffic" page is Google's 429
+                    blocked = '/sorry/' in (tab.url or '') or 'unusual traffic' in html
+                    google.feedback(429 if blocked else 200, time.monotonic() - started)
                 if page == 0:  # Extract total result count only on the first page
                     soup = BeautifulSoup(html, 'html.parser')
                     result_stats = soup.select_one('#result-stats')
@@ -231,9 +241,6 @@ class DomainMonitor:
                 all_results.extend(results)
                 self.logger.info(f"Found {len(results)} results for {site} on page {page + 1}")
 
-                # Random delay to avoid requests being too fast
-                time.sleep(random.uniform(2, 5))
-
                 if page + 1 >= total_pages:
                     self.logger.info(f"Reached the last page based on total results for {site}")
                     break
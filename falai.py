@@ -1,58 +1,36 @@
-import os
 import aiohttp
 import asyncio
 from bs4 import BeautifulSoup
 from datetime import datetime
 from dotenv import load_dotenv
+from d1_client import D1Client
+from rate_limit import paced, report_rates
+from sitemap import SitemapRules, SitemapState, crawl_sitemaps
 import re
 
 # Load environment variables
 load_dotenv()
 
-D1_DATABASE_ID = os.getenv('CLOUDFLARE_D1_DATABASE_ID')
-CLOUDFLARE_ACCOUNT_ID = os.getenv('CLOUDFLARE_ACCOUNT_ID')
-CLOUDFLARE_API_TOKEN = os.getenv('CLOUDFLARE_API_TOKEN')
-
 # Constants
-CLOUDFLARE_BASE_URL = f"https://api.cloudflare.com/client/v4/accounts/{CLOUDFLARE_ACCOUNT_ID}/d1/database/{D1_DATABASE_ID}"
 ROOT_SITEMAP_URL = "https://fal.ai/sitemap.xml"
-HEADERS = {
-    "Authorization": f"Bearer {CLOUDFLARE_API_TOKEN}",
-    "Content-Type": "application/json",
-}
+# Model pages are in the first sitemap; its API, examples and edit subpages all count for the model page
+SITEMAP_RULES = SitemapRules(follow=r'/sitemap-0\.xml$', rewrite=[(r'/api', ''), (r'/examples', ''), (r'/edit', '')],
+                             keep=r'/models/')
+
+# Shared D1 client (pooled connections, bounded in-flight queries, retries)
+d1 = D1Client()
+# Validators and entries of each sitemap, so unchanged ones are skipped or answered with a 304
+sitemaps = SitemapState('falai')
 
 # Semaphore for controlling concurrency
 MAX_CONCURRENT_REQUESTS = 50  # Adjust based on system capabilities
 semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
 
-# Helper: Parse a sitemap and return all <loc> URLs
-async def parse_sitemap(url, session):
-    async with semaphore:
-        try:
-            async with session.get(url) as response:
-                response.raise_for_status()
-                text = await response.text()
-                soup = BeautifulSoup(text, "xml")
-                urls= [loc.text for loc in soup.find_all("loc")]
-                cleanurls=[]
-                for url in urls:
-                    url=url.replace('/api','')
-                    url=url.replace('/examples','')
-                    url=url.replace('/edit','')
-
-                    if '/models/' in model_url==False:
-                        continue
-                 cleanurls.append(url)
-                
-        except aiohttp.ClientError as e:
-            print(f"[ERROR] Failed to fetch sitemap {url}: {e}")
-            return []
-
 # Helper: Fetch model page and extract run count
 async def get_model_runs(url, session):
     async with semaphore:
         try:
-            async with session.get(url) as response:
+            async with paced(session, 'GET', url) as response:
                 response.raise_for_status()
                 text = await response.text()
                 soup = BeautifulSoup(text, "html.parser")
@@ -77,7 +55,7 @@ async def get_model_runs(url, session):
             return None
 
 # Helper: Create table in the database
-async def create_table_if_not_exists(session):
+async def create_table_if_not_exists():
     create_table_sql = """
     CREATE TABLE IF NOT EXISTS replicate_model_data (
         id SERIAL PRIMARY KEY,
@@ -87,67 +65,51 @@ async def create_table_if_not_exists(session):
         updateAt TEXT
     );
     """
-    payload = {"sql": create_table_sql}
-    url = f"{CLOUDFLARE_BASE_URL}/query"
-    try:
-        async with session.post(url, headers=HEADERS, json=payload) as response:
-            response.raise_for_status()
-            print("[INFO] Table replicate_model_data checked/created successfully.")
-    except aiohttp.ClientError as e:
-        print(f"[ERROR] Failed to create table: {e}")
+    if await d1.query(create_table_sql) is not None:
+        print("[INFO] Table replicate_model_data checked/created successfully.")
+    else:
+        print("[ERROR] Failed to create table.")
 
 # Helper: Insert or update model data
-async def upsert_model_data(model_url, run_count, session):
+async def upsert_model_data(model_url, run_count):
     current_time = datetime.utcnow().isoformat()
-    sql = f"""
+    sql = """
     INSERT INTO replicate_model_data (model_url, run_count, createAt, updateAt)
-    VALUES ('{model_url}', {run_count}, '{current_time}', '{current_time}')
+    VALUES (?, ?, ?, ?)
     ON CONFLICT (model_url) DO UPDATE
-    SET run_count = {run_count}, 
-        updateAt = '{current_time}',
+    SET run_count = excluded.run_count, 
+        updateAt = excluded.updateAt,
         createAt = replicate_model_data.createAt;
     """
-    payload = {"sql": sql}
-    url = f"{CLOUDFLARE_BASE_URL}/query"
-    try:
-        async with session.post(url, headers=HEADERS, json=payload) as response:
-            response.raise_for_status()
-            print(f"[INFO] Data upserted for {model_url} with {run_count} runs.")
-    except aiohttp.ClientError as e:
-        print(f"[ERROR] Failed to upsert data for {model_url}: {e}")
+    params = [model_url, run_count, current_time, current_time]
+    if await d1.query(sql, params) is not None:
+        print(f"[INFO] Data upserted for {model_url} with {run_count} runs.")
+    else:
+        print(f"[ERROR] Failed to upsert data for {model_url}.")
 
 # Main workflow
 async def process_model_url(model_url, session):
     print(f"[INFO] Processing model: {model_url}")
     run_count = await get_model_runs(model_url, session)
     if run_count is not None:
-        await upsert_model_data(model_url, run_count, session)
+        await upsert_model_data(model_url, run_count)
 
 async def main():
     print("[INFO] Starting sitemap parsing...")
-    async with aiohttp.ClientSession() as session:
-        await create_table_if_not_exists(session)
-
-        # Parse the root sitemap
-        subsitemaps = await parse_sitemap(ROOT_SITEMAP_URL, session)
-        if not subsitemaps:
-            print("[ERROR] No subsitemaps found.")
-            return
+    async with aiohttp.ClientSession() as session, d1:
+        await create_table_if_not_exists()
 
+        # Model pages are scraped as soon as their sitemap has parsed
         tasks = []
-        for subsitemap_url in subsitemaps:
-            if subsitemap_url != 'https://fal.ai/sitemap-0.xml':
-                print(f"[INFO] Skipping unsupported sitemap: {subsitemap_url}")
-                continue
-
-            print(f"[INFO] Parsing subsitemap: {subsitemap_url}")
-            model_urls = await parse_sitemap(subsitemap_url, session)
-
-            for model_url in model_urls:
-                
-                tasks.append(process_model_url(model_url, session))
+        async for model_url, _ in crawl_sitemaps(session, ROOT_SITEMAP_URL, SITEMAP_RULES, state=sitemaps):
+            tasks.append(asyncio.ensure_future(process_model_url(model_url, session)))
+        if not tasks:
+            print("[ERROR] No model URLs found in the sitemaps.")
 
         await asyncio.gather(*tasks)
+    report_rates()
+    sitemaps.report()
+    sitemaps.close()
     print("[INFO] Sitemap parsing complete.")
 
 # Run the script
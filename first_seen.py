@@ -0,0 +1,138 @@
+import os
+import time
+import asyncio
+import datetime
+from cdx_client import CDXClient
+from cdx_query import page_history_scan
+from cc_index import CCIndexClient
+
+# Stop waiting on the other sources once one of them returns a capture at or before this timestamp ('' = off)
+FIRST_SEEN_STOP_BEFORE = os.getenv('FIRST_SEEN_STOP_BEFORE', '')
+FIRST_SEEN_TIMEOUT = float(os.getenv('FIRST_SEEN_TIMEOUT', '90'))
+# A source whose average lookup takes longer than this sits out the next FIRST_SEEN_SKIP_FOR lookups
+FIRST_SEEN_SLOW_SECONDS = float(os.getenv('FIRST_SEEN_SLOW_SECONDS', '30'))
+FIRST_SEEN_SKIP_FOR = int(os.getenv('FIRST_SEEN_SKIP_FOR', '20'))
+# Pages of Wayback captures read per URL; collapse=urlkey keeps one row per distinct page
+FIRST_SEEN_IA_PAGES = int(os.getenv('FIRST_SEEN_IA_PAGES', '5'))
+# Common Crawl is searched crawl by crawl, so only the crawls of the last N days are asked
+FIRST_SEEN_CC_DAYS = int(os.getenv('FIRST_SEEN_CC_DAYS', '730'))
+
+
+class SourceStats:
+    """Latency and outcome counters of one first-seen source"""
+
+    def __init__(self, name):
+        self.name = name
+        self.lookups = 0
+        self.found = 0
+        self.failures = 0
+        self.cancelled = 0
+        self.skipped = 0
+        self.avg_seconds = None
+        self.skip_left = 0
+
+    def record(self, seconds):
+        # Exponentially weighted, so a source that recovers is trusted again within a few lookups
+        self.avg_seconds = seconds if self.avg_seconds is None else 0.7 * self.avg_seconds + 0.3 * seconds
+
+
+class FirstSeen:
+    """Earliest capture of a URL across archive sources (Wayback, Common Crawl), queried concurrently"""
+
+    def __init__(self, sources, stop_before=FIRST_SEEN_STOP_BEFORE, timeout=FIRST_SEEN_TIMEOUT,
+                 slow_seconds=FIRST_SEEN_SLOW_SECONDS, skip_for=FIRST_SEEN_SKIP_FOR):
+        # sources maps a name to an async function url -> earliest timestamp or None
+        self.sources = sources
+        self.stop_before = str(stop_before or '')
+        self.timeout = timeout
+        self.slow_seconds = slow_seconds
+        self.skip_for = skip_for
+        self.stats = {name: SourceStats(name) for name in sources}
+
+    def _active(self):
+        active = []
+        for name, stats in self.stats.items():
+            if stats.skip_left > 0:
+                stats.skip_left -= 1
+                stats.skipped += 1
+            else:
+                active.append(name)
+        return active
+
+    async def _timed(self, name, url):
+        stats = self.stats[name]
+        started = time.monotonic()
+        try:
+            timestamp = await asyncio.wait_for(self.sources[name](url), self.timeout)
+        except Exception as e:
+            # Any error stays with its source, so the others still answer the lookup
+            stats.failures += 1
+            print(f"⚠ First-seen lookup of {url} on {name} failed: {str(e) or type(e).__name__}")
+            timestamp = None
+        stats.record(time.monotonic() - started)
+        stats.lookups += 1
+        if timestamp:
+            stats.found += 1
+        if stats.avg_seconds > self.slow_seconds:
+            print(f"⚠ {name} averages {stats.avg_seconds:.1f}s per lookup, skipping it for the next {self.skip_for}")
+            stats.skip_left = self.skip_for
+        return name, timestamp
+
+    async def lookup(self, url):
+        """Earliest timestamp per source plus the overall 'earliest'; skipped or failed sources map to None"""
+        result = {name: None for name in self.sources}
+        tasks = {name: asyncio.ensure_future(self._timed(name, url)) for name in self._active()}
+        try:
+            for next_done in asyncio.as_completed(list(tasks.values())):
+                name, timestamp = await next_done
+                result[name] = timestamp
+                if timestamp and self.stop_before and timestamp <= self.stop_before:
+                    # Old enough to settle the question, so the slower sources are not waited for
+                    break
+        finally:
+            for name, task in tasks.items():
+                if not task.done():
+                    task.cancel()
+                    self.stats[name].cancelled += 1
+        timestamps = [timestamp for timestamp in result.values() if timestamp]
+        result['earliest'] = min(timestamps) if timestamps else None
+        return result
+
+    def report(self):
+        for stats in self.stats.values():
+            average = f"{stats.avg_seconds:.2f}s" if stats.avg_seconds is not None else 'n/a'
+            print(f"[INFO] First-seen source {stats.name}: {stats.lookups} lookups, {stats.found} found, "
+                  f"{stats.failures} failed, {stats.cancelled} cancelled after an early answer, {stats.skipped} skipped as slow, "
+                  f"average {average}")
+
+
+def wayback_source(session=None, pages=FIRST_SEEN_IA_PAGES):
+    """Earliest non-404 Wayback capture of a URL and the pages under it"""
+    async def earliest(url):
+        website_url = url.replace('https://', '').replace('http://', '').replace('www.', '')
+        query = page_history_scan(website_url).project('timestamp').limit(1000)
+        timestamps = []
+        async with CDXClient(session=session, fields=query.fields) as cdx:
+            async for rows, _ in cdx.iter_pages(query.params(), max_pages=pages):
+                timestamps.extend(timestamp for timestamp, in rows)
+        return min(timestamps) if timestamps else None
+    return earliest
+
+
+def common_crawl_source(session=None, indexes=None, days=FIRST_SEEN_CC_DAYS):
+    """Earliest Common Crawl capture of a URL across the crawls of the last `days` days"""
+    cc = CCIndexClient(session=session, indexes=indexes)
+    start = (datetime.datetime.utcnow() - datetime.timedelta(days=days)).strftime('%Y%m%d')
+
+    async def earliest(url):
+        # One client for every lookup, so collinfo.json is read once and the concurrency cap is shared
+        return await cc.first_seen(url.replace('https://', '').replace('http://', ''), start=start)
+    return earliest
+
+
+def default_first_seen(session=None, ia_map=None):
+    """Federated lookup over the Wayback Machine ('ia') and Common Crawl ('cc'); ia_map answers Wayback from a bulk scan"""
+    ia = wayback_source(session)
+    if ia_map is not None:
+        ia = ia_map.source(ia)
+    return FirstSeen({'ia': ia, 'cc': common_crawl_source(session)})
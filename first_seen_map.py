@@ -0,0 +1,184 @@
+import os
+import time
+import sqlite3
+import datetime
+from urllib.parse import urlsplit
+from cdx_client import CDXClient, CDXError
+from cdx_query import first_seen_scan
+from crawl_state import CrawlCheckpoint
+
+FIRST_SEEN_MAP_DIR = os.getenv('FIRST_SEEN_MAP_DIR', os.getenv('STAGE_DIR', 'state'))
+# A map scanned within this many hours answers lookups as it is; older ones get the captures since the last scan
+FIRST_SEEN_MAP_MAX_AGE_HOURS = float(os.getenv('FIRST_SEEN_MAP_MAX_AGE_HOURS', '24'))
+FIRST_SEEN_MAP_CONCURRENCY = int(os.getenv('FIRST_SEEN_MAP_CONCURRENCY', '4'))
+
+# First path segments of huggingface.co that are site sections rather than model owners
+HUB_RESERVED = {'api', 'blog', 'chat', 'collections', 'datasets', 'docs', 'enterprise', 'join', 'learn', 'login',
+                'models', 'new', 'notifications', 'organizations', 'papers', 'posts', 'pricing', 'privacy', 'search',
+                'settings', 'spaces', 'tasks', 'terms-of-service'}
+
+
+def _hub_path(url):
+    parts = urlsplit(url if '://' in url else f"https://{url}")
+    if not parts.hostname or not parts.hostname.endswith('huggingface.co'):
+        return []
+    return [part for part in parts.path.split('/') if part]
+
+
+def hub_model_url(url):
+    """https://huggingface.co/owner/name for any capture under a model page, else None"""
+    parts = _hub_path(url)
+    # Google results are spelled huggingface.co/models/owner/name
+    if parts and parts[0] == 'models':
+        parts = parts[1:]
+    if len(parts) < 2 or parts[0] in HUB_RESERVED:
+        return None
+    return f"https://huggingface.co/{parts[0]}/{parts[1]}"
+
+
+def hub_space_url(url):
+    """https://huggingface.co/spaces/owner/name for any capture under a Space, else None"""
+    parts = _hub_path(url)
+    if len(parts) < 3 or parts[0] != 'spaces':
+        return None
+    return f"https://huggingface.co/spaces/{parts[1]}/{parts[2]}"
+
+
+class FirstSeenMap:
+    """url -> earliest capture timestamp for everything under one prefix, built by one collapsed CDX scan"""
+
+    def __init__(self, name, prefix, normalize, path=None, max_age_hours=FIRST_SEEN_MAP_MAX_AGE_HOURS):
+        self.name = name
+        self.prefix = prefix
+        # normalize maps a capture URL to the key it counts for (e.g. its model page), or None to drop it
+        self.normalize = normalize
+        self.path = path or os.path.join(FIRST_SEEN_MAP_DIR, f'first_seen_{name}.db')
+        self.max_age = max_age_hours * 3600
+        self.checkpoint = CrawlCheckpoint(f'first_seen_{name}')
+        self.hits = 0
+        self.misses = 0
+        self.fallback_found = 0
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS first_seen (
+            url TEXT PRIMARY KEY,
+            timestamp TEXT NOT NULL
+        )
+        """)
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS scans (
+            prefix TEXT PRIMARY KEY,
+            scanned_until TEXT NOT NULL,
+            scanned_at REAL NOT NULL
+        )
+        """)
+        self.conn.commit()
+
+    def key(self, url):
+        return self.normalize(url) or url
+
+    def get(self, url):
+        row = self.conn.execute("SELECT timestamp FROM first_seen WHERE url = ?", (self.key(url),)).fetchone()
+        return row[0] if row else None
+
+    def record(self, rows):
+        """Merge (key, timestamp) pairs, keeping the earlier timestamp for keys already in the map"""
+        self.conn.executemany(
+            """
+            INSERT INTO first_seen (url, timestamp) VALUES (?, ?)
+            ON CONFLICT (url) DO UPDATE SET timestamp = MIN(first_seen.timestamp, excluded.timestamp)
+            """,
+            rows
+        )
+
+    def size(self):
+        return self.conn.execute("SELECT COUNT(*) FROM first_seen").fetchone()[0]
+
+    def last_scan(self):
+        """(scanned_until timestamp, scanned_at epoch) of the last finished scan, or (None, None)"""
+        row = self.conn.execute("SELECT scanned_until, scanned_at FROM scans WHERE prefix = ?", (self.prefix,)).fetchone()
+        return row if row else (None, None)
+
+    def stale(self):
+        _, scanned_at = self.last_scan()
+        return scanned_at is None or time.time() - scanned_at > self.max_age
+
+    async def refresh(self, session=None, force=False, concurrency=FIRST_SEEN_MAP_CONCURRENCY):
+        """Scan the prefix (only captures since the last scan once one finished) and merge the earliest per key"""
+        if not force and not self.stale() and not self.checkpoint.in_progress(self.prefix):
+            print(f"✓ First-seen map {self.name} is fresh ({self.size()} URLs)")
+            return 0
+        since, _ = self.last_scan()
+        # A scan interrupted by a failure or timeout resumes at its next page with its original window
+        progress = self.checkpoint.prefix(self.prefix, since=since,
+                                          started=datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S'))
+        since = progress['params'].get('since')
+        query = first_seen_scan(self.prefix)
+        if since:
+            # Day granularity overlaps the last scan a little; MIN makes re-reading those captures harmless
+            query.between(since[:8])
+        print(f"✓ Scanning {self.prefix} for the first-seen map {self.name} "
+              f"({'captures since ' + since[:8] if since else 'full history'})")
+        merged = 0
+        try:
+            async with CDXClient(session=session, fields=query.fields, concurrency=concurrency) as cdx:
+                async for page, rows, total in cdx.iter_shards(query.params(), int(progress['resume_key'] or 0)):
+                    earliest = {}
+                    for timestamp, original in rows:
+                        key = self.normalize(original)
+                        if key and (key not in earliest or timestamp < earliest[key]):
+                            earliest[key] = timestamp
+                    self.record(earliest.items())
+                    self.conn.commit()
+                    self.checkpoint.advance(self.prefix, page + 1, len(rows))
+                    merged += len(earliest)
+                cdx.report()
+        except CDXError as e:
+            print(f"✗ First-seen scan of {self.prefix} stopped, the next run resumes it: {e}")
+            return merged
+        self.checkpoint.finish(self.prefix)
+        self.conn.execute(
+            """
+            INSERT INTO scans (prefix, scanned_until, scanned_at) VALUES (?, ?, ?)
+            ON CONFLICT (prefix) DO UPDATE SET scanned_until = excluded.scanned_until, scanned_at = excluded.scanned_at
+            """,
+            (self.prefix, progress['params']['started'], time.time())
+        )
+        self.conn.commit()
+        print(f"✓ First-seen map {self.name}: merged {merged} page keys, {self.size()} URLs in the map")
+        return merged
+
+    def source(self, fallback):
+        """A FirstSeen source answering from the map; only URLs missing from it go to fallback, whose answers are kept"""
+        async def earliest(url):
+            timestamp = self.get(url)
+            if timestamp:
+                self.hits += 1
+                return timestamp
+            self.misses += 1
+            timestamp = await fallback(url)
+            if timestamp:
+                self.fallback_found += 1
+                self.record([(self.key(url), timestamp)])
+                self.conn.commit()
+            return timestamp
+        return earliest
+
+    def report(self):
+        print(f"✓ First-seen map {self.name}: {self.hits} answered from the map, {self.misses} fell back to a per-URL "
+              f"lookup ({self.fallback_found} found and added), {self.size()} URLs in the map")
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+def hub_models_map():
+    """First-seen map of Hugging Face model pages, from one scan of huggingface.co/"""
+    return FirstSeenMap('hub_models', 'huggingface.co/', hub_model_url)
+
+
+def hub_spaces_map():
+    """First-seen map of Hugging Face Spaces, from one scan of huggingface.co/spaces/"""
+    return FirstSeenMap('hub_spaces', 'huggingface.co/spaces/', hub_space_url)
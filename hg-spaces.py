@@ -1,31 +1,28 @@
-import os
-import requests
 import asyncio
-from aiohttp import ClientSession, ClientTimeout
+from aiohttp import ClientTimeout
 from bs4 import BeautifulSoup
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
+from d1_client import D1Client
+from rate_limit import paced, report_rates
+from sitemap import iter_sitemap
+from model_stage import ModelStage
 import re
 import aiohttp
-from collect_data_wayback import collect_data_wayback,exact_url_timestamp
-from waybackpy import WaybackMachineCDXServerAPI
-import cdx_toolkit
+from collect_data_wayback import exact_url_timestamp_async
+from crawl_state import CrawlCheckpoint
+from first_seen import default_first_seen
+from first_seen_map import hub_spaces_map
 from domainLatestUrl import DomainMonitor
 from hgSpacePopular import bulk_scrape_and_save_space_urls
 # Load environment variables
 load_dotenv()
 
-D1_DATABASE_ID = os.getenv('CLOUDFLARE_D1_DATABASE_ID')
-CLOUDFLARE_ACCOUNT_ID = os.getenv('CLOUDFLARE_ACCOUNT_ID')
-CLOUDFLARE_API_TOKEN = os.getenv('CLOUDFLARE_API_TOKEN')
-
 # Constants
-CLOUDFLARE_BASE_URL = f"https://api.cloudflare.com/client/v4/accounts/{CLOUDFLARE_ACCOUNT_ID}/d1/database/{D1_DATABASE_ID}"
-HEADERS = {
-    "Authorization": f"Bearer {CLOUDFLARE_API_TOKEN}",
-    "Content-Type": "application/json",
-}
-ccisopen=False
+# Shared D1 client (pooled connections, bounded in-flight queries, retries)
+d1 = D1Client()
+# Last stats pushed to D1, used to skip unchanged models
+stage = ModelStage('huggingface_spaces_data')
 
 # Concurrency limit
 SEM_LIMIT = 20
@@ -33,10 +30,8 @@ SEM_LIMIT = 20
 # Helper: Parse a sitemap and return all <loc> URLs
 async def parse_sitemap(session, url):
     try:
-        async with session.get(url) as response:
-            response.raise_for_status()
-            soup = BeautifulSoup(await response.text(), "xml")
-            return [loc.text for loc in soup.find_all("loc")]
+        # Entries are parsed as the body streams in, so a huge (or .xml.gz) sitemap never sits in memory whole
+        return [loc async for loc, _ in iter_sitemap(session, url)]
     except Exception as e:
         print(f"[ERROR] Failed to fetch sitemap {url}: {e}")
         return []
@@ -46,7 +41,7 @@ async def get_model_runs(session, item):
     try:
         url=item.get('model_url')
         # https://huggingface.co/spaces/AP123/IllusionDiffusion/discussions/94
-        async with session.get(url) as response:
+        async with paced(session, 'GET', url) as response:
             response.raise_for_status()
             soup = BeautifulSoup(await response.text(), "html.parser")
             run_span = soup.find("button", class_="flex items-center border-l px-1.5 py-1 text-gray-400 hover:bg-gray-50 focus:bg-gray-100 focus:outline-none dark:hover:bg-gray-900 dark:focus:bg-gray-800")
@@ -71,7 +66,7 @@ async def get_model_runs(session, item):
         return item
 
 # Helper: Create table in the database
-async def create_table_if_not_exists(session):
+async def create_table_if_not_exists():
     create_table_sql = """
     CREATE TABLE IF NOT EXISTS huggingface_spaces_data (
         id SERIAL PRIMARY KEY,
@@ -83,154 +78,57 @@ async def create_table_if_not_exists(session):
         updateAt TEXT
     );
     """
-    payload = {"sql": create_table_sql}
-    url = f"{CLOUDFLARE_BASE_URL}/query"
-    async with session.post(url, headers=HEADERS, json=payload) as response:
-        response.raise_for_status()
-        result = await response.json()
-        
-        if result.get("success"):
-            print("[INFO] Table huggingface_spaces_data checked/created successfully.")
-            return True  # Assuming table creation was successful
-        return False  # Assuming table already existed
-
-import aiohttp
-import json
-import os
-
-async def get_existing_model_data():
-    payload = {
-        "sql": "SELECT * FROM huggingface_spaces_data;"    }
-    url = f"{CLOUDFLARE_BASE_URL}/query"
-
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, headers=HEADERS, json=payload) as response:
-            if response.status != 200:
-                print(f"Error: Received HTTP {response.status}")
-                return []
-
-            response_data = await response.json()
-            print('quety===',response_data)
-            if not response_data.get('success'):
-                print(f"API Error: {response_data.get('errors')}")
-                return []
-
-            result = response_data.get('result')[0].get('results')
-            if not result:
-                print("No result found.")
-                return []
+    if await d1.query(create_table_sql) is not None:
+        print("[INFO] Table huggingface_spaces_data checked/created successfully.")
+        return True
+    return False
 
-            # Return all rows of data
-            return result
+# Helper: Stream the stored model URLs page by page instead of loading the whole table
+def iter_existing_models():
+    return d1.iter_pages('huggingface_spaces_data', ['model_url'])
 
 
 # Helper: Check if there is any data in the table
-async def is_table_populated(session):
-    check_data_sql = "SELECT COUNT(*) AS count FROM huggingface_spaces_data;"
-    payload = {"sql": check_data_sql}
-    url = f"{CLOUDFLARE_BASE_URL}/query"
-
-    try:
-        async with session.post(url, headers=HEADERS, json=payload) as response:
-            response.raise_for_status()
-            result = await response.json()
-            if result.get("success"):
-                count = result.get("result")[0].get("count")
-                print('===',result.get('successs'))
-                return True
-            return False
-    except aiohttp.ClientError as e:
-        print(f"[ERROR] Failed to check table data: {e}")
-        return False
-    except Exception as e:
-        print(f"[ERROR] Unexpected error while checking table data: {e}")
-        return False
+async def is_table_populated():
+    rows = await d1.rows("SELECT 1 AS found FROM huggingface_spaces_data LIMIT 1;")
+    print('table populated', bool(rows))
+    return bool(rows)
 
 
 # Helper: Insert or update model data with retry and exception handling
-async def get_model_date(session, item, max_retries=3, retry_delay=5):
-    current_time = datetime.utcnow().isoformat()
+async def get_model_date(first_seen, item):
     model_url=item.get('model_url')
     print('Try to find first index date of', model_url)
-    user_agent = "check huggingface model's user agent"
-    wayback_createAt = None
-    cc_createAt = None    
-
-    # try:
-        # cdx_api = WaybackMachineCDXServerAPI(model_url, user_agent)
-        # oldest = cdx_api.oldest()
-        # if oldest.datetime_timestamp:
-            # wayback_createAt = oldest.datetime_timestamp.isoformat()
-        # print('==WaybackMachineCDXServerAPI=', wayback_createAt)
-    # except Exception as e:
-        # print('WaybackMachineCDXServerAPI failed:', e)
-
-    current_date = datetime.now()
-    start_date = current_date - timedelta(days=365)
-    start_date = int(start_date.strftime('%Y%m%d'))
-    current_date = int(current_date.strftime('%Y%m%d'))
-    wayback_createAt=exact_url_timestamp(model_url)
-    # for t in ['cc','ia']:
-        # if ccisopen==False and t=='cc':
-            # continue
-        # try:
-            # cdx = cdx_toolkit.CDXFetcher(source=t)
-            # for obj in cdx.iter(model_url, from_ts=start_date, to=current_date,limit=1, cc_sort='ascending'):
-                # if t=='cc':
-                
-                    # cc_createAt = obj.get('timestamp')
-                # if t=='ia':
-                    # wayback_createAt = obj.get('timestamp')
-                
-        # except Exception as e:
-            # print('t failed:', e)
-    item['wayback_createAt']=wayback_createAt
-    item['cc_createAt']=cc_createAt
-
-async def upsert_model_data(session,item, max_retries=3, retry_delay=5):
+    # Wayback and Common Crawl are asked concurrently; each column keeps its own source's earliest capture
+    dates=await first_seen.lookup(model_url)
+    item['wayback_createAt']=dates.get('ia')
+    item['cc_createAt']=dates.get('cc')
+    print('first seen', model_url, dates)
+
+# Helper: Build the upsert statement for a model's latest stats
+def build_upsert_statement(model_url, stats):
     current_time = datetime.utcnow().isoformat()
-
-    model_url=item.get('model_url')
-    run_count=item.get('run_count')
-    google_indexAt=item.get('google_indexAt',None)
-    wayback_createAt=item.get('wayback_createAt',None)
-    cc_createAt=item.get('cc_createAt',None)
-    
-    sql = f"""
+    sql = """
     INSERT INTO huggingface_spaces_data (model_url, run_count, google_indexAt,wayback_createAt, cc_createAt, updateAt)
-    VALUES ('{model_url}', {run_count}, 
-    
-            {f"'{google_indexAt}'" if google_indexAt else 'NULL'}, 
-            {f"'{wayback_createAt}'" if wayback_createAt else 'NULL'}, 
-            {f"'{cc_createAt}'" if cc_createAt else 'NULL'}, 
-            '{current_time}')
+    VALUES (?, ?, ?, ?, ?, ?)
     ON CONFLICT (model_url) DO UPDATE
-    SET run_count = {run_count}, 
-        updateAt = '{current_time}',
+    SET run_count = excluded.run_count, 
+        updateAt = excluded.updateAt,
         google_indexAt = COALESCE(huggingface_spaces_data.google_indexAt, EXCLUDED.google_indexAt),
         wayback_createAt = COALESCE(huggingface_spaces_data.wayback_createAt, EXCLUDED.wayback_createAt),
         cc_createAt = COALESCE(huggingface_spaces_data.cc_createAt, EXCLUDED.cc_createAt);
     """
-    payload = {"sql": sql}
-    url = f"{CLOUDFLARE_BASE_URL}/query"
-
-    for attempt in range(max_retries):
-        try:
-            async with session.post(url, headers=HEADERS, json=payload) as response:
-                response.raise_for_status()
-                print(f"[INFO] Data upserted for {model_url} with {run_count} runs.")
-                return
-        except aiohttp.ClientError as e:
-            print(f"[ERROR] Attempt {attempt + 1} failed: {e}")
-            if attempt < max_retries - 1:
-                print(f"[INFO] Retrying in {retry_delay} seconds...")
-                await asyncio.sleep(retry_delay)
-        except Exception as e:
-            print(f"[ERROR] Unexpected error on attempt {attempt + 1}: {e}")
-            if attempt < max_retries - 1:
-                print(f"[INFO] Retrying in {retry_delay} seconds...")
-                await asyncio.sleep(retry_delay)
-    print(f"[ERROR] Failed to upsert data for {model_url} after {max_retries} attempts.")
+    params = [model_url, stats['run_count'], stats['google_indexAt'] or None,
+              stats['wayback_createAt'] or None, stats['cc_createAt'] or None, current_time]
+    return {"sql": sql, "params": params}
+
+# Helper: Stage a model's stats locally; stage.sync pushes the changed ones at the end of the run
+def stage_model_data(item):
+    stage.stage(item.get('model_url'),
+                run_count=item.get('run_count'),
+                google_indexAt=item.get('google_indexAt'),
+                wayback_createAt=item.get('wayback_createAt'),
+                cc_createAt=item.get('cc_createAt'))
 
 # Process a single model URL
 async def process_model_url(semaphore, session, item):
@@ -241,10 +139,10 @@ async def process_model_url(semaphore, session, item):
         print(f"[INFO] save statics: {item}")
         
         if item is not None:
-            await upsert_model_data(session, item)
+            stage_model_data(item)
 async def process_popular_model(semaphore, session, item):
     async with semaphore:
-        await upsert_model_data(session, item)
+        stage_model_data(item)
 
 # Main function
 async def main():
@@ -254,118 +152,146 @@ async def main():
     supportgooglesearch=True
     baseUrl='https://huggingface.co/spaces/'
     
-    async with aiohttp.ClientSession(timeout=timeout) as session:
-        print("[INFO] Starting sitemap parsing...")
-        await create_table_if_not_exists(session)
-        is_populated = await is_table_populated(session)
+    # The backfill can return early, so the rate report and stage close run on every way out
+    try:
+        async with aiohttp.ClientSession(timeout=timeout) as session, d1:
+            print("[INFO] Starting sitemap parsing...")
+            await create_table_if_not_exists()
+            is_populated = await is_table_populated()
         
-        if is_populated==False:
-            print('Using Wayback Machine as initial')
-            current_date = datetime.now()
-            start_date = current_date - timedelta(days=730)
-            file_path = 'hg.txt'
-            items=exact_url_timestamp(
-                baseUrl,
-                max_count=5000,
-                start_date=int(start_date.strftime('%Y%m%d')),
-                end_date=int(current_date.strftime('%Y%m%d')),
+            # A backfill interrupted by a failure or timeout resumes from its checkpoint even once rows exist
+            backfill = CrawlCheckpoint('huggingface_spaces_backfill')
+            if is_populated==False or backfill.in_progress():
+                print('Using Wayback Machine as initial')
+                current_date = datetime.now()
+                start_date = current_date - timedelta(days=730)
+                file_path = 'hg.txt'
+                unique_items = {}
+
+                # Each CDX chunk is cleaned, processed and synced to D1 as soon as it arrives
+                async def process_chunk(chunk):
+                    cleanitems=[]
+                    print('start clean urls',)
+                    uniqueurls=[]
+                    for item in chunk:
+                        url=item.get('url')
+                        wayback_createAt=item.get('timestamp')
+                        print('--',url)
+                        if '?' in url:
+                            url=url.split('?')[0]
+                        modelname=url.replace(baseUrl,'').split('/')
+                        if len(modelname)<2:
+                            print('invalid url',url)
+                            continue
+
+                        url=baseUrl+modelname[0]+'/'+modelname[1]
+                        if url in unique_items:
+                            print('model url added before',url)
                 
-                chunk_size=1000,
-                sleep=5
-            )
-            # if os.path.exists(file_path):
-                # with open(file_path, encoding='utf8') as f:
-                    # model_urls = [line.strip() for line in f]
-            print('items',len(items))
-            print("[INFO] wayback check parsing complete.")
-            unique_items = {}
-
-            if len(items)<1:
-                return 
-            cleanitems=[]
-            print('start clean urls',)
-            uniqueurls=[]
-            for item in items:
-                url=item.get('url')
-                wayback_createAt=item.get('timestamp')
-                print('--',url)
-                if '?' in url:
-                    url=url.split('?')[0]
-                modelname=url.replace(baseUrl,'').split('/')
-                if len(modelname)<2:
-                    print('invalid url',url)
-                    continue
-
-                url=baseUrl+modelname[0]+'/'+modelname[1]
-                if url in unique_items:
-                    print('model url added before',url)
-                
-                    existing_item = unique_items[url]
+                            existing_item = unique_items[url]
                     
-                    existing_wayback_createAt = existing_item.get('wayback_createAt')
-                    if wayback_createAt < existing_wayback_createAt:
-                        existing_item['wayback_createAt'] = wayback_createAt
-                        print('new model url date is older',wayback_createAt)
+                            existing_wayback_createAt = existing_item.get('wayback_createAt')
+                            if wayback_createAt < existing_wayback_createAt:
+                                existing_item['wayback_createAt'] = wayback_createAt
+                                print('new model url date is older',wayback_createAt)
 
-                else:
-                    print('add new model url ',url)
+                        else:
+                            print('add new model url ',url)
                     
-                    item['model_url'] = url
-                    item['wayback_createAt'] = wayback_createAt
-                    unique_items[url] = item
-            cleanitems = list(unique_items.values())
-
-            print('cleanitems',len(cleanitems))
-            await asyncio.gather(*(process_model_url(semaphore, session, item) for item in cleanitems))
-        modelurls=[]
-        existing_models=await get_existing_model_data()
-        print('existing models count',len(existing_models))
-        
-        if existing_models!=[]:
-            modelurls=[  item.get('model_url')   for item in existing_models]            
-        if supportsitemap:
-            url_domain = 'https://huggingface.co'
-            ROOT_SITEMAP_URL = f"{url_domain}/sitemap.xml"
-            new_models = await parse_sitemap(session, ROOT_SITEMAP_URL)
-            print("[INFO] Sitemap parsing complete.")
-            # model_urls = list(set(model_urls))
-            
-        if supportgooglesearch:
-            d=DomainMonitor()
-            search_model_urls=[]
-            results=d.monitor_site(site=baseUrl,time_range='24h')
-            print('==',results)
-            print("[INFO] google search check  complete.")
-            new_models={}
-            if results and len(results)>1:
-                gindex=int(datetime.now().strftime('%Y%m%d'))
-                items=[]
-                for i in results:
-                    item={}
-                    url=i.get('url')
-                    if '?' in url:
-                        url=url.split('?')[0]
-                    modelname=url.replace(baseUrl,'').split('/')
-                    if len(modelname)<4:
-                        continue
-                    url=baseUrl+modelname[0]+'/'+modelname[1]
-                    if url in modelurls:
-                        continue
-                    item['model_url']=url
-
-                    item['google_indexAt']=gindex
-                    if not url in modelurls:
-                        existing_models.append(item)
-            print('clean google search url item',cleanitems)
+                            item['model_url'] = url
+                            item['wayback_createAt'] = wayback_createAt
+                            unique_items[url] = item
+                            cleanitems.append(item)
+
+                    print('cleanitems',len(cleanitems))
+                    await asyncio.gather(*(process_model_url(semaphore, session, item) for item in cleanitems))
+                    # Sync before the checkpoint moves past this chunk, so a resumed run never refetches it
+                    await stage.sync(d1, build_upsert_statement)
+
+                items=await exact_url_timestamp_async(
+                    baseUrl,
+                    max_count=5000,
+                    start_date=int(start_date.strftime('%Y%m%d')),
+                    end_date=int(current_date.strftime('%Y%m%d')),
+                
+                    chunk_size=1000,
+                    checkpoint=backfill,
+                    on_chunk=process_chunk,
+                    session=session
+                )
+                # if os.path.exists(file_path):
+                    # with open(file_path, encoding='utf8') as f:
+                        # model_urls = [line.strip() for line in f]
+                print('items',len(items))
+                print("[INFO] wayback check parsing complete.")
+
+                if len(items)<1:
+                    return 
+            # Refresh stored models one page at a time; only their URLs are kept for dedup below
+            modelurls=set()
+            async for page in iter_existing_models():
+                existing_models=[{'model_url': row.get('model_url')} for row in page]
+                modelurls.update(item['model_url'] for item in existing_models)
+                await asyncio.gather(*(process_model_url(semaphore, session, item) for item in existing_models))
+            print('existing models count',len(modelurls))
+            if supportsitemap:
+                url_domain = 'https://huggingface.co'
+                ROOT_SITEMAP_URL = f"{url_domain}/sitemap.xml"
+                new_models = await parse_sitemap(session, ROOT_SITEMAP_URL)
+                print("[INFO] Sitemap parsing complete.")
+                # model_urls = list(set(model_urls))
             
+            if supportgooglesearch:
+                d=DomainMonitor()
+                search_model_urls=[]
+                results=d.monitor_site(site=baseUrl,time_range='24h')
+                print('==',results)
+                print("[INFO] google search check  complete.")
+                new_models={}
+                new_items=[]
+                if results and len(results)>1:
+                    gindex=int(datetime.now().strftime('%Y%m%d'))
+                    items=[]
+                    for i in results:
+                        item={}
+                        url=i.get('url')
+                        if '?' in url:
+                            url=url.split('?')[0]
+                        modelname=url.replace(baseUrl,'').split('/')
+                        if len(modelname)<4:
+                            continue
+                        url=baseUrl+modelname[0]+'/'+modelname[1]
+                        if url in modelurls:
+                            continue
+                        item['model_url']=url
+
+                        item['google_indexAt']=gindex
+                        if not url in modelurls:
+                            new_items.append(item)
+                print('clean google search url item',new_items)
             
-            await asyncio.gather(*(process_model_url(semaphore, session, item) for item in existing_models))
+                # Newly found pages have no archive dates yet; Wayback dates come from one prefix scan kept on disk
+                first_seen_map=hub_spaces_map()
+                if new_items:
+                    await first_seen_map.refresh(session)
+                first_seen=default_first_seen(session, ia_map=first_seen_map)
+                await asyncio.gather(*(get_model_date(first_seen, item) for item in new_items))
+                first_seen.report()
+                first_seen_map.report()
+                first_seen_map.close()
+                await asyncio.gather(*(process_model_url(semaphore, session, item) for item in new_items))
     
-        print("[INFO] url detect complete.")
-        print("[INFO] update popular space count.")
+            print("[INFO] url detect complete.")
+            print("[INFO] update popular space count.")
+
+            popularspaces=bulk_scrape_and_save_space_urls()
+            await asyncio.gather(*(process_popular_model(semaphore, session, item) for item in popularspaces))
 
-        popularspaces=bulk_scrape_and_save_space_urls()
-        await asyncio.gather(*(process_popular_model(semaphore, session, item) for item in popularspaces))
+            # Only models whose stats moved since the last push are written to D1
+            await stage.sync(d1, build_upsert_statement)
+    finally:
+        report_rates()
+        stage.close()
 
 
 
@@ -0,0 +1,210 @@
+import os
+import time
+import zlib
+import sqlite3
+import hashlib
+import datetime
+from urllib.parse import urlsplit, urlencode, parse_qsl
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# What reading back a missing, truncated or corrupt blob can raise; any of them makes the entry a miss
+UNREADABLE_ERRORS = (OSError, zlib.error) + ((zstandard.ZstdError,) if zstandard is not None else ())
+
+# Set HTTP_CACHE=0 to always go to the network
+HTTP_CACHE = os.getenv('HTTP_CACHE', '1').lower() not in ('0', 'false', 'no')
+HTTP_CACHE_DIR = os.getenv('HTTP_CACHE_DIR', os.path.join('.cache', 'http'))
+HTTP_CACHE_MAX_BYTES = int(os.getenv('HTTP_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+# A query whose window is still open can gain captures, so it is only trusted briefly
+HTTP_CACHE_OPEN_TTL = float(os.getenv('HTTP_CACHE_OPEN_TTL', '3600'))
+HTTP_CACHE_CLOSED_TTL = float(os.getenv('HTTP_CACHE_CLOSED_TTL', str(30 * 24 * 3600)))
+# Captures keep arriving in the index for a while after they are taken
+HTTP_CACHE_SETTLE_DAYS = float(os.getenv('HTTP_CACHE_SETTLE_DAYS', '3'))
+
+
+def normalize_url(url, params=None):
+    """One spelling per query: lower-case scheme and host, query params sorted, params merged in"""
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    for key, value in (params.items() if isinstance(params, dict) else params or []):
+        for item in (value if isinstance(value, (list, tuple)) else [value]):
+            query.append((key, str(item)))
+    return f"{parts.scheme.lower()}://{parts.netloc.lower()}{parts.path}?{urlencode(sorted(query))}"
+
+
+def window_closed(params, settle_days=HTTP_CACHE_SETTLE_DAYS):
+    """Whether a CDX query's to= lies far enough in the past that its answer can no longer change"""
+    params = params if isinstance(params, dict) else dict(params or [])
+    end = str(params.get('to') or '')
+    if not end:
+        return False
+    # A partial timestamp like 2024 or 202403 covers everything up to the end of that period
+    end = end + '99999999999999'[len(end):]
+    settled = (datetime.datetime.utcnow() - datetime.timedelta(days=settle_days)).strftime('%Y%m%d%H%M%S')
+    return end < settled
+
+
+class ResponseCache:
+    """On-disk response cache: entries keyed by normalized URL point at compressed bodies stored by content hash"""
+
+    def __init__(self, directory=HTTP_CACHE_DIR, max_bytes=HTTP_CACHE_MAX_BYTES, open_ttl=HTTP_CACHE_OPEN_TTL,
+                 closed_ttl=HTTP_CACHE_CLOSED_TTL):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.open_ttl = open_ttl
+        self.closed_ttl = closed_ttl
+        self.codec = 'zstd' if zstandard is not None else 'zlib'
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.bytes_served = 0
+        os.makedirs(os.path.join(directory, 'blobs'), exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(directory, 'index.db'))
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                blob TEXT NOT NULL,
+                codec TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        # Blob reference checks run on every delete, eviction included
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_blob ON entries (blob)")
+        self.db.commit()
+
+    def _blob_path(self, blob):
+        return os.path.join(self.directory, 'blobs', blob[:2], blob)
+
+    def _compress(self, body):
+        if self.codec == 'zstd':
+            return zstandard.ZstdCompressor(level=3).compress(body)
+        return zlib.compress(body, 6)
+
+    def _decompress(self, data, codec):
+        if codec == 'zstd':
+            if zstandard is None:
+                return None
+            return zstandard.ZstdDecompressor().decompress(data)
+        return zlib.decompress(data)
+
+    def get(self, url, params=None):
+        """Cached body bytes for the query, or None on a miss or an expired entry"""
+        key = hashlib.sha256(normalize_url(url, params).encode('utf8')).hexdigest()
+        row = self.db.execute("SELECT blob, codec, expires_at FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        blob, codec, expires_at = row
+        body = None
+        if expires_at > time.time():
+            try:
+                with open(self._blob_path(blob), 'rb') as f:
+                    body = self._decompress(f.read(), codec)
+            except UNREADABLE_ERRORS as e:
+                print(f"⚠ Dropping unreadable cache entry for {url}: {e}")
+        else:
+            self.expired += 1
+        if body is None:
+            self._delete(key)
+            self.misses += 1
+            return None
+        self.db.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+        self.db.commit()
+        self.hits += 1
+        self.bytes_served += len(body)
+        return body
+
+    def put(self, url, body, params=None, closed=None):
+        """Store a response body; closed (by default derived from the to= param) picks the long or short TTL"""
+        normalized = normalize_url(url, params)
+        key = hashlib.sha256(normalized.encode('utf8')).hexdigest()
+        if closed is None:
+            closed = window_closed(parse_qsl(urlsplit(normalized).query))
+        blob = f"{hashlib.sha256(body).hexdigest()}.{self.codec}"
+        path = self._blob_path(blob)
+        if not os.path.exists(path):
+            # Same body under several queries (empty pages, repeated windows) is stored once
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(self._compress(body))
+            os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+        now = time.time()
+        old = self.db.execute("SELECT blob FROM entries WHERE key = ?", (key,)).fetchone()
+        self.db.execute(
+            "INSERT OR REPLACE INTO entries (key, url, blob, codec, size, expires_at, last_access) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, normalized, blob, self.codec, size, now + (self.closed_ttl if closed else self.open_ttl), now)
+        )
+        self.db.commit()
+        if old and old[0] != blob:
+            self._drop_blob_if_unused(old[0])
+        self._evict()
+
+    def _delete(self, key, commit=True):
+        """Remove one entry; returns the bytes freed, which is 0 while another entry still uses its blob"""
+        row = self.db.execute("SELECT blob, size FROM entries WHERE key = ?", (key,)).fetchone()
+        self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+        if commit:
+            self.db.commit()
+        if row and self._drop_blob_if_unused(row[0]):
+            return row[1]
+        return 0
+
+    def _drop_blob_if_unused(self, blob):
+        """Delete the blob file once no entry points at it; returns whether it went"""
+        if self.db.execute("SELECT 1 FROM entries WHERE blob = ? LIMIT 1", (blob,)).fetchone() is not None:
+            return False
+        try:
+            os.remove(self._blob_path(blob))
+        except FileNotFoundError:
+            pass
+        return True
+
+    def size(self):
+        """Bytes on disk: each distinct blob counted once"""
+        row = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT blob, size FROM entries)").fetchone()
+        return row[0]
+
+    def _evict(self):
+        # Least recently used entries go first until the distinct blobs fit in max_bytes
+        total = self.size()
+        if total <= self.max_bytes:
+            return
+        # The total is summed once; each delete takes off the size of a blob only when its last entry goes
+        for key, in self.db.execute("SELECT key FROM entries ORDER BY last_access").fetchall():
+            total -= self._delete(key, commit=False)
+            self.evictions += 1
+            if total <= self.max_bytes:
+                break
+        self.db.commit()
+
+    def report(self):
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups * 100 if lookups else 0
+        print(f"✓ HTTP cache ({self.codec}, {self.directory}): {self.hits} hits, {self.misses} misses ({rate:.0f}% hit rate), "
+              f"{self.expired} expired, {self.evictions} evicted, {self.bytes_served / 1024:.0f} KB served, "
+              f"{self.size() / 1024:.0f} KB on disk")
+
+    def close(self):
+        self.db.close()
+
+
+_default_cache = None
+
+
+def default_cache():
+    """The process-wide cache under HTTP_CACHE_DIR, or None when HTTP_CACHE=0"""
+    global _default_cache
+    if not HTTP_CACHE:
+        return None
+    if _default_cache is None:
+        _default_cache = ResponseCache()
+    return _default_cache
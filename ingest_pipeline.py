@@ -0,0 +1,79 @@
+import os
+import time
+import asyncio
+
+PIPELINE_WORKERS = int(os.getenv('PIPELINE_WORKERS', '4'))
+PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', '10000'))
+PIPELINE_LOG_INTERVAL = float(os.getenv('PIPELINE_LOG_INTERVAL', '5'))
+
+# Marks the end of the stream for each writer worker
+_DONE = object()
+
+
+async def _produce(records, parse, queue, stats, workers):
+    """Parser stage: turn raw records into rows and push them into the bounded queue"""
+    async def put(row):
+        if queue.full():
+            stats['backpressure_events'] += 1
+            started = time.monotonic()
+            await queue.put(row)
+            stats['backpressure_seconds'] += time.monotonic() - started
+        else:
+            queue.put_nowait(row)
+
+    if hasattr(records, '__aiter__'):
+        async for record in records:
+            stats['records'] += 1
+            row = parse(record)
+            if row is not None:
+                stats['rows'] += 1
+                await put(row)
+    else:
+        for record in records:
+            stats['records'] += 1
+            row = parse(record)
+            if row is not None:
+                stats['rows'] += 1
+                await put(row)
+    for _ in range(workers):
+        await queue.put(_DONE)
+
+
+async def _consume(queue, writer, stats):
+    """Writer stage: drain rows from the queue into the D1 writer"""
+    while True:
+        row = await queue.get()
+        if row is _DONE:
+            return
+        await writer.add(row)
+        stats['written'] += 1
+
+
+async def _monitor(queue, stats):
+    while True:
+        await asyncio.sleep(PIPELINE_LOG_INTERVAL)
+        print(f"[INFO] Pipeline: parsed {stats['rows']} rows, handed {stats['written']} to writer, "
+              f"queue depth {queue.qsize()}/{queue.maxsize}, "
+              f"producer blocked {stats['backpressure_events']} times ({stats['backpressure_seconds']:.1f}s)")
+
+
+async def run_pipeline(records, parse, writer, workers=PIPELINE_WORKERS, queue_size=PIPELINE_QUEUE_SIZE):
+    """Parse records and write the resulting rows with N concurrent writer workers over a bounded queue"""
+    queue = asyncio.Queue(maxsize=queue_size)
+    stats = {'records': 0, 'rows': 0, 'written': 0, 'backpressure_events': 0, 'backpressure_seconds': 0.0}
+    started = time.monotonic()
+    monitor = asyncio.create_task(_monitor(queue, stats))
+    tasks = [asyncio.create_task(_produce(records, parse, queue, stats, workers))]
+    tasks += [asyncio.create_task(_consume(queue, writer, stats)) for _ in range(workers)]
+    try:
+        # A failing stage raises here instead of leaving the others blocked on the queue
+        await asyncio.gather(*tasks)
+    finally:
+        monitor.cancel()
+        for task in tasks:
+            task.cancel()
+    elapsed = time.monotonic() - started
+    print(f"[INFO] Pipeline done: {stats['records']} records, {stats['rows']} rows in {elapsed:.1f}s "
+          f"with {workers} writers; producer blocked {stats['backpressure_events']} times "
+          f"({stats['backpressure_seconds']:.1f}s) on a {queue_size}-row queue")
+    return stats
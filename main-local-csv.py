@@ -6,6 +6,9 @@ import asyncio
 from dotenv import load_dotenv
 load_dotenv()
 import datetime
+from cdx_lines import CDXLineReader
+from cdx_client import CDX_API_URL
+from cdx_query import archive_listing_scan
 
 proxy_url=None
 domain='toolify.ai'
@@ -26,9 +29,6 @@ if domain is None:
 os.makedirs('./result', exist_ok=True)
 
 async def geturls(domain):
-    no_subs=None
-    subs_wildcard = "*." if not no_subs else ""
-    # subs_wildcard=''
     domainname = domain.replace("https://", "")
     domainname=domainname.split('/')[0]
     csv_file=f'waybackmachines-{domainname}.csv'
@@ -36,12 +36,8 @@ async def geturls(domain):
 
     outfile=Recorder(f'result/{domainname}-{date_today}.csv')
 
-    query_url = f"http://web.archive.org/cdx/search/cdx?url={subs_wildcard}{domain}/&fl=timestamp,original,mimetype,statuscode,digest"
-    query_url = f"http://web.archive.org/cdx/search/cdx?url={domain}/&matchType=prefix&fl=timestamp,original"
-    fileter='&statuscode=200'
-    filter="&collapse=digest"
-    filter="&collapse=urlkey"
-    query_url=query_url+filter
+    query = archive_listing_scan(domain)
+    query_url = f"{CDX_API_URL}?{query.query_string()}"
 
     # For example: http://web.archive.org/cdx/search/cdx?url=archive.org&from=2010&to=2011
 
@@ -59,43 +55,17 @@ async def geturls(domain):
                                 headers=headers,
                 # auth=auth.prepare_request, 
                 timeout=300000)     
-            count=0
-            while True:
-                raw = await resp.content.read(10240)  # 每次读取1024字节
-                if not raw:
-                    break
-                # raw=await resp.text()
-                # print(raw)
-                try:
-
-                    raw = raw.decode('utf-8')
-                except UnicodeDecodeError:
-                    raw = raw.decode('latin-1')
-
-                if resp.status != 200:
+            if resp.status != 200:
                 # Handle different HTTP status codes
-                # return 
-                    print('not 200')
-            # Process the response
-                # print(raw)
-                lines = raw.splitlines()
-                fieldnames = ['date', 'url']
-
-                print(len(lines))
-                count=count+len(lines)
-                file_exists = os.path.isfile(csv_file)
-
-                for line in lines:
-                    if ' ' in line:
-                        # parts = line.split(' ')
-                        # timestamp, original_url = parts[0], parts[1]
-                        # data={'date':timestamp,'url':original_url}
-                        data={'url':line.strip()}
-                        with open(csv_file, mode='a', newline='', encoding='utf-8') as f:
-                            writer = csv.DictWriter(f, fieldnames=fieldnames)
-                            # if not file_exists:
-                                # writer.writeheader()
-                            writer.writerow(data)
+                print('not 200')
+            fieldnames = ['date', 'url']
+            # Read the body as bytes so a line split across two chunks is carried over, not cut in half
+            captures = CDXLineReader(resp.content)
+            with open(csv_file, mode='a', newline='', encoding='utf-8') as f:
+                writer = csv.DictWriter(f, fieldnames=fieldnames)
+                async for batch in captures.batches():
+                    writer.writerows({'date': timestamp, 'url': original_url} for timestamp, original_url in batch)
+            count = captures.captures
             print('============',count)
 
         except aiohttp.ClientError as e:
@@ -5,6 +5,13 @@ import asyncio
 import datetime
 from dotenv import load_dotenv
 import sys
+from d1_client import D1Client
+from d1_writer import BatchedD1Writer
+from ingest_pipeline import run_pipeline
+from watermarks import Watermarks
+from cdx_lines import CDXLineReader
+from cdx_client import CDX_API_URL
+from cdx_query import seller_scan
 
 load_dotenv()
 
@@ -62,103 +69,47 @@ def check_environment_variables():
 
     return required_vars
 
-async def check_url_exists(session, url, api_token, account_id, database_id):
-    """Check if URL already exists in the table"""
-    check_url = f"https://api.cloudflare.com/client/v4/accounts/{account_id}/d1/database/{database_id}/query"
-    
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_token}"
-    }
-    
-    payload = {
-        "sql": "SELECT COUNT(*) as count FROM wayback_sellerid_data WHERE url = ?",
-        "params": [url]
-    }
-
-    try:
-        async with session.post(check_url, headers=headers, json=payload) as response:
-            if response.status == 200:
-                data = await response.json()
-                if data.get('success') and data.get('result'):
-                    count = data['result'][0]['count']
-                    return count > 0
-            return False
-    except Exception as e:
-        print(f"✗ Error checking URL existence: {str(e)}")
-        return False
-
-async def test_cloudflare_connection(api_token, account_id, database_id):
+async def test_cloudflare_connection(d1):
     """Test connection to Cloudflare API"""
-    url = f"https://api.cloudflare.com/client/v4/accounts/{account_id}/d1/database/{database_id}"
-    
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_token}"
-    }
-    
-    print(f"\nTesting Cloudflare connection...")
-    print(f"URL: {url}")
     print("Current UTC time:", datetime.datetime.utcnow().isoformat())
-    
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers) as response:
-                response_text = await response.text()
-                print(f"Response Status: {response.status}")
-                print(f"Response Body: {response_text}")
-                
-                if response.status == 200:
-                    data = await response.json()
-                    if data.get('success'):
-                        print("✓ Cloudflare connection successful")
-                        return True
-                    else:
-                        print(f"✗ Cloudflare API error: {data}")
-                else:
-                    print(f"✗ HTTP Status {response.status}: {response_text}")
-                return False
-    except Exception as e:
-        print(f"✗ Connection error: {str(e)}")
-        return False
-
-async def write_to_cloudflare_d1(session, data, api_token, account_id, database_id):
-    """Write data to Cloudflare D1"""
-    url_exists = await check_url_exists(session, data['url'], api_token, account_id, database_id)
-    
-    if url_exists:
-        print(f"⚠ URL already exists, skipping: {data['url']}")
-        return
-
-    url = f"https://api.cloudflare.com/client/v4/accounts/{account_id}/d1/database/{database_id}/query"
-    
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_token}"
+    return await d1.test_connection()
+
+def parse_line(capture, current_time):
+    """Turn one (timestamp, original) CDX capture into a wayback_sellerid_data row"""
+    timestamp, url = capture
+    if '&seller=' in url:
+        url=url.split('&seller=')[-1]
+        if '&' in url:
+            url=url.split('&')[0]
+    if '?seller=' in url:
+        url=url.split('?seller=')[-1]
+        if '&' in url:
+            url=url.split('&')[0]
+    return {
+        "url": url,
+        "date": timestamp,
+        "updateAt": current_time
     }
-    
+
+async def save_lines(captures, d1):
+    """Parse CDX captures (a list or a streaming CDXLineReader) and write the new seller ids to D1"""
+    print("\nProcessing URLs...")
     current_time = datetime.datetime.utcnow().isoformat()
-    
-    payload = {
-        "sql": "INSERT INTO wayback_sellerid_data (url, date, updateAt) VALUES (?, ?, ?)",
-        "params": [data['url'], data['date'], current_time]
-    }
+    writer = BatchedD1Writer(d1, 'wayback_sellerid_data', ['url', 'date', 'updateAt'], newest_column='date')
+    await writer.load_known_keys('url')
 
-    try:
-        async with session.post(url, headers=headers, json=payload) as response:
-            if response.status == 200:
-                print(f"✓ Successfully inserted: {data['url']}")
-            else:
-                error_text = await response.text()
-                print(f"✗ Failed to insert: {data['url']}")
-                print(f"Error: {error_text}")
-    except Exception as e:
-        print(f"✗ Error writing to Cloudflare: {str(e)}")
+    stats = await run_pipeline(captures, lambda capture: parse_line(capture, current_time), writer)
+    await writer.close()
+
+    print(f"\n✓ Processing complete:")
+    print(f"  - Total URLs found: {stats['records']}")
+    print(f"  - URLs processed: {writer.rows_inserted}")
+    print(f"  - URLs skipped (already exist): {writer.rows_known + writer.rows_ignored}")
+    return writer
 
-async def geturls(domain, api_token, account_id, database_id, timeframe):
+async def geturls(domain, d1, timeframe):
     """Fetch URLs from Wayback Machine and store them"""
     domainname = domain.replace("https://", "").split('/')[0]
-    query_url = f"http://web.archive.org/cdx/search/cdx?url={domain}/&matchType=prefix&fl=timestamp,original&collapse=urlkey"
     
     try:
         timeframe_index = int(timeframe)
@@ -170,9 +121,13 @@ async def geturls(domain, api_token, account_id, database_id, timeframe):
         timeframe_index = 2
 
     start, end = get_time_range(filters[timeframe_index])
+    # Daily runs only ask for captures newer than the last one ingested for this domain
+    marks = Watermarks(d1)
+    start, end = await marks.window('wayback_sellerid_data', domain, start, end)
 
-    filter_str = f'&statuscode=200&from={start}&to={end}'
-    query_url = query_url + filter_str
+    # statuscode is a filter= expression; a bare &statuscode=200 param is ignored by the CDX server
+    query = seller_scan(domain).between(start, end)
+    query_url = f"{CDX_API_URL}?{query.query_string()}"
 
     headers = {
         'Referer': 'https://web.archive.org/',
@@ -186,60 +141,22 @@ async def geturls(domain, api_token, account_id, database_id, timeframe):
                     print(f"✗ Wayback Machine API returned status {resp.status}")
                     return
 
-                content = await resp.text()
-                lines = content.splitlines()
+                # Stream the body line by line instead of holding the whole CDX response in memory
+                captures = CDXLineReader(resp.content)
                 
                 os.makedirs('./result', exist_ok=True)
                 
-                print(f"\nProcessing {len(lines)} URLs...")
-                total_processed = 0
-                total_skipped = 0
-
-                for line in lines:
-                    if ' ' in line:
-                        parts = line.strip().split(' ')
-                        if len(parts) >= 2:
-                            url=parts[1]
-                            if '&seller=' in url:
-                                url=url.split('&seller=')[-1]
-                                if '&' in url:
-                                    url=url.split('&')[0]
-                            if '?seller=' in url:
-                                url=url.split('?seller=')[-1]
-                                if '&' in url:
-                                    url=url.split('&')[0]
-                            data = {
-                                "url": url,
-                                "date": parts[0]
-                            }
-                            await write_to_cloudflare_d1(session, data, api_token, account_id, database_id)
-                            
-                            # url_exists = await check_url_exists(session, data['url'], api_token, account_id, database_id)
-                            # if url_exists:
-                                # total_skipped += 1
-                            # else:
-                                # await write_to_cloudflare_d1(session, data, api_token, account_id, database_id)
-                                # total_processed += 1
-
-                print(f"\n✓ Processing complete:")
-                print(f"  - Total URLs found: {len(lines)}")
-                print(f"  - URLs processed: {total_processed}")
-                print(f"  - URLs skipped (already exist): {total_skipped}")
+                writer = await save_lines(captures, d1)
+                # Only captures that were written move the mark, and a failed row leaves it in place for a retry
+                if writer.rows_failed == 0 and writer.newest:
+                    await marks.advance('wayback_sellerid_data', domain, writer.newest)
 
         except Exception as e:
             print(f"✗ Error: {str(e)}")
 
-async def create_table(api_token, account_id, database_id):
+async def create_table(d1):
     """Create the wayback_data table if it doesn't exist"""
-    url = f"https://api.cloudflare.com/client/v4/accounts/{account_id}/d1/database/{database_id}/query"
-    
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_token}"
-    }
-    
-    payload = {
-        "sql": """
+    sql = """
         CREATE TABLE IF NOT EXISTS wayback_sellerid_data (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             url TEXT NOT NULL UNIQUE,
@@ -247,18 +164,12 @@ async def create_table(api_token, account_id, database_id):
             updateAt TEXT NOT NULL
         )
         """
-    }
     
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers, json=payload) as response:
-                if response.status == 200:
-                    print("✓ Table created/verified successfully")
-                else:
-                    error_text = await response.text()
-                    print(f"✗ Failed to create table: {error_text}")
-    except Exception as e:
-        print(f"✗ Error creating table: {str(e)}")
+    results = await d1.query(sql)
+    if results is not None:
+        print("✓ Table created/verified successfully")
+    else:
+        print("✗ Failed to create table")
 
 async def main():
     # Check environment variables
@@ -268,28 +179,26 @@ async def main():
     print(f"Current time (UTC): {datetime.datetime.utcnow().isoformat()}")
     
     # Test Cloudflare connection
-    if not await test_cloudflare_connection(
+    d1 = D1Client(
         env_vars['CLOUDFLARE_API_TOKEN'],
         env_vars['CLOUDFLARE_ACCOUNT_ID'],
         env_vars['CLOUDFLARE_D1_DATABASE_ID']
-    ):
+    )
+    if not await test_cloudflare_connection(d1):
+        await d1.close()
         sys.exit(1)
 
     # Create table
-    await create_table(
-        env_vars['CLOUDFLARE_API_TOKEN'],
-        env_vars['CLOUDFLARE_ACCOUNT_ID'],
-        env_vars['CLOUDFLARE_D1_DATABASE_ID']
-    )
+    await create_table(d1)
 
     # Process URLs
     await geturls(
         env_vars['DOMAIN'],
-        env_vars['CLOUDFLARE_API_TOKEN'],
-        env_vars['CLOUDFLARE_ACCOUNT_ID'],
-        env_vars['CLOUDFLARE_D1_DATABASE_ID'],
+        d1,
         env_vars['TIME_FRAME']
     )
 
+    await d1.close()
+
 if __name__ == "__main__":
     asyncio.run(main())
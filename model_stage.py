@@ -0,0 +1,133 @@
+import os
+import json
+import time
+import sqlite3
+
+STAGE_DIR = os.getenv('STAGE_DIR', 'state')
+STAGE_SYNC_BATCH = int(os.getenv('STAGE_SYNC_BATCH', '50'))
+# Unchanged sitemap URLs still re-scraped each run, least recently scraped first, so stats that move without a
+# lastmod change (run counts) keep refreshing: this share of them, and at least STAGE_REFRESH_MIN
+STAGE_REFRESH_FRACTION = float(os.getenv('STAGE_REFRESH_FRACTION', '0.05'))
+STAGE_REFRESH_MIN = int(os.getenv('STAGE_REFRESH_MIN', '50'))
+
+
+class ModelStage:
+    """Local SQLite record of the last stats pushed to D1 for each model, so a run only syncs what changed"""
+
+    def __init__(self, table, path=None):
+        self.table = table
+        self.path = path or os.path.join(STAGE_DIR, f'{table}.db')
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS staged_models (
+            model_url TEXT PRIMARY KEY,
+            stats TEXT NOT NULL,
+            pushed_stats TEXT,
+            staged_at REAL NOT NULL,
+            pushed_at REAL
+        )
+        """)
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS sitemap_snapshot (
+            model_url TEXT PRIMARY KEY,
+            lastmod TEXT,
+            scraped_at REAL NOT NULL
+        )
+        """)
+        self.conn.commit()
+        self.run_started = time.time()
+        self.planned = {}
+        self.snapshot = None
+        self.diff = None
+
+    def stage(self, model_url, **stats):
+        """Record the stats scraped for a model in this run"""
+        self.conn.execute(
+            """
+            INSERT INTO staged_models (model_url, stats, staged_at) VALUES (?, ?, ?)
+            ON CONFLICT (model_url) DO UPDATE SET stats = excluded.stats, staged_at = excluded.staged_at
+            """,
+            (model_url, json.dumps(stats, sort_keys=True), time.time())
+        )
+
+    def needs_scrape(self, model_url, lastmod):
+        """Whether a sitemap entry is new or its lastmod moved; unchanged ones are held for refresh_sample()"""
+        if self.snapshot is None:
+            self.snapshot = {model_url: (lastmod, scraped_at) for model_url, lastmod, scraped_at
+                             in self.conn.execute("SELECT model_url, lastmod, scraped_at FROM sitemap_snapshot")}
+            self.diff = {'new': 0, 'changed': 0, 'unchanged': []}
+        self.planned[model_url] = lastmod
+        if model_url not in self.snapshot:
+            self.diff['new'] += 1
+            return True
+        if lastmod and lastmod != self.snapshot[model_url][0]:
+            self.diff['changed'] += 1
+            return True
+        self.diff['unchanged'].append(model_url)
+        return False
+
+    def refresh_sample(self, refresh_fraction=STAGE_REFRESH_FRACTION, refresh_min=STAGE_REFRESH_MIN):
+        """Unchanged URLs due for a re-scrape once the whole sitemap has gone through needs_scrape()"""
+        if self.snapshot is None:
+            return []
+        new, changed, unchanged = self.diff['new'], self.diff['changed'], self.diff['unchanged']
+        # Rotating through the oldest scrapes refreshes every unchanged URL within 1 / refresh_fraction runs
+        unchanged.sort(key=lambda model_url: self.snapshot[model_url][1])
+        sample = unchanged[:min(len(unchanged), max(refresh_min, int(len(unchanged) * refresh_fraction)))]
+        print(f"[INFO] Sitemap diff for {self.table}: {len(self.planned)} URLs, {new} new, {changed} changed, "
+              f"{len(unchanged)} unchanged; scraping {new + changed + len(sample)} "
+              f"({len(sample)} unchanged as the refresh sample).")
+        self.snapshot = None
+        return sample
+
+    def mark_scraped(self, model_url):
+        """Record a successful scrape at the lastmod the sitemap gave for it, so the next run can diff against it"""
+        self.conn.execute(
+            """
+            INSERT INTO sitemap_snapshot (model_url, lastmod, scraped_at) VALUES (?, ?, ?)
+            ON CONFLICT (model_url) DO UPDATE SET lastmod = excluded.lastmod, scraped_at = excluded.scraped_at
+            """,
+            (model_url, self.planned.get(model_url), time.time())
+        )
+
+    def pending(self):
+        """Models staged in this run whose stats differ from what was last pushed"""
+        rows = self.conn.execute(
+            """
+            SELECT model_url, stats FROM staged_models
+            WHERE staged_at >= ? AND (pushed_stats IS NULL OR pushed_stats != stats)
+            """,
+            (self.run_started,)
+        ).fetchall()
+        return [(model_url, json.loads(stats)) for model_url, stats in rows]
+
+    async def sync(self, d1, build_statement, batch_size=STAGE_SYNC_BATCH):
+        """Push changed rows to D1 in bulk; build_statement(model_url, stats) returns a {sql, params} dict"""
+        self.conn.commit()
+        staged = self.conn.execute(
+            "SELECT COUNT(*) FROM staged_models WHERE staged_at >= ?", (self.run_started,)
+        ).fetchone()[0]
+        pending = self.pending()
+        pushed = 0
+        failed = 0
+        for i in range(0, len(pending), batch_size):
+            chunk = pending[i:i + batch_size]
+            results = await d1.batch([build_statement(model_url, stats) for model_url, stats in chunk])
+            if results is None:
+                failed += len(chunk)
+                continue
+            now = time.time()
+            self.conn.executemany(
+                "UPDATE staged_models SET pushed_stats = stats, pushed_at = ? WHERE model_url = ?",
+                [(now, model_url) for model_url, _ in chunk]
+            )
+            self.conn.commit()
+            pushed += len(chunk)
+        print(f"[INFO] Sync of {self.table}: {staged} models staged, {staged - len(pending)} unchanged and skipped, "
+              f"{pushed} pushed, {failed} failed.")
+        return pushed
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
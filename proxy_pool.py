@@ -0,0 +1,259 @@
+import os
+import time
+import random
+import asyncio
+import contextlib
+import aiohttp
+import requests
+
+try:
+    from aiohttp_socks import ProxyConnector
+except ImportError:
+    ProxyConnector = None
+
+# Newline-separated proxy lists to load (URLs of text files), and/or proxies given inline, comma-separated;
+# with neither set there is no pool and requests go out directly
+PROXY_LIST_URLS = [url.strip() for url in os.getenv('PROXY_LIST_URLS', '').split(',') if url.strip()]
+PROXIES = [proxy.strip() for proxy in os.getenv('PROXIES', '').split(',') if proxy.strip()]
+# Scheme assumed for bare host:port entries, as in the TheSpeedX socks5.txt list
+PROXY_DEFAULT_SCHEME = os.getenv('PROXY_DEFAULT_SCHEME', 'socks5')
+# Free lists hold thousands of entries; only a random sample of them is health-checked and used
+PROXY_SAMPLE = int(os.getenv('PROXY_SAMPLE', '200'))
+PROXY_CHECK_URL = os.getenv('PROXY_CHECK_URL', 'https://www.google.com/generate_204')
+PROXY_CHECK_TIMEOUT = float(os.getenv('PROXY_CHECK_TIMEOUT', '10'))
+PROXY_CHECK_INTERVAL = float(os.getenv('PROXY_CHECK_INTERVAL', '300'))
+PROXY_CHECK_CONCURRENCY = int(os.getenv('PROXY_CHECK_CONCURRENCY', '50'))
+# A proxy failing this many requests or checks in a row is evicted for the rest of the run
+PROXY_MAX_FAILURES = int(os.getenv('PROXY_MAX_FAILURES', '3'))
+# Keep the machine's own IP in the rotation as one more egress, scored like the proxies
+PROXY_INCLUDE_DIRECT = os.getenv('PROXY_INCLUDE_DIRECT', '1').lower() not in ('0', 'false', 'no')
+
+# Answers that mean the egress IP is blocked or throttled rather than the request being wrong
+BLOCKED_STATUSES = {403, 407, 429, 503}
+
+
+def load_proxy_list(url):
+    """Proxy URLs from a newline-separated list; bare host:port lines get PROXY_DEFAULT_SCHEME"""
+    proxies = []
+    try:
+        response = requests.get(url, timeout=30)
+        response.raise_for_status()
+    except Exception as e:
+        print(f"⚠ Could not fetch proxy list {url}: {e}")
+        return proxies
+    for line in response.text.splitlines():
+        line = line.strip()
+        if line and not line.startswith('#'):
+            proxies.append(line if '://' in line else f"{PROXY_DEFAULT_SCHEME}://{line}")
+    return proxies
+
+
+class Proxy:
+    """One egress (a proxy URL, or None for a direct connection) with its latency and success record"""
+
+    def __init__(self, url=None):
+        self.url = url
+        self.scheme = url.split('://', 1)[0].lower() if url else 'direct'
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.latency = None
+        self.checked_at = None
+        self.client = None
+
+    def __repr__(self):
+        return self.url or 'direct'
+
+    @property
+    def socks(self):
+        return self.scheme.startswith('socks')
+
+    def record(self, seconds, ok):
+        if ok:
+            self.successes += 1
+            self.consecutive_failures = 0
+            # Exponentially weighted, so a proxy that slows down loses its share within a few requests
+            self.latency = seconds if self.latency is None else 0.7 * self.latency + 0.3 * seconds
+        else:
+            self.failures += 1
+            self.consecutive_failures += 1
+
+    def score(self):
+        """Selection weight: success rate (smoothed) squared over latency, so fast reliable proxies get most traffic"""
+        success_rate = (self.successes + 1) / (self.successes + self.failures + 2)
+        return success_rate ** 2 / max(self.latency or PROXY_CHECK_TIMEOUT, 0.05)
+
+    def session(self, session):
+        """The session to send through: the caller's for direct and HTTP proxies, a per-proxy one for SOCKS"""
+        if not self.socks:
+            return session
+        if self.client is None or self.client.closed:
+            self.client = aiohttp.ClientSession(connector=ProxyConnector.from_url(self.url), timeout=session.timeout)
+        return self.client
+
+    def request_kwargs(self):
+        return {'proxy': self.url} if self.url and not self.socks else {}
+
+    async def close(self):
+        if self.client is not None and not self.client.closed:
+            await self.client.close()
+
+
+class ProxyPool:
+    """Health-checked egress pool: proxies are scored on latency and success, picked by weight, evicted when dead"""
+
+    def __init__(self, proxies=(), check_url=PROXY_CHECK_URL, check_timeout=PROXY_CHECK_TIMEOUT,
+                 check_interval=PROXY_CHECK_INTERVAL, check_concurrency=PROXY_CHECK_CONCURRENCY,
+                 max_failures=PROXY_MAX_FAILURES, include_direct=PROXY_INCLUDE_DIRECT):
+        self.check_url = check_url
+        self.check_timeout = aiohttp.ClientTimeout(total=check_timeout)
+        self.check_interval = check_interval
+        self.check_concurrency = check_concurrency
+        self.max_failures = max_failures
+        self.proxies = {}
+        self.evicted = 0
+        self.retired = []
+        self.loop = None
+        self.checker = None
+        self.starting = None
+        self.check_session = None
+        if include_direct:
+            self.proxies[None] = Proxy()
+        self.add(proxies)
+
+    def add(self, urls):
+        skipped = 0
+        for url in urls:
+            proxy = Proxy(url)
+            if proxy.socks and ProxyConnector is None:
+                skipped += 1
+                continue
+            self.proxies.setdefault(url, proxy)
+        if skipped:
+            print(f"⚠ Skipped {skipped} SOCKS proxies: pip install aiohttp_socks to use them")
+
+    def healthy(self):
+        """Egresses that have answered at least once and are not failing now"""
+        return [proxy for proxy in self.proxies.values()
+                if proxy.successes and proxy.consecutive_failures < self.max_failures]
+
+    def choose(self):
+        """Weighted random pick among healthy egresses, or None when nothing has answered yet"""
+        healthy = self.healthy()
+        if not healthy:
+            return None
+        return random.choices(healthy, weights=[proxy.score() for proxy in healthy])[0]
+
+    def record(self, proxy, seconds, ok):
+        proxy.record(seconds, ok)
+        # A proxy that never answered is dropped on its first failure; the direct connection is never evicted
+        if proxy.url is not None and (proxy.consecutive_failures >= self.max_failures or not proxy.successes):
+            if self.proxies.pop(proxy.url, None) is not None:
+                self.evicted += 1
+                # Requests still in flight on it finish first; its session is closed with the pool
+                self.retired.append(proxy)
+
+    async def check(self, proxy, semaphore):
+        ok = False
+        async with semaphore:
+            started = time.monotonic()
+            try:
+                session = proxy.session(self.check_session)
+                async with session.get(self.check_url, timeout=self.check_timeout, **proxy.request_kwargs()) as response:
+                    ok = response.status < 400
+            except Exception:
+                ok = False
+        proxy.checked_at = time.time()
+        self.record(proxy, time.monotonic() - started, ok)
+
+    async def check_all(self):
+        semaphore = asyncio.Semaphore(self.check_concurrency)
+        await asyncio.gather(*(self.check(proxy, semaphore) for proxy in list(self.proxies.values())))
+        print(f"✓ Proxy pool: {len(self.healthy())} healthy of {len(self.proxies)}, {self.evicted} evicted so far")
+
+    async def _check_forever(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            await self.check_all()
+
+    async def start(self):
+        """Check every proxy once, then keep re-checking in the background; safe to call from each request"""
+        loop = asyncio.get_running_loop()
+        if self.loop is loop:
+            return
+        # Concurrent first requests all wait on the same initial round of checks
+        if self.starting is None or self.starting.get_loop() is not loop:
+            self.starting = asyncio.ensure_future(self._start(loop))
+        await asyncio.shield(self.starting)
+
+    async def _start(self, loop):
+        # Sessions belong to the loop that made them, so a pool reused across asyncio.run calls starts over
+        for proxy in self.proxies.values():
+            proxy.client = None
+        self.check_session = aiohttp.ClientSession(timeout=self.check_timeout)
+        await self.check_all()
+        self.checker = asyncio.ensure_future(self._check_forever())
+        self.loop = loop
+
+    @contextlib.asynccontextmanager
+    async def request(self, session, method, url, **kwargs):
+        """session.request through the best-scoring egress; the outcome updates that egress's score"""
+        await self.start()
+        proxy = self.choose()
+        if proxy is None:
+            async with session.request(method, url, **kwargs) as response:
+                yield response
+            return
+        started = time.monotonic()
+        ok = False
+        try:
+            async with proxy.session(session).request(method, url, **proxy.request_kwargs(), **kwargs) as response:
+                # Scored on what the egress answered; an error the caller raises over a good answer is not its fault
+                ok = response.status not in BLOCKED_STATUSES
+                yield response
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            # Transport errors, including ones hit while the caller reads the body, count against the egress
+            ok = False
+            raise
+        finally:
+            self.record(proxy, time.monotonic() - started, ok)
+
+    def report(self):
+        ranked = sorted(self.healthy(), key=lambda proxy: proxy.score(), reverse=True)
+        top = ', '.join(f"{proxy} {proxy.latency:.2f}s {proxy.successes}/{proxy.successes + proxy.failures}"
+                        for proxy in ranked[:5])
+        print(f"✓ Proxy pool: {len(ranked)} healthy of {len(self.proxies)}, {self.evicted} evicted; top: {top or 'none'}")
+
+    async def close(self):
+        if self.checker is not None:
+            self.checker.cancel()
+        for proxy in list(self.proxies.values()) + self.retired:
+            await proxy.close()
+        if self.check_session is not None and not self.check_session.closed:
+            await self.check_session.close()
+        self.loop = None
+
+
+_default_pool = None
+
+
+def default_proxy_pool():
+    """The process-wide pool from PROXY_LIST_URLS / PROXIES, or None when neither is set"""
+    global _default_pool
+    if not PROXY_LIST_URLS and not PROXIES:
+        return None
+    if _default_pool is None:
+        proxies = list(PROXIES)
+        for url in PROXY_LIST_URLS:
+            proxies.extend(load_proxy_list(url))
+        random.shuffle(proxies)
+        _default_pool = ProxyPool(proxies[:PROXY_SAMPLE])
+    return _default_pool
+
+
+def proxied(session, method, url, pool=None, **kwargs):
+    """session.request(method, url) through the default proxy pool when one is configured, else directly"""
+    pool = default_proxy_pool() if pool is None else pool
+    if not pool:
+        return session.request(method, url, **kwargs)
+    return pool.request(session, method, url, **kwargs)
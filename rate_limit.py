@@ -0,0 +1,187 @@
+import os
+import time
+import asyncio
+import contextlib
+from urllib.parse import urlsplit
+import aiohttp
+from proxy_pool import proxied
+
+# Starting and ceiling request rates per host suffix, as host=start:max in requests per second
+RATE_LIMITS = os.getenv('RATE_LIMITS', 'archive.org=0.8:2,commoncrawl.org=0.5:2,huggingface.co=5:20,civitai.com=5:20,'
+                                       'replicate.com=5:20,google.com=0.3:0.5')
+RATE_DEFAULT = os.getenv('RATE_DEFAULT', '10:100')
+# Set RATE_LIMIT=0 to send requests unpaced
+RATE_LIMIT = os.getenv('RATE_LIMIT', '1').lower() not in ('0', 'false', 'no')
+RATE_MIN = float(os.getenv('RATE_MIN', '0.05'))
+# Healthy responses add this fraction of the starting rate; a throttled or slow one halves the rate
+RATE_INCREASE = float(os.getenv('RATE_INCREASE', '0.05'))
+RATE_DECREASE = float(os.getenv('RATE_DECREASE', '0.5'))
+# Responses in flight when the server pushes back arrive together; they count as one backoff per cooldown
+RATE_COOLDOWN = float(os.getenv('RATE_COOLDOWN', '5'))
+# A response is slow when it takes this many times the host's average latency (and at least RATE_SLOW_FLOOR seconds)
+RATE_SLOW_FACTOR = float(os.getenv('RATE_SLOW_FACTOR', '3'))
+RATE_SLOW_FLOOR = float(os.getenv('RATE_SLOW_FLOOR', '2'))
+
+# Counted as throttling in the report; any 5xx or failed request also backs off, as the server is likely overloaded
+THROTTLE_STATUSES = {429, 503}
+
+
+def _parse_limits(spec):
+    limits = {}
+    for entry in spec.split(','):
+        host, _, rates = entry.strip().partition('=')
+        if host and rates:
+            start, _, ceiling = rates.partition(':')
+            limits[host] = (float(start), float(ceiling or start))
+    return limits
+
+
+class HostLimiter:
+    """Token bucket for one host whose rate moves AIMD-style: up while responses are healthy, halved on pushback"""
+
+    def __init__(self, host, rate, max_rate, min_rate=RATE_MIN):
+        self.host = host
+        self.rate = rate
+        self.start_rate = rate
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.next_at = 0.0
+        self.paused_until = 0.0
+        self.last_backoff = 0.0
+        self.avg_latency = None
+        self.requests = 0
+        self.throttled = 0
+        self.slow = 0
+        self.backoffs = 0
+        self.first_at = None
+        self.last_at = None
+
+    def _reserve(self):
+        # One slot every 1/rate seconds; reserving moves next_at on, so concurrent callers queue up in order
+        now = time.monotonic()
+        slot = max(now, self.next_at, self.paused_until)
+        self.next_at = slot + 1 / self.rate
+        self.requests += 1
+        self.first_at = self.first_at or slot
+        self.last_at = slot
+        return slot - now
+
+    async def acquire(self):
+        delay = self._reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def acquire_blocking(self):
+        """acquire() for synchronous callers such as the browser-driven Google search"""
+        delay = self._reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    def feedback(self, status, seconds, retry_after=None):
+        """Adjust the rate from one response: status None means the request failed before an answer"""
+        slow = (self.avg_latency is not None
+                and seconds > max(RATE_SLOW_FLOOR, RATE_SLOW_FACTOR * self.avg_latency))
+        if status is not None and status < 500:
+            self.avg_latency = seconds if self.avg_latency is None else 0.8 * self.avg_latency + 0.2 * seconds
+        if retry_after:
+            try:
+                self.paused_until = max(self.paused_until, time.monotonic() + float(retry_after))
+            except ValueError:
+                pass
+        if status is None or status == 429 or status >= 500 or slow:
+            if status in THROTTLE_STATUSES:
+                self.throttled += 1
+            elif slow:
+                self.slow += 1
+            self.backoff(f"HTTP {status}" if status else f"{'slow' if slow else 'failed'} response ({seconds:.1f}s)")
+        elif status < 400:
+            self.rate = min(self.max_rate, self.rate + RATE_INCREASE * self.start_rate)
+
+    def backoff(self, reason):
+        now = time.monotonic()
+        if now - self.last_backoff < RATE_COOLDOWN:
+            return
+        self.last_backoff = now
+        self.backoffs += 1
+        old_rate = self.rate
+        self.rate = max(self.min_rate, self.rate * RATE_DECREASE)
+        print(f"⚠ {self.host} pushed back ({reason}), rate {old_rate:.2f} -> {self.rate:.2f} req/s")
+
+    def achieved_rate(self):
+        if not self.requests or self.last_at == self.first_at:
+            return 0.0
+        # requests - 1 intervals between the first and last slot
+        return (self.requests - 1) / (self.last_at - self.first_at)
+
+    def report(self):
+        latency = f"{self.avg_latency:.2f}s" if self.avg_latency is not None else 'n/a'
+        print(f"✓ Rate {self.host}: {self.requests} requests at {self.achieved_rate():.2f} req/s achieved, "
+              f"now {self.rate:.2f} req/s (max {self.max_rate:g}), {self.throttled} throttled, {self.slow} slow, "
+              f"{self.backoffs} backoffs, average latency {latency}")
+
+
+class RateLimiter:
+    """One HostLimiter per host, configured by the longest matching suffix in RATE_LIMITS"""
+
+    def __init__(self, limits=RATE_LIMITS, default=RATE_DEFAULT):
+        self.limits = _parse_limits(limits) if isinstance(limits, str) else dict(limits)
+        self.default = _parse_limits(f"*={default}")['*']
+        self.hosts = {}
+
+    def _key(self, hostname):
+        matches = [suffix for suffix in self.limits if hostname == suffix or hostname.endswith('.' + suffix)]
+        return max(matches, key=len) if matches else hostname
+
+    def host(self, url):
+        """The limiter for a URL's host; subdomains of a configured suffix (web.archive.org) share its bucket"""
+        key = self._key(urlsplit(url).hostname or '')
+        if key not in self.hosts:
+            rate, max_rate = self.limits.get(key, self.default)
+            self.hosts[key] = HostLimiter(key, rate, max_rate)
+        return self.hosts[key]
+
+    def report(self):
+        for limiter in self.hosts.values():
+            limiter.report()
+
+
+_default_limiter = None
+
+
+def default_rate_limiter():
+    """The process-wide limiter, so every client in a script shares one bucket per host; None when RATE_LIMIT=0"""
+    global _default_limiter
+    if not RATE_LIMIT:
+        return None
+    if _default_limiter is None:
+        _default_limiter = RateLimiter()
+    return _default_limiter
+
+
+def report_rates():
+    """Log the achieved request rate of every host the default limiter has paced"""
+    if _default_limiter is not None:
+        _default_limiter.report()
+
+
+@contextlib.asynccontextmanager
+async def paced(session, method, url, limiter=None, pool=None, **kwargs):
+    """proxied() request that waits for its host's token bucket; the response status and latency tune the rate"""
+    limiter = default_rate_limiter() if limiter is None else limiter
+    if not limiter:
+        async with proxied(session, method, url, pool=pool, **kwargs) as response:
+            yield response
+        return
+    host = limiter.host(url)
+    await host.acquire()
+    started = time.monotonic()
+    answered = False
+    try:
+        async with proxied(session, method, url, pool=pool, **kwargs) as response:
+            answered = True
+            host.feedback(response.status, time.monotonic() - started, response.headers.get('Retry-After'))
+            yield response
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        if not answered:
+            host.feedback(None, time.monotonic() - started)
+        raise
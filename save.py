@@ -3,6 +3,7 @@ from urllib.parse import urlparse, parse_qs, unquote
 import aiohttp
 import csv
 import os
+import re
 import asyncio
 import datetime
 from dotenv import load_dotenv
@@ -10,6 +11,12 @@ import sys
 from waybackpy import WaybackMachineCDXServerAPI
 from waybackpy.wrapper import Url
 import cdx_toolkit
+from d1_client import D1Client
+from d1_writer import BatchedD1Writer
+from ingest_pipeline import run_pipeline
+from cdx_lines import CDXLineReader
+from cdx_client import CDX_API_URL
+from cdx_query import hashtag_scan
 
 load_dotenv()
 
@@ -68,102 +75,11 @@ def check_environment_variables():
 
     return required_vars
 
-async def check_tag_exists(platform,session, tag, api_token, account_id, database_id):
-    """Check if URL already exists in the table"""
-    check_url = f"https://api.cloudflare.com/client/v4/accounts/{account_id}/d1/database/{database_id}/query"
-    
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_token}"
-    }
-    
-    payload = {
-        "sql": f"SELECT COUNT(*) as count FROM wayback_{platform}_hashtag_data WHERE tag = ?",
-        "params": [tag]
-    }
-    print('check existing sql',  f"SELECT COUNT(*) as count FROM wayback_{platform}_hashtag_data WHERE tag = ?"
-)
-    try:
-        async with session.post(check_url, headers=headers, json=payload) as response:
-            if response.status == 200:
-                data = await response.json()
-                if data.get('success') and data.get('result'):
-                    count = data['result'][0]['count']
-                    return count > 0
-            return False
-    except Exception as e:
-        print(f"✗ Error checking URL existence: {str(e)}")
-        return False
-
-async def test_cloudflare_connection(api_token, account_id, database_id):
+async def test_cloudflare_connection(d1):
     """Test connection to Cloudflare API"""
-    url = f"https://api.cloudflare.com/client/v4/accounts/{account_id}/d1/database/{database_id}"
-    
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_token}"
-    }
-    
-    print(f"\nTesting Cloudflare connection...")
-    print(f"URL: {url}")
     print("Current UTC time:", datetime.datetime.utcnow().isoformat())
-    
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers) as response:
-                response_text = await response.text()
-                print(f"Response Status: {response.status}")
-                print(f"Response Body: {response_text}")
-                
-                if response.status == 200:
-                    data = await response.json()
-                    if data.get('success'):
-                        print("✓ Cloudflare connection successful")
-                        return True
-                    else:
-                        print(f"✗ Cloudflare API error: {data}")
-                else:
-                    print(f"✗ HTTP Status {response.status}: {response_text}")
-                return False
-    except Exception as e:
-        print(f"✗ Connection error: {str(e)}")
-        return False
-
-async def write_to_cloudflare_d1(platform,session, data, api_token, account_id, database_id):
-    """Write data to Cloudflare D1"""
-    tag_exists = await check_tag_exists(platform,session, data['tag'], api_token, account_id, database_id)
-    
-    if tag_exists:
-        print(f"⚠ URL already exists, skipping: {data['tag']}")
-        return
-
-    url = f"https://api.cloudflare.com/client/v4/accounts/{account_id}/d1/database/{database_id}/query"
-    
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_token}"
-    }
-    
-    current_time = datetime.datetime.utcnow().isoformat()
-    
-    payload = {
-        "sql": f"INSERT INTO wayback_{platform}_hashtag_data (tag,url, date, updateAt) VALUES (?,?, ?, ?)",
-        "params": [data['tag'],data['url'], data['date'], current_time]
-    }
-
-    try:
-        async with session.post(url, headers=headers, json=payload) as response:
-            if response.status == 200:
-                print(f"✓ Successfully inserted: {data['tag'],data['url']}")
-            else:
-                error_text = await response.text()
-                print(f"✗ Failed to insert: {data['tag'],data['url']}")
-                print(f"Error: {error_text}")
-    except Exception as e:
-        print(f"✗ Error writing to Cloudflare: {str(e)}")
-import re
+    return await d1.test_connection()
 
-# Function to replace emojis in a string
 def replace_emojis(text, replacement=""):
     # Regex pattern to match emojis
     emoji_pattern = re.compile(
@@ -186,10 +102,7 @@ def replace_emojis(text, replacement=""):
     # Replace all emojis with the replacement text
     return emoji_pattern.sub(replacement, text)
 
-
-
-
-async def saveurls(platform, domain, api_token, account_id, database_id, timeframe):
+async def saveurls(platform, domain, d1, timeframe):
     """
     Fetch URLs from Wayback Machine using waybackpy and store them in the Cloudflare D1 database.
     """
@@ -220,59 +133,63 @@ async def saveurls(platform, domain, api_token, account_id, database_id, timefra
             lines=f.readlines()
         
         
-        async with aiohttp.ClientSession() as session:
-            # for snapshot in urls:
-            for line in lines:
-                obj=line.split(',')
-                print('=======',obj)
-                if len(obj)==0:
-                    return 
-                obj=[x.strip() for x in obj]
-                url=obj[2].replace('url','').strip().replace('\n','')
-                date=obj[1].replace('timestamp','').strip()
-                print('url',url)
-                print('date',date)
-                print('website',website_url)
-
-                parsed_url = urlparse(url)
-                path = parsed_url.path
-                decoded_path = unquote(path)
-                tag=None
-                if website_url=='tiktok.com/tag/':
-                    tag=decoded_path.split('/tag/')[-1]
-                    if 'pc' in tag:
-                        tag=tag.split('/pc')[0]
-                    if '?' in tag:
-                        tag=tag.split('?')[0]
-                    tag = replace_emojis(tag, replacement="")
-                        
-                if 'ideogram.ai' in website_url:
-                    tag=decoded_path
+        current_time = datetime.datetime.utcnow().isoformat()
+        writer = BatchedD1Writer(d1, f'wayback_{platform}_hashtag_data', ['tag', 'url', 'date', 'updateAt'])
+        await writer.load_known_keys('tag')
+        # for snapshot in urls:
+        for line in lines:
+            obj=line.split(',')
+            print('=======',obj)
+            if len(obj)==0:
+                break
+            obj=[x.strip() for x in obj]
+            url=obj[2].replace('url','').strip().replace('\n','')
+            date=obj[1].replace('timestamp','').strip()
+            print('url',url)
+            print('date',date)
+            print('website',website_url)
+
+            parsed_url = urlparse(url)
+            path = parsed_url.path
+            decoded_path = unquote(path)
+            tag=None
+            if website_url=='tiktok.com/tag/':
+                tag=decoded_path.split('/tag/')[-1]
+                if 'pc' in tag:
+                    tag=tag.split('/pc')[0]
+                if '?' in tag:
+                    tag=tag.split('?')[0]
+                tag = replace_emojis(tag, replacement="")
                     
+            if 'ideogram.ai' in website_url:
+                tag=decoded_path
                 
-                print('keep params clean',tag)
-                    
+            
+            print('keep params clean',tag)
                 
-                data = {
-                    # "url": snapshot.archive_url,
-                    # "date": snapshot.timestamp
-                }
-                data={
-                "tag":tag,
-                "url":url,
-                'date':date
-                }
-                await write_to_cloudflare_d1(platform, session, data, api_token, account_id, database_id)
+            
+            data = {
+                # "url": snapshot.archive_url,
+                # "date": snapshot.timestamp
+            }
+            data={
+            "tag":tag,
+            "url":url,
+            'date':date,
+            'updateAt':current_time
+            }
+            await writer.add(data)
+
+        await writer.close()
 
         print(f"\n✓ Completed fetching and storing URLs for domain: {domainname}")
 
     except Exception as e:
         print(f"✗ Error using waybackpy: {str(e)}")
 
-async def geturls(platform,domain, api_token, account_id, database_id, timeframe):
+async def geturls(platform,domain, d1, timeframe):
     """Fetch URLs from Wayback Machine and store them"""
     domainname = domain.replace("https://", "").split('/')[0]
-    query_url = f"http://web.archive.org/cdx/search/cdx?url={domain}/&matchType=prefix&fl=timestamp,original&collapse=urlkey"
     
     try:
         timeframe_index = int(timeframe)
@@ -285,10 +202,7 @@ async def geturls(platform,domain, api_token, account_id, database_id, timeframe
 
     start, end = get_time_range(filters[timeframe_index])
 
-    filter_str = f'&statuscode=200&from={start}&to={end}'
-    query_url = query_url + filter_str
     print('start,end',start,end)
-    chunk_size=4000
     website_url=domain.replace('https://','')
     website_url=website_url.replace('www.','')    
 
@@ -296,15 +210,9 @@ async def geturls(platform,domain, api_token, account_id, database_id, timeframe
         'Referer': 'https://web.archive.org/',
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
     }
-    query_url = 'http://web.archive.org/cdx/search/cdx?url=https://www.' + website_url + '*&collapse=urlkey&filter=!statuscode:404&showResumeKey=true&matchType=prefix&from=%s&to=%s&limit=%s&output=json'%(start,end,chunk_size)
-# https://github.com/internetarchive/wayback/blob/master/wayback-cdx-server/README.md
-
-
-    query_url='http://web.archive.org/cdx/search/cdx?url=tiktok.com/tag/&collapse=urlkey&matchType=prefix&from=20241223&to=20241225'
-    query_url='http://web.archive.org/cdx/search/cdx?url=tiktok.com/tag/&collapse=digest&matchType=prefix&from=2024&to=2024&fl=original,timestamp'
-    query_url='http://web.archive.org/cdx/search/cdx?url=tiktok.com/tag/&collapse=urlkey&matchType=prefix&from=2023&to=2023'
-    query_url='http://web.archive.org/cdx/search/cdx?url=tiktok.com/tag/&collapse=urlkey&matchType=prefix&from=2024&to=2024'
-    query_url=query_url+'&fl=timestamp,original'
+    # https://github.com/internetarchive/wayback/blob/master/wayback-cdx-server/README.md
+    query = hashtag_scan(website_url).collapse('urlkey').between(start, end)
+    query_url = f"{CDX_API_URL}?{query.query_string()}"
     print('build query url',query_url,website_url)
     async with aiohttp.ClientSession() as session:
         try:
@@ -314,67 +222,47 @@ async def geturls(platform,domain, api_token, account_id, database_id, timeframe
                     print(f"✗ Wayback Machine API returned status {resp.status}")
                     return
 
-                content = await resp.text()
-                lines = content.splitlines()
+                # Stream the body line by line instead of holding the whole CDX response in memory
+                captures = CDXLineReader(resp.content)
                 
                 os.makedirs('./result', exist_ok=True)
                 
-                print(f"\nProcessing {len(lines)} URLs...")
-                total_processed = 0
-                total_skipped = 0
-
-                for line in lines:
-                    if ' ' in line:
-                        parts = line.strip().split(' ')
-                        print('preprocessing',parts)
-                        
-                        if len(parts) >= 2:
-                            url=parts[1]
-                            print('preprocessing url',website_url in url, '?' in url,'&' in url)
-                            
-                            if website_url in url:
-                                url=url.split(website_url)[-1]
-                                print('keep params only',url)
-                            if '?' in url:
-            
-                                url=url.split('?')[0]
-                                
-                            if '&' in url:
-                                url=url.split('&')[0]
-                                print('keep params clean',url)
-                                
-                            data = {
-                                "url": url,
-                                "date": parts[0]
-                            }
-                            await write_to_cloudflare_d1(platform,session, data, api_token, account_id, database_id)
-                            
-                            # url_exists = await check_tag_exists(platform,session, data['url'], api_token, account_id, database_id)
-                            # if url_exists:
-                                # total_skipped += 1
-                            # else:
-                                # await write_to_cloudflare_d1(session, data, api_token, account_id, database_id)
-                                # total_processed += 1
+                print("\nProcessing URLs...")
+                current_time = datetime.datetime.utcnow().isoformat()
+                writer = BatchedD1Writer(d1, f'wayback_{platform}_hashtag_data', ['tag', 'url', 'date', 'updateAt'])
+                await writer.load_known_keys('tag')
+
+                # Runs once per CDX line, so it stays free of terminal output; run_pipeline reports progress
+                def parse_line(capture):
+                    timestamp, original = capture
+                    url=original
+                    if website_url in url:
+                        url=url.split(website_url)[-1]
+                    if '?' in url:
+                        url=url.split('?')[0]
+                    if '&' in url:
+                        url=url.split('&')[0]
+                    return {
+                        "tag": url,
+                        "url": original,
+                        "date": timestamp,
+                        "updateAt": current_time
+                    }
+
+                stats = await run_pipeline(captures, parse_line, writer)
+                await writer.close()
 
                 print(f"\n✓ Processing complete:")
-                print(f"  - Total URLs found: {len(lines)}")
-                print(f"  - URLs processed: {total_processed}")
-                print(f"  - URLs skipped (already exist): {total_skipped}")
+                print(f"  - Total URLs found: {stats['records']}")
+                print(f"  - URLs processed: {writer.rows_inserted}")
+                print(f"  - URLs skipped (already exist): {writer.rows_known + writer.rows_ignored}")
 
         except Exception as e:
             print(f"✗ Error: {str(e)}")
 
-async def create_table(platform,api_token, account_id, database_id):
+async def create_table(platform,d1):
     """Create the wayback_data table if it doesn't exist"""
-    url = f"https://api.cloudflare.com/client/v4/accounts/{account_id}/d1/database/{database_id}/query"
-    
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_token}"
-    }
-    
-    payload = {
-        "sql": f"""
+    sql = f"""
         CREATE TABLE IF NOT EXISTS wayback_{platform}_hashtag_data (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             tag TEXT NOT NULL UNIQUE,
@@ -383,18 +271,12 @@ async def create_table(platform,api_token, account_id, database_id):
             updateAt TEXT NOT NULL
         )
         """
-    }
     
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers, json=payload) as response:
-                if response.status == 200:
-                    print("✓ Table created/verified successfully")
-                else:
-                    error_text = await response.text()
-                    print(f"✗ Failed to create table: {error_text}")
-    except Exception as e:
-        print(f"✗ Error creating table: {str(e)}")
+    results = await d1.query(sql)
+    if results is not None:
+        print("✓ Table created/verified successfully")
+    else:
+        print("✗ Failed to create table")
 
 async def main():
     # Check environment variables
@@ -404,11 +286,13 @@ async def main():
     print(f"Current time (UTC): {datetime.datetime.utcnow().isoformat()}")
     
     # Test Cloudflare connection
-    if not await test_cloudflare_connection(
+    d1 = D1Client(
         env_vars['CLOUDFLARE_API_TOKEN'],
         env_vars['CLOUDFLARE_ACCOUNT_ID'],
         env_vars['CLOUDFLARE_D1_DATABASE_ID']
-    ):
+    )
+    if not await test_cloudflare_connection(d1):
+        await d1.close()
         sys.exit(1)
 
 
@@ -487,22 +371,18 @@ async def main():
             if platform!=domain:
                 continue
             
-            await create_table(platform,
-        env_vars['CLOUDFLARE_API_TOKEN'],
-        env_vars['CLOUDFLARE_ACCOUNT_ID'],
-        env_vars['CLOUDFLARE_D1_DATABASE_ID']
-    )
+            await create_table(platform, d1)
 
 
             await saveurls(
         # env_vars['DOMAIN'],
           platform,
           url,
-        env_vars['CLOUDFLARE_API_TOKEN'],
-        env_vars['CLOUDFLARE_ACCOUNT_ID'],
-        env_vars['CLOUDFLARE_D1_DATABASE_ID'],
+        d1,
         env_vars['TIME_FRAME']
     )
 
+    await d1.close()
+
 if __name__ == "__main__":
     asyncio.run(main())
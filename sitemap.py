@@ -0,0 +1,337 @@
+import os
+import re
+import time
+import zlib
+import asyncio
+import sqlite3
+import xml.etree.ElementTree as ET
+from rate_limit import paced
+
+# Bytes read off the response per step; memory stays at one chunk plus the entry being parsed
+SITEMAP_READ_CHUNK = int(os.getenv('SITEMAP_READ_CHUNK', '65536'))
+SITEMAP_STATE_DIR = os.getenv('SITEMAP_STATE_DIR', os.getenv('STAGE_DIR', 'state'))
+# Sitemaps downloaded at once by crawl_sitemaps, and how many index levels below the root it follows
+SITEMAP_CONCURRENCY = int(os.getenv('SITEMAP_CONCURRENCY', '4'))
+SITEMAP_MAX_DEPTH = int(os.getenv('SITEMAP_MAX_DEPTH', '4'))
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def _local(tag):
+    # '{http://www.sitemaps.org/schemas/sitemap/0.9}loc' -> 'loc'
+    return tag.rsplit('}', 1)[-1]
+
+
+class SitemapParser:
+    """Incremental sitemap / sitemap index parser: feed raw bytes (plain or gzip), get (loc, lastmod) as entries close"""
+
+    def __init__(self):
+        self.parser = ET.XMLPullParser(events=('start', 'end'))
+        self.root = None
+        self.inflate = None
+        self.sniffed = False
+        self.bytes = 0
+        self.entries = 0
+
+    @property
+    def is_index(self):
+        return self.root is not None and _local(self.root.tag) == 'sitemapindex'
+
+    def feed(self, chunk):
+        self.bytes += len(chunk)
+        if not self.sniffed:
+            # .xml.gz files are usually served as plain bytes, not with Content-Encoding, so look at the data itself
+            self.sniffed = True
+            if chunk[:2] == GZIP_MAGIC:
+                self.inflate = zlib.decompressobj(47)
+        if self.inflate is None:
+            self.parser.feed(chunk)
+            return self._drain()
+        # Sitemaps compress ~15:1, so inflate a chunk's worth at a time rather than a whole chunk at once
+        entries = []
+        while chunk:
+            self.parser.feed(self.inflate.decompress(chunk, SITEMAP_READ_CHUNK))
+            entries.extend(self._drain())
+            chunk = self.inflate.unconsumed_tail
+        return entries
+
+    def close(self):
+        if self.inflate is not None:
+            self.parser.feed(self.inflate.flush())
+        self.parser.close()
+        return self._drain()
+
+    def _drain(self):
+        entries = []
+        for event, element in self.parser.read_events():
+            if event == 'start':
+                if self.root is None:
+                    self.root = element
+                continue
+            if _local(element.tag) not in ('url', 'sitemap'):
+                continue
+            loc = lastmod = None
+            for child in element:
+                name = _local(child.tag)
+                if name == 'loc':
+                    loc = (child.text or '').strip()
+                elif name == 'lastmod':
+                    lastmod = (child.text or '').strip() or None
+            if loc:
+                entries.append((loc, lastmod))
+            # Entries are finished with once read, so the tree never grows past the one being parsed
+            self.root.clear()
+        self.entries += len(entries)
+        return entries
+
+
+
+
+class SitemapState:
+    """Validators and entries of each sitemap fetched, so an unchanged one is answered locally or by a 304"""
+
+    def __init__(self, name, path=None):
+        self.name = name
+        self.path = path or os.path.join(SITEMAP_STATE_DIR, f'sitemaps_{name}.db')
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS sitemaps (
+            url TEXT PRIMARY KEY,
+            etag TEXT,
+            last_modified TEXT,
+            fetched_lastmod TEXT,
+            announced_lastmod TEXT,
+            entries INTEGER,
+            fetched_at REAL,
+            is_index INTEGER
+        )
+        """)
+        try:
+            # State written before is_index was tracked; those copies are fetched in full once to learn it
+            self.conn.execute("ALTER TABLE sitemaps ADD COLUMN is_index INTEGER")
+        except sqlite3.OperationalError:
+            pass
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS sitemap_entries (
+            sitemap TEXT NOT NULL,
+            loc TEXT NOT NULL,
+            lastmod TEXT
+        )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS sitemap_entries_sitemap ON sitemap_entries (sitemap)")
+        self.conn.commit()
+        self.skipped = 0
+        self.not_modified = 0
+        self.fetched = 0
+
+    def get(self, url):
+        row = self.conn.execute(
+            "SELECT etag, last_modified, fetched_lastmod, announced_lastmod, entries, is_index FROM sitemaps WHERE url = ?",
+            (url,)
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('etag', 'last_modified', 'fetched_lastmod', 'announced_lastmod', 'entries', 'is_index'), row))
+
+    def _stored(self, known):
+        return bool(known and known['entries'] is not None and known['is_index'] is not None)
+
+    def unchanged(self, url):
+        """Whether the parent index still announces the lastmod the stored copy was fetched at"""
+        known = self.get(url)
+        return bool(self._stored(known) and known['fetched_lastmod']
+                    and known['fetched_lastmod'] == known['announced_lastmod'])
+
+    def headers(self, url):
+        """If-None-Match / If-Modified-Since for a conditional GET of a sitemap fetched before"""
+        known = self.get(url)
+        headers = {}
+        if self._stored(known):
+            if known['etag']:
+                headers['If-None-Match'] = known['etag']
+            if known['last_modified']:
+                headers['If-Modified-Since'] = known['last_modified']
+        return headers
+
+    def is_index(self, url):
+        known = self.get(url)
+        return bool(known and known['is_index'])
+
+    def entries(self, url):
+        return self.conn.execute(
+            "SELECT loc, lastmod FROM sitemap_entries WHERE sitemap = ? ORDER BY rowid", (url,)).fetchall()
+
+    def announce(self, entries):
+        """Each child's lastmod as an index announces it, compared with the one it was fetched at"""
+        # Committed at once: children are fetched while the rest of their index is still streaming in
+        self.conn.executemany(
+            """
+            INSERT INTO sitemaps (url, announced_lastmod) VALUES (?, ?)
+            ON CONFLICT (url) DO UPDATE SET announced_lastmod = excluded.announced_lastmod
+            """,
+            entries
+        )
+        self.conn.commit()
+
+    def finish(self, url, entries, is_index, etag=None, last_modified=None):
+        """Replace the stored copy of a sitemap read in full, in one transaction"""
+        # Sitemaps are fetched concurrently on one connection, so nothing is written until a fetch has completed
+        known = self.get(url)
+        self.conn.execute("DELETE FROM sitemap_entries WHERE sitemap = ?", (url,))
+        self.conn.executemany("INSERT INTO sitemap_entries (sitemap, loc, lastmod) VALUES (?, ?, ?)",
+                              [(url, loc, lastmod) for loc, lastmod in entries])
+        self.conn.execute(
+            """
+            INSERT INTO sitemaps (url, etag, last_modified, fetched_lastmod, entries, fetched_at, is_index)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (url) DO UPDATE SET etag = excluded.etag, last_modified = excluded.last_modified,
+                fetched_lastmod = excluded.fetched_lastmod, entries = excluded.entries, fetched_at = excluded.fetched_at,
+                is_index = excluded.is_index
+            """,
+            (url, etag, last_modified, known and known['announced_lastmod'], len(entries), time.time(), int(is_index))
+        )
+        self.conn.commit()
+
+    def confirm(self, url):
+        """A 304: the stored copy is current as of the lastmod the index announces now"""
+        self.conn.execute("UPDATE sitemaps SET fetched_lastmod = announced_lastmod, fetched_at = ? WHERE url = ?",
+                          (time.time(), url))
+        self.conn.commit()
+
+    def report(self):
+        print(f"✓ Sitemaps {self.name}: {self.skipped} skipped (lastmod unchanged), {self.not_modified} not modified (304), "
+              f"{self.fetched} downloaded")
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+async def iter_sitemap_batches(session, url, state=None, chunk_size=SITEMAP_READ_CHUNK):
+    """(is_index, entries) for each run of entries parsed from a sitemap or sitemap index as the response streams in"""
+    # With a state, a sitemap whose index lastmod has not moved is served from the stored copy without a request;
+    # the rest are fetched conditionally and a 304 is served from the stored copy too
+    if state is not None and state.unchanged(url):
+        state.skipped += 1
+        yield state.is_index(url), state.entries(url)
+        return
+    headers = state.headers(url) if state is not None else {}
+    async with paced(session, 'GET', url, headers=headers) as response:
+        not_modified = response.status == 304 and bool(headers)
+        if not not_modified:
+            response.raise_for_status()
+            parser = SitemapParser()
+            stored = []
+            try:
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    entries = parser.feed(chunk)
+                    if entries:
+                        if state is not None:
+                            stored.extend(entries)
+                            if parser.is_index:
+                                state.announce(entries)
+                        yield parser.is_index, entries
+                entries = parser.close()
+                if entries:
+                    if state is not None:
+                        stored.extend(entries)
+                        if parser.is_index:
+                            state.announce(entries)
+                    yield parser.is_index, entries
+            except (ET.ParseError, zlib.error) as e:
+                print(f"⚠ Sitemap {url} stopped parsing after {parser.entries} entries: {e}")
+                return
+            if state is not None:
+                state.fetched += 1
+                state.finish(url, stored, parser.is_index, response.headers.get('ETag'),
+                             response.headers.get('Last-Modified'))
+    if not_modified:
+        state.not_modified += 1
+        state.confirm(url)
+        yield state.is_index(url), state.entries(url)
+
+
+async def iter_sitemap(session, url, state=None, chunk_size=SITEMAP_READ_CHUNK):
+    """Yield (loc, lastmod) of a sitemap or sitemap index as the response streams in; lastmod may be None"""
+    async for _, entries in iter_sitemap_batches(session, url, state, chunk_size):
+        for entry in entries:
+            yield entry
+
+
+class SitemapRules:
+    """A provider's sitemap layout: which sitemaps of an index to follow, and how page locs become URLs to scrape"""
+
+    def __init__(self, follow=None, rewrite=(), keep=None):
+        # follow and keep are regexes searched in the URL, None matching everything; rewrite is (regex, replacement) pairs
+        self.follow = re.compile(follow) if follow else None
+        self.rewrite = [(re.compile(pattern), replacement) for pattern, replacement in rewrite]
+        self.keep = re.compile(keep) if keep else None
+
+    def follows(self, url):
+        return self.follow is None or bool(self.follow.search(url))
+
+    def page(self, loc):
+        """The page URL to scrape for a loc, or None when the rules drop it"""
+        for pattern, replacement in self.rewrite:
+            loc = pattern.sub(replacement, loc)
+        if self.keep is not None and not self.keep.search(loc):
+            return None
+        return loc
+
+
+async def crawl_sitemaps(session, root_url, rules=None, state=None, concurrency=SITEMAP_CONCURRENCY,
+                         max_depth=SITEMAP_MAX_DEPTH):
+    """Yield (page_url, lastmod) from a whole sitemap tree: indexes are followed recursively as the rules allow,
+    sitemaps are fetched concurrently, and pages come out as each sitemap parses while the others still download"""
+    rules = rules or SitemapRules()
+    semaphore = asyncio.Semaphore(concurrency)
+    found = asyncio.Queue()
+    seen = {root_url}
+    pages = set()
+    tasks = []
+    counts = {'indexes': 0, 'sitemaps': 0, 'not_followed': 0, 'failed': 0}
+
+    async def visit(url, depth):
+        try:
+            async with semaphore:
+                index = False
+                async for index, entries in iter_sitemap_batches(session, url, state):
+                    if not index:
+                        found.put_nowait(entries)
+                        continue
+                    for loc, _ in entries:
+                        if loc in seen:
+                            continue
+                        seen.add(loc)
+                        if depth >= max_depth or not rules.follows(loc):
+                            counts['not_followed'] += 1
+                            continue
+                        # Children start as soon as the index names them, without waiting for the rest of it
+                        tasks.append(asyncio.ensure_future(visit(loc, depth + 1)))
+                counts['indexes' if index else 'sitemaps'] += 1
+        except Exception as e:
+            counts['failed'] += 1
+            print(f"⚠ Sitemap {url} failed: {e}")
+        finally:
+            # One marker per sitemap; children are queued before their parent's marker, so all are counted in time
+            found.put_nowait(None)
+
+    tasks.append(asyncio.ensure_future(visit(root_url, 0)))
+    done = 0
+    try:
+        while done < len(tasks):
+            entries = await found.get()
+            if entries is None:
+                done += 1
+                continue
+            for loc, lastmod in entries:
+                page = rules.page(loc)
+                if page and page not in pages:
+                    pages.add(page)
+                    yield page, lastmod
+    finally:
+        for task in tasks:
+            task.cancel()
+    print(f"✓ Sitemap crawl {root_url}: {counts['indexes']} indexes and {counts['sitemaps']} sitemaps read, "
+          f"{counts['not_followed']} not followed, {counts['failed']} failed; {len(pages)} pages")
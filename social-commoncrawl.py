@@ -3,8 +3,12 @@ import os
 import aiohttp
 import asyncio
 import datetime
-import json
 from dotenv import load_dotenv
+from d1_client import D1Client
+from d1_writer import BatchedD1Writer
+from ingest_pipeline import run_pipeline
+from http_cache import default_cache
+from cc_index import CCIndexClient
 
 load_dotenv()
 
@@ -62,104 +66,14 @@ def check_environment_variables():
 
     return required_vars
 
-async def check_url_exists(platform, session, url, api_token, account_id, database_id):
-    """Check if URL already exists in the table"""
-    check_url = f"https://api.cloudflare.com/client/v4/accounts/{account_id}/d1/database/{database_id}/query"
-    
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_token}"
-    }
-    
-    payload = {
-        "sql": f"SELECT COUNT(*) as count FROM wayback_{platform}_hashtag_data WHERE url = ?",
-        "params": [url]
-    }
-    print('check existing sql',  f"SELECT COUNT(*) as count FROM wayback_{platform}_hashtag_data WHERE url = ?")
-
-    try:
-        async with session.post(check_url, headers=headers, json=payload) as response:
-            if response.status == 200:
-                data = await response.json()
-                if data.get('success') and data.get('result'):
-                    count = data['result'][0]['count']
-                    return count > 0
-            return False
-    except Exception as e:
-        print(f"✗ Error checking URL existence: {str(e)}")
-        return False
-
-async def test_cloudflare_connection(api_token, account_id, database_id):
+async def test_cloudflare_connection(d1):
     """Test connection to Cloudflare API"""
-    url = f"https://api.cloudflare.com/client/v4/accounts/{account_id}/d1/database/{database_id}"
-    
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_token}"
-    }
-    
-    print(f"\nTesting Cloudflare connection...")
-    print(f"URL: {url}")
     print("Current UTC time:", datetime.datetime.utcnow().isoformat())
-    
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers) as response:
-                response_text = await response.text()
-                print(f"Response Status: {response.status}")
-                print(f"Response Body: {response_text}")
-                
-                if response.status == 200:
-                    data = await response.json()
-                    if data.get('success'):
-                        print("✓ Cloudflare connection successful")
-                        return True
-                    else:
-                        print(f"✗ Cloudflare API error: {data}")
-                else:
-                    print(f"✗ HTTP Status {response.status}: {response_text}")
-                return False
-    except Exception as e:
-        print(f"✗ Connection error: {str(e)}")
-        return False
-
-async def write_to_cloudflare_d1(platform, session, data, api_token, account_id, database_id):
-    """Write data to Cloudflare D1"""
-    url_exists = await check_url_exists(platform, session, data['url'], api_token, account_id, database_id)
-    
-    if url_exists:
-        print(f"⚠ URL already exists, skipping: {data['url']}")
-        return
-
-    url = f"https://api.cloudflare.com/client/v4/accounts/{account_id}/d1/database/{database_id}/query"
-    
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_token}"
-    }
-    
-    current_time = datetime.datetime.utcnow().isoformat()
-    
-    payload = {
-        "sql": f"INSERT INTO wayback_{platform}_hashtag_data (url, date, updateAt) VALUES (?, ?, ?)",
-        "params": [data['url'], data['date'], current_time]
-    }
+    return await d1.test_connection()
 
-    try:
-        async with session.post(url, headers=headers, json=payload) as response:
-            if response.status == 200:
-                print(f"✓ Successfully inserted: {data['url']}")
-            else:
-                error_text = await response.text()
-                print(f"✗ Failed to insert: {data['url']}")
-                print(f"Error: {error_text}")
-    except Exception as e:
-        print(f"✗ Error writing to Cloudflare: {str(e)}")
-
-async def get_urls_ccindex(platform, domain, api_token, account_id, database_id, timeframe):
+async def get_urls_ccindex(platform, domain, d1, timeframe):
     """Fetch URLs from Common Crawl Index and store them"""
     domainname = domain.replace("https://", "").split('/')[0]
-    query_url = f"https://index.commoncrawl.org/CC-MAIN-2024-40-index?url={domainname}/*&output=json"
     
     try:
         timeframe_index = int(timeframe)
@@ -174,53 +88,50 @@ async def get_urls_ccindex(platform, domain, api_token, account_id, database_id,
 
     async with aiohttp.ClientSession() as session:
         try:
-            async with session.get(query_url) as resp:
-                if resp.status != 200:
-                    print(f"✗ Common Crawl Index returned status {resp.status}")
-                    return
-
-                content = await resp.text()
-                lines = content.splitlines()
-                
-                os.makedirs('./result', exist_ok=True)
-                
-                print(f"\nProcessing {len(lines)} URLs...")
-                total_processed = 0
-                total_skipped = 0
-
-                for line in lines:
-                    data = json.loads(line)
-                    if 'url' in data:
-                        url = data['url']
-                        if domainname in url:
-                            url = url.split(domainname)[-1]
-                            if '&' in url:
-                                url = url.split('&')[0]
-                            data = {
-                                "url": url,
-                                "date": data['timestamp']
-                            }
-                            await write_to_cloudflare_d1(platform, session, data, api_token, account_id, database_id)
-
-                print(f"\n✓ Processing complete:")
-                print(f"  - Total URLs found: {len(lines)}")
-                print(f"  - URLs processed: {total_processed}")
-                print(f"  - URLs skipped (already exist): {total_skipped}")
+            os.makedirs('./result', exist_ok=True)
+            
+            print("\nProcessing URLs...")
+            current_time = datetime.datetime.utcnow().isoformat()
+            writer = BatchedD1Writer(d1, f'wayback_{platform}_hashtag_data', ['url', 'date', 'updateAt'], min_column='date')
+            await writer.load_known_keys('url')
+
+            def parse_line(data):
+                if 'url' in data:
+                    url = data['url']
+                    if domainname in url:
+                        url = url.split(domainname)[-1]
+                        if '&' in url:
+                            url = url.split('&')[0]
+                        return {
+                            "url": url,
+                            "date": data['timestamp'],
+                            "updateAt": current_time
+                        }
+                return None
+
+            # Every crawl overlapping the window, queried concurrently, streamed into the writer as pages land;
+            # a URL seen in several crawls keeps its earliest date, by an upsert that only ever lowers date
+            try:
+                async with CCIndexClient(session=session) as cc:
+                    stats = await run_pipeline(cc.iter_captures(f"{domainname}/", start, end), parse_line, writer)
+            finally:
+                # Rows already buffered are written even when the query fails part way
+                await writer.close()
+
+            print(f"\n✓ Processing complete:")
+            print(f"  - Total captures found: {stats['records']}")
+            print(f"  - URLs processed: {writer.rows_inserted}")
+            print(f"  - URLs moved to an earlier date: {writer.rows_lowered}")
+            print(f"  - URLs skipped (already exist): {writer.rows_known + writer.rows_ignored}")
+            if default_cache():
+                default_cache().report()
 
         except Exception as e:
             print(f"✗ Error: {str(e)}")
 
-async def create_table(platform, api_token, account_id, database_id):
+async def create_table(platform, d1):
     """Create the wayback_data table if it doesn't exist"""
-    url = f"https://api.cloudflare.com/client/v4/accounts/{account_id}/d1/database/{database_id}/query"
-    
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_token}"
-    }
-    
-    payload = {
-        "sql": f"""
+    sql = f"""
         CREATE TABLE IF NOT EXISTS wayback_{platform}_hashtag_data (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             url TEXT NOT NULL UNIQUE,
@@ -228,18 +139,12 @@ async def create_table(platform, api_token, account_id, database_id):
             updateAt TEXT NOT NULL
         )
         """
-    }
     
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers, json=payload) as response:
-                if response.status == 200:
-                    print("✓ Table created/verified successfully")
-                else:
-                    error_text = await response.text()
-                    print(f"✗ Failed to create table: {error_text}")
-    except Exception as e:
-        print(f"✗ Error creating table: {str(e)}")
+    results = await d1.query(sql)
+    if results is not None:
+        print("✓ Table created/verified successfully")
+    else:
+        print("✗ Failed to create table")
 
 async def main():
     # Check environment variables
@@ -249,11 +154,13 @@ async def main():
     print(f"Current time (UTC): {datetime.datetime.utcnow().isoformat()}")
     
     # Test Cloudflare connection
-    if not await test_cloudflare_connection(
+    d1 = D1Client(
         env_vars['CLOUDFLARE_API_TOKEN'],
         env_vars['CLOUDFLARE_ACCOUNT_ID'],
         env_vars['CLOUDFLARE_D1_DATABASE_ID']
-    ):
+    )
+    if not await test_cloudflare_connection(d1):
+        await d1.close()
         sys.exit(1)
 
     domain = env_vars['DOMAIN'].lower()
@@ -326,21 +233,16 @@ async def main():
                                 )
     print('=====',platform_url)
 
-    await create_table(
-        domain,
-        env_vars['CLOUDFLARE_API_TOKEN'],
-        env_vars['CLOUDFLARE_ACCOUNT_ID'],
-        env_vars['CLOUDFLARE_D1_DATABASE_ID']
-    )
+    await create_table(domain, d1)
 
     await get_urls_ccindex(
         domain,
         platform_url,
-        env_vars['CLOUDFLARE_API_TOKEN'],
-        env_vars['CLOUDFLARE_ACCOUNT_ID'],
-        env_vars['CLOUDFLARE_D1_DATABASE_ID'],
+        d1,
         env_vars['TIME_FRAME']
     )
 
+    await d1.close()
+
 if __name__ == "__main__":
     asyncio.run(main())
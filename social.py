@@ -1,15 +1,18 @@
-from urllib.parse import urlparse, parse_qs, unquote
-
 import aiohttp
 import csv
 import os
+import re
 import asyncio
 import datetime
 from dotenv import load_dotenv
 import sys
 from waybackpy import WaybackMachineCDXServerAPI
 from waybackpy.wrapper import Url
-import cdx_toolkit
+from d1_client import D1Client
+from cdx_client import CDX_API_URL, CDXClient
+from cdx_query import hashtag_scan, hashtag_of
+from d1_writer import BatchedD1Writer
+from watermarks import Watermarks
 
 load_dotenv()
 
@@ -68,102 +71,11 @@ def check_environment_variables():
 
     return required_vars
 
-async def check_tag_exists(platform,session, tag, api_token, account_id, database_id):
-    """Check if URL already exists in the table"""
-    check_url = f"https://api.cloudflare.com/client/v4/accounts/{account_id}/d1/database/{database_id}/query"
-    
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_token}"
-    }
-    
-    payload = {
-        "sql": f"SELECT COUNT(*) as count FROM wayback_{platform}_hashtag_data WHERE tag = ?",
-        "params": [tag]
-    }
-    print('check existing sql',  f"SELECT COUNT(*) as count FROM wayback_{platform}_hashtag_data WHERE tag = ?"
-)
-    try:
-        async with session.post(check_url, headers=headers, json=payload) as response:
-            if response.status == 200:
-                data = await response.json()
-                if data.get('success') and data.get('result'):
-                    count = data['result'][0]['count']
-                    return count > 0
-            return False
-    except Exception as e:
-        print(f"✗ Error checking URL existence: {str(e)}")
-        return False
-
-async def test_cloudflare_connection(api_token, account_id, database_id):
+async def test_cloudflare_connection(d1):
     """Test connection to Cloudflare API"""
-    url = f"https://api.cloudflare.com/client/v4/accounts/{account_id}/d1/database/{database_id}"
-    
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_token}"
-    }
-    
-    print(f"\nTesting Cloudflare connection...")
-    print(f"URL: {url}")
     print("Current UTC time:", datetime.datetime.utcnow().isoformat())
-    
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers) as response:
-                response_text = await response.text()
-                print(f"Response Status: {response.status}")
-                print(f"Response Body: {response_text}")
-                
-                if response.status == 200:
-                    data = await response.json()
-                    if data.get('success'):
-                        print("✓ Cloudflare connection successful")
-                        return True
-                    else:
-                        print(f"✗ Cloudflare API error: {data}")
-                else:
-                    print(f"✗ HTTP Status {response.status}: {response_text}")
-                return False
-    except Exception as e:
-        print(f"✗ Connection error: {str(e)}")
-        return False
-
-async def write_to_cloudflare_d1(platform,session, data, api_token, account_id, database_id):
-    """Write data to Cloudflare D1"""
-    tag_exists = await check_tag_exists(platform,session, data['tag'], api_token, account_id, database_id)
-    
-    if tag_exists:
-        print(f"⚠ URL already exists, skipping: {data['tag']}")
-        return
-
-    url = f"https://api.cloudflare.com/client/v4/accounts/{account_id}/d1/database/{database_id}/query"
-    
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_token}"
-    }
-    
-    current_time = datetime.datetime.utcnow().isoformat()
-    
-    payload = {
-        "sql": f"INSERT INTO wayback_{platform}_hashtag_data (tag,url, date, updateAt) VALUES (?,?, ?, ?)",
-        "params": [data['tag'],data['url'], data['date'], current_time]
-    }
-
-    try:
-        async with session.post(url, headers=headers, json=payload) as response:
-            if response.status == 200:
-                print(f"✓ Successfully inserted: {data['tag'],data['url']}")
-            else:
-                error_text = await response.text()
-                print(f"✗ Failed to insert: {data['tag'],data['url']}")
-                print(f"Error: {error_text}")
-    except Exception as e:
-        print(f"✗ Error writing to Cloudflare: {str(e)}")
-import re
+    return await d1.test_connection()
 
-# Function to replace emojis in a string
 def replace_emojis(text, replacement=""):
     # Regex pattern to match emojis
     emoji_pattern = re.compile(
@@ -186,12 +98,9 @@ def replace_emojis(text, replacement=""):
     # Replace all emojis with the replacement text
     return emoji_pattern.sub(replacement, text)
 
-
-
-
-async def geturls_py(platform, domain, api_token, account_id, database_id, timeframe):
+async def geturls_py(platform, domain, d1, timeframe):
     """
-    Fetch URLs from Wayback Machine using waybackpy and store them in the Cloudflare D1 database.
+    Fetch hashtag URLs from the Wayback Machine CDX API and store them in the Cloudflare D1 database.
     """
     domainname = domain.replace("https://", "").split('/')[0]
     print(f"\nFetching URLs for domain: {domainname}")
@@ -210,77 +119,52 @@ async def geturls_py(platform, domain, api_token, account_id, database_id, timef
     print(f"Timeframe: {filters[timeframe_index]}")
     print(f"Start: {start}, End: {end}")
 
-    try:
-        # Initialize Wayback Machine CDX Server API
-        # cdx_api = WaybackMachineCDXServerAPI(url=domainname,start_timestamp=start[:7], end_timestamp=end[:7])
-        # cdx_api=Url(domainname)
-        # Fetch snapshots between the specified time range
-
-        # urls = cdx_api.known_urls()
-
-        # print(f"\nProcessing {len(snapshots)} URLs...")
-
-
-        url = 'tiktok.com/tag/*'
-        # https://github.com/cocrawler/cdx_toolkit
-        from_timestamp = datetime.datetime(2024, 12, 1).strftime('%Y%m%d%H%M%S')
-        to_timestamp = datetime.datetime(2024, 12, 24).strftime('%Y%m%d%H%M%S')
-        kwargs = {
-    'url':url,
-    'filter':"status=200",
-    'filter':"mime:html",
-    'from_ts': from_timestamp,
-    'to': to_timestamp}
-        
-        cdxtoolkit = cdx_toolkit.CDXFetcher(source='ia')
-        
-        print('init cdx toolkit')
-
-        print(url, 'size estimate', cdxtoolkit.get_size_estimate(url))
-
-        
-        async with aiohttp.ClientSession() as session:
-            # for snapshot in urls:
+    # Hashtag pages live under one URL prefix, e.g. tiktok.com/tag/
+    prefix = domain.replace("https://", "").replace("http://", "").replace("www.", "")
+    marks = Watermarks(d1)
+    start, end = await marks.window(platform, prefix, start, end)
+    query = hashtag_scan(prefix).between(start, end)
+    params = query.params()
 
-            
-            for obj in cdxtoolkit.iter(**kwargs):
-                print('=======',obj)
-                url=obj['url'],
-                date=obj['timestamp']
-                parsed_url = urlparse(url)
-                path = parsed_url.path
-                decoded_path = unquote(path)
-                tag=None
-                if website_url=='tiktok.com':
-                    tag=decoded_path.split('tag')[0]
-                    if 'pc' in tag:
-                        tag=tag.split('/pc')[0]
-            
-                tag = replace_emojis(tag, replacement="")
-                
-                print('keep params clean',tag)
-                    
-                
-                data = {
-                    # "url": snapshot.archive_url,
-                    # "date": snapshot.timestamp
-                }
-                data={
-                "tag":tag,
-                "url":url,
-                'date':date
-                }
-                await write_to_cloudflare_d1(platform, session, data, api_token, account_id, database_id)
+    try:
+        # The prefix can hold millions of captures, so fetch its page= slices concurrently
+        async with CDXClient(fields=query.fields) as cdx:
+            current_time = datetime.datetime.utcnow().isoformat()
+            writer = BatchedD1Writer(d1, f'wayback_{platform}_hashtag_data', ['tag', 'url', 'date', 'updateAt'],
+                                     newest_column='date')
+            await writer.load_known_keys('tag')
+
+            async for page, rows, total in cdx.iter_shards(params):
+                for timestamp, url in rows:
+                    if not url:
+                        continue
+                    # Emoji are stripped as before, so tags keep deduping against rows already stored
+                    tag = replace_emojis(hashtag_of(url, prefix) or '', replacement="")
+                    if not tag:
+                        continue
+
+                    await writer.add({
+                        "tag": tag,
+                        "url": url,
+                        "date": timestamp,
+                        "updateAt": current_time
+                    })
+                print(f"✓ Page {page + 1}/{total}: {len(rows)} captures")
+
+            await writer.close()
+            cdx.report()
+            # Only captures that were written move the mark, and a failed row leaves it in place for a retry
+            if writer.rows_failed == 0 and writer.newest:
+                await marks.advance(platform, prefix, writer.newest)
 
         print(f"\n✓ Completed fetching and storing URLs for domain: {domainname}")
 
     except Exception as e:
-        print(f"✗ Error using waybackpy: {str(e)}")
+        print(f"✗ Error fetching CDX pages: {str(e)}")
 
-async def geturls(platform,domain, api_token, account_id, database_id, timeframe):
+async def geturls(platform,domain, d1, timeframe):
     """Fetch URLs from Wayback Machine and store them"""
     domainname = domain.replace("https://", "").split('/')[0]
-    query_url = f"http://web.archive.org/cdx/search/cdx?url={domain}/&matchType=prefix&fl=timestamp,original&collapse=urlkey"
     
     try:
         timeframe_index = int(timeframe)
@@ -293,10 +177,7 @@ async def geturls(platform,domain, api_token, account_id, database_id, timeframe
 
     start, end = get_time_range(filters[timeframe_index])
 
-    filter_str = f'&statuscode=200&from={start}&to={end}'
-    query_url = query_url + filter_str
     print('start,end',start,end)
-    chunk_size=4000
     website_url=domain.replace('https://','')
     website_url=website_url.replace('www.','')    
 
@@ -304,15 +185,9 @@ async def geturls(platform,domain, api_token, account_id, database_id, timeframe
         'Referer': 'https://web.archive.org/',
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
     }
-    query_url = 'http://web.archive.org/cdx/search/cdx?url=https://www.' + website_url + '*&collapse=urlkey&filter=!statuscode:404&showResumeKey=true&matchType=prefix&from=%s&to=%s&limit=%s&output=json'%(start,end,chunk_size)
-# https://github.com/internetarchive/wayback/blob/master/wayback-cdx-server/README.md
-
-
-    query_url='http://web.archive.org/cdx/search/cdx?url=tiktok.com/tag/&collapse=urlkey&matchType=prefix&from=20241223&to=20241225'
-    query_url='http://web.archive.org/cdx/search/cdx?url=tiktok.com/tag/&collapse=digest&matchType=prefix&from=2024&to=2024&fl=original,timestamp'
-    query_url='http://web.archive.org/cdx/search/cdx?url=tiktok.com/tag/&collapse=urlkey&matchType=prefix&from=2023&to=2023'
-    query_url='http://web.archive.org/cdx/search/cdx?url=tiktok.com/tag/&collapse=urlkey&matchType=prefix&from=2024&to=2024'
-    query_url=query_url+'&fl=timestamp,original'
+    # https://github.com/internetarchive/wayback/blob/master/wayback-cdx-server/README.md
+    query = hashtag_scan(website_url).collapse('urlkey').between(start, end)
+    query_url = f"{CDX_API_URL}?{query.query_string()}"
     print('build query url',query_url,website_url)
     async with aiohttp.ClientSession() as session:
         try:
@@ -328,8 +203,9 @@ async def geturls(platform,domain, api_token, account_id, database_id, timeframe
                 os.makedirs('./result', exist_ok=True)
                 
                 print(f"\nProcessing {len(lines)} URLs...")
-                total_processed = 0
-                total_skipped = 0
+                current_time = datetime.datetime.utcnow().isoformat()
+                writer = BatchedD1Writer(d1, f'wayback_{platform}_hashtag_data', ['tag', 'url', 'date', 'updateAt'])
+                await writer.load_known_keys('tag')
 
                 for line in lines:
                     if ' ' in line:
@@ -352,37 +228,26 @@ async def geturls(platform,domain, api_token, account_id, database_id, timeframe
                                 print('keep params clean',url)
                                 
                             data = {
-                                "url": url,
-                                "date": parts[0]
+                                "tag": url,
+                                "url": parts[1],
+                                "date": parts[0],
+                                "updateAt": current_time
                             }
-                            await write_to_cloudflare_d1(platform,session, data, api_token, account_id, database_id)
-                            
-                            # url_exists = await check_tag_exists(platform,session, data['url'], api_token, account_id, database_id)
-                            # if url_exists:
-                                # total_skipped += 1
-                            # else:
-                                # await write_to_cloudflare_d1(session, data, api_token, account_id, database_id)
-                                # total_processed += 1
+                            await writer.add(data)
+
+                await writer.close()
 
                 print(f"\n✓ Processing complete:")
                 print(f"  - Total URLs found: {len(lines)}")
-                print(f"  - URLs processed: {total_processed}")
-                print(f"  - URLs skipped (already exist): {total_skipped}")
+                print(f"  - URLs processed: {writer.rows_inserted}")
+                print(f"  - URLs skipped (already exist): {writer.rows_known + writer.rows_ignored}")
 
         except Exception as e:
             print(f"✗ Error: {str(e)}")
 
-async def create_table(platform,api_token, account_id, database_id):
+async def create_table(platform,d1):
     """Create the wayback_data table if it doesn't exist"""
-    url = f"https://api.cloudflare.com/client/v4/accounts/{account_id}/d1/database/{database_id}/query"
-    
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_token}"
-    }
-    
-    payload = {
-        "sql": f"""
+    sql = f"""
         CREATE TABLE IF NOT EXISTS wayback_{platform}_hashtag_data (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             tag TEXT NOT NULL UNIQUE,
@@ -391,18 +256,12 @@ async def create_table(platform,api_token, account_id, database_id):
             updateAt TEXT NOT NULL
         )
         """
-    }
     
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers, json=payload) as response:
-                if response.status == 200:
-                    print("✓ Table created/verified successfully")
-                else:
-                    error_text = await response.text()
-                    print(f"✗ Failed to create table: {error_text}")
-    except Exception as e:
-        print(f"✗ Error creating table: {str(e)}")
+    results = await d1.query(sql)
+    if results is not None:
+        print("✓ Table created/verified successfully")
+    else:
+        print("✗ Failed to create table")
 
 async def main():
     # Check environment variables
@@ -412,11 +271,13 @@ async def main():
     print(f"Current time (UTC): {datetime.datetime.utcnow().isoformat()}")
     
     # Test Cloudflare connection
-    if not await test_cloudflare_connection(
+    d1 = D1Client(
         env_vars['CLOUDFLARE_API_TOKEN'],
         env_vars['CLOUDFLARE_ACCOUNT_ID'],
         env_vars['CLOUDFLARE_D1_DATABASE_ID']
-    ):
+    )
+    if not await test_cloudflare_connection(d1):
+        await d1.close()
         sys.exit(1)
 
 
@@ -495,22 +356,18 @@ async def main():
             if platform!=domain:
                 continue
             
-            await create_table(platform,
-        env_vars['CLOUDFLARE_API_TOKEN'],
-        env_vars['CLOUDFLARE_ACCOUNT_ID'],
-        env_vars['CLOUDFLARE_D1_DATABASE_ID']
-    )
+            await create_table(platform, d1)
 
 
             await geturls_py(
         # env_vars['DOMAIN'],
           platform,
           url,
-        env_vars['CLOUDFLARE_API_TOKEN'],
-        env_vars['CLOUDFLARE_ACCOUNT_ID'],
-        env_vars['CLOUDFLARE_D1_DATABASE_ID'],
+        d1,
         env_vars['TIME_FRAME']
     )
 
+    await d1.close()
+
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,39 @@
+from cdx_query import hashtag_of, seller_scan
+
+
+def test_path_style_prefix():
+    assert hashtag_of('https://www.tiktok.com/tag/funny', 'tiktok.com/tag/') == 'funny'
+    assert hashtag_of('https://www.tiktok.com/tag/funny/video?lang=en', 'tiktok.com/tag/') == 'funny'
+    assert hashtag_of('https://www.instagram.com/explore/tags/cats/', 'instagram.com/explore/tags/') == 'cats'
+
+
+def test_encoded_path_style_prefix():
+    assert hashtag_of('https://www.tumblr.com/search/%23art', 'tumblr.com/search/%23') == 'art'
+
+
+def test_search_style_prefix():
+    assert hashtag_of('https://www.reddit.com/search/?q=%23python', 'reddit.com/search/?q=%23') == 'python'
+
+
+def test_search_style_prefix_without_slash():
+    assert hashtag_of('https://twitter.com/search?q=%23news&src=hashtag_click', 'twitter.com/search?q=%23') == 'news'
+
+
+def test_nested_search_style_prefix():
+    assert hashtag_of('https://www.pinterest.com/search/pins/?q=%23decor', 'pinterest.com/search/pins/?q=%23') == 'decor'
+
+
+def test_no_hashtag():
+    assert hashtag_of('https://www.reddit.com/search/', 'reddit.com/search/?q=%23') is None
+    assert hashtag_of('https://www.tiktok.com/tag/', 'tiktok.com/tag/') is None
+
+
+def test_seller_scan_query_prefix():
+    query = seller_scan('https://www.amazon.com/sp?ie=UTF8&seller=')
+    assert query.query_string() == ('url=https%3A%2F%2Fwww.amazon.com%2Fsp%3Fie%3DUTF8%26seller%3D&matchType=prefix'
+                                    '&filter=statuscode%3A200&collapse=urlkey&fl=timestamp%2Coriginal')
+
+
+def test_seller_scan_bare_host():
+    assert seller_scan('https://www.amazon.com').url == 'https://www.amazon.com/'
+    assert seller_scan('https://www.amazon.com/').url == 'https://www.amazon.com/'
@@ -0,0 +1,67 @@
+import asyncio
+import sqlite3
+
+from d1_writer import BatchedD1Writer
+
+
+class SQLiteClient:
+    """Just enough of D1Client to run the writer against an in-memory database"""
+
+    def __init__(self):
+        self.db = sqlite3.connect(':memory:')
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("CREATE TABLE pages (id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT NOT NULL UNIQUE, "
+                        "date TEXT NOT NULL, updateAt TEXT NOT NULL)")
+
+    async def query(self, sql, params=None):
+        before = self.db.total_changes
+        rows = [dict(row) for row in self.db.execute(sql, params or [])]
+        return [{'results': rows, 'meta': {'changes': self.db.total_changes - before}}]
+
+    async def batch(self, statements):
+        return [(await self.query(statement['sql'], statement['params']))[0] for statement in statements]
+
+    def dates(self):
+        return dict(self.db.execute("SELECT url, date FROM pages").fetchall())
+
+
+def write(client, rows, **kwargs):
+    async def run():
+        writer = BatchedD1Writer(client, 'pages', ['url', 'date', 'updateAt'], **kwargs)
+        await writer.load_known_keys('url')
+        for url, date in rows:
+            await writer.add({'url': url, 'date': date, 'updateAt': 'now'})
+        await writer.close()
+        return writer
+    return asyncio.run(run())
+
+
+def test_known_keys_are_skipped():
+    client = SQLiteClient()
+    write(client, [('a', '2023')])
+    writer = write(client, [('a', '2021'), ('b', '2022')])
+    assert client.dates() == {'a': '2023', 'b': '2022'}
+    assert (writer.rows_inserted, writer.rows_known) == (1, 1)
+
+
+def test_min_column_keeps_earliest_within_a_run():
+    client = SQLiteClient()
+    writer = write(client, [('a', '2023'), ('a', '2021'), ('a', '2024')], min_column='date', batch_size=2)
+    assert client.dates() == {'a': '2021'}
+    assert (writer.rows_inserted, writer.rows_lowered, writer.rows_known) == (1, 1, 1)
+
+
+def test_min_column_lowers_preloaded_key():
+    client = SQLiteClient()
+    write(client, [('a', '2023'), ('b', '2020')])
+    writer = write(client, [('a', '2021'), ('b', '2022')], min_column='date')
+    assert client.dates() == {'a': '2021', 'b': '2020'}
+    assert (writer.rows_inserted, writer.rows_lowered, writer.rows_known) == (0, 1, 1)
+
+
+def test_min_column_counts_without_batch_endpoint():
+    client = SQLiteClient()
+    write(client, [('a', '2023')])
+    writer = write(client, [('a', '2021'), ('c', '2022')], min_column='date', use_batch_endpoint=False)
+    assert client.dates() == {'a': '2021', 'c': '2022'}
+    assert (writer.rows_inserted, writer.rows_lowered, writer.rows_ignored) == (1, 1, 0)
@@ -0,0 +1,41 @@
+import os
+
+from http_cache import ResponseCache
+
+
+def make_cache(tmp_path, **kwargs):
+    return ResponseCache(directory=str(tmp_path), **kwargs)
+
+
+def test_round_trip(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.put('https://web.archive.org/cdx/search/cdx', b'20240101 https://example.com/', {'url': 'example.com'})
+    assert cache.get('https://web.archive.org/cdx/search/cdx', {'url': 'example.com'}) == b'20240101 https://example.com/'
+
+
+def test_corrupt_blob_is_a_miss(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.put('https://index.commoncrawl.org/a', b'x' * 1000)
+    blob, = cache.db.execute("SELECT blob FROM entries").fetchone()
+    with open(cache._blob_path(blob), 'r+b') as f:
+        f.truncate(5)
+    assert cache.get('https://index.commoncrawl.org/a') is None
+    assert cache.db.execute("SELECT COUNT(*) FROM entries").fetchone()[0] == 0
+
+
+def test_eviction_counts_shared_blobs_once(tmp_path):
+    cache = make_cache(tmp_path, max_bytes=10 ** 9)
+    bodies = [os.urandom(2000) for _ in range(4)]
+    for i, body in enumerate(bodies):
+        cache.put(f'https://index.commoncrawl.org/{i}', body)
+    # A second query with the same body as the newest entry shares its blob
+    cache.put('https://index.commoncrawl.org/copy', bodies[3])
+    for i, key in enumerate(['0', '1', '2', '3', 'copy']):
+        cache.db.execute("UPDATE entries SET last_access = ? WHERE url LIKE ?", (i, f'%/{key}?%'))
+    blob_size = cache.size() // 4
+    cache.max_bytes = blob_size * 2
+    cache._evict()
+    assert cache.size() <= cache.max_bytes
+    assert cache.evictions == 2
+    assert cache.get('https://index.commoncrawl.org/3') == bodies[3]
+    assert cache.get('https://index.commoncrawl.org/copy') == bodies[3]
@@ -0,0 +1,62 @@
+import os
+import datetime
+
+# Set BACKFILL=1 to ignore the stored marks and query the full TIME_FRAME window
+BACKFILL = os.getenv('BACKFILL', '').lower() in ('1', 'true', 'yes')
+WATERMARK_TABLE = os.getenv('WATERMARK_TABLE', 'crawl_watermarks')
+
+
+class Watermarks:
+    """Newest capture timestamp ingested per platform and prefix, kept in D1 so every workflow run sees it"""
+
+    def __init__(self, d1, table=WATERMARK_TABLE, backfill=BACKFILL):
+        self.d1 = d1
+        self.table = table
+        self.backfill = backfill
+
+    async def create_table(self):
+        sql = f"""
+        CREATE TABLE IF NOT EXISTS {self.table} (
+            platform TEXT NOT NULL,
+            prefix TEXT NOT NULL,
+            last_seen TEXT NOT NULL,
+            updateAt TEXT NOT NULL,
+            PRIMARY KEY (platform, prefix)
+        )
+        """
+        return await self.d1.query(sql) is not None
+
+    async def get(self, platform, prefix):
+        rows = await self.d1.rows(
+            f"SELECT last_seen FROM {self.table} WHERE platform = ? AND prefix = ?", [platform, prefix]
+        )
+        return rows[0]['last_seen'] if rows else None
+
+    async def window(self, platform, prefix, start, end):
+        """CDX from/to for this run: from the last capture seen, or the full window on a first run or backfill"""
+        await self.create_table()
+        last_seen = None if self.backfill else await self.get(platform, prefix)
+        if last_seen is None:
+            mode = 'backfill requested' if self.backfill else 'no high-water mark yet'
+            print(f"✓ {platform} {prefix}: {mode}, querying {start} to {end}")
+            return start, end
+        # from= is inclusive, so the newest capture comes back once and is dropped as a known key
+        print(f"✓ {platform} {prefix}: only captures since high-water mark {last_seen}")
+        return last_seen, end
+
+    async def advance(self, platform, prefix, last_seen):
+        """Record the newest capture timestamp ingested; never moves the mark backwards"""
+        if not last_seen:
+            return
+        current_time = datetime.datetime.utcnow().isoformat()
+        rows = await self.d1.rows(
+            f"""
+            INSERT INTO {self.table} (platform, prefix, last_seen, updateAt) VALUES (?, ?, ?, ?)
+            ON CONFLICT (platform, prefix) DO UPDATE
+            SET last_seen = MAX({self.table}.last_seen, excluded.last_seen), updateAt = excluded.updateAt
+            RETURNING last_seen
+            """,
+            [platform, prefix, last_seen, current_time]
+        )
+        if rows:
+            print(f"✓ High-water mark of {platform} {prefix} is now {rows[0]['last_seen']}")